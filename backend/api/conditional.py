@@ -0,0 +1,86 @@
+import hashlib
+import time
+from email.utils import formatdate
+from typing import Any, Hashable, Optional
+
+from core import settings
+from fastapi.responses import Response
+from social import codec
+from social.cache import LRUCache, response_cache
+
+
+class Representation:
+
+    __slots__ = ('content', 'etag', 'body', 'last_modified', 'seen_at')
+
+    def __init__(
+        self, content: Any, etag: str, body: bytes, last_modified: float,
+        seen_at: float,
+    ):
+        self.content = content
+        self.etag = etag
+        self.body = body
+        self.last_modified = last_modified
+        self.seen_at = seen_at
+
+
+representations = LRUCache(settings.CACHE_MAX_SIZE)
+
+
+def etag(body: bytes) -> str:
+    return '"{}"'.format(hashlib.blake2b(body, digest_size=16).hexdigest())
+
+
+def matches(if_none_match: Optional[str], tag: str) -> bool:
+    # If-None-Match uses the weak comparison, W/ prefixes do not matter
+    if not if_none_match:
+        return False
+    tags = [x.strip() for x in if_none_match.split(',')]
+    return '*' in tags or any(
+        (x[2:] if x.startswith('W/') else x) == tag for x in tags
+    )
+
+
+def _represent(key: Hashable, content: Any, ttl: float) -> Representation:
+
+    # results served from the response cache are the very same objects,
+    # so their body and hash are reused instead of serialized again
+    found, entry = representations.get(key)
+    if found and entry.content is content:
+        return entry
+
+    body = codec.dumps(content)
+    tag = etag(body)
+    now = time.time()
+    if found and entry.etag == tag:
+        now = entry.last_modified
+    entry = Representation(content, tag, body, now, time.monotonic())
+    if ttl > 0:
+        representations.set(key, entry, ttl + settings.CACHE_STALE_GRACE)
+    return entry
+
+
+def conditional_response(
+    operation: str, key: Hashable, content: Any,
+    if_none_match: Optional[str],
+) -> Response:
+
+    ttl = response_cache.ttls.get(operation, 0)
+    entry = _represent((operation, key), content, ttl)
+
+    if ttl > 0:
+        age = time.monotonic() - entry.seen_at
+        cache_control = 'max-age={}'.format(max(0, int(ttl - age)))
+    else:
+        cache_control = 'no-cache'
+    headers = {
+        'ETag': entry.etag,
+        'Cache-Control': cache_control,
+        'Last-Modified': formatdate(entry.last_modified, usegmt=True),
+    }
+
+    if matches(if_none_match, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(
+        content=entry.body, media_type='application/json', headers=headers
+    )
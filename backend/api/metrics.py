@@ -0,0 +1,72 @@
+import time
+from typing import Callable, Dict
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from social.metrics import (collect, http_in_flight, http_requests,
+                            http_response_size)
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+router = APIRouter()
+
+_routes: Dict[Callable, str] = {}
+
+
+def route_path(scope: Scope) -> str:
+
+    # the router leaves the matched endpoint in the scope, labels use
+    # its path template so user IDs do not blow up the cardinality
+    endpoint = scope.get('endpoint')
+    if endpoint is None:
+        return 'unmatched'
+    if endpoint not in _routes:
+        for route in scope['router'].routes:
+            if getattr(route, 'endpoint', None) is endpoint:
+                _routes[endpoint] = route.path
+                break
+        else:
+            _routes[endpoint] = endpoint.__name__
+    return _routes[endpoint]
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(
+        collect(), media_type='text/plain; version=0.0.4'
+    )
+
+
+class MetricsMiddleware:
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.monotonic()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.dec()
+            route = route_path(scope)
+            http_requests.observe(
+                time.monotonic() - started_at, route, scope['method'],
+                str(status)
+            )
+            http_response_size.observe(size, route)
@@ -0,0 +1,56 @@
+import re
+from typing import Optional, Tuple
+
+from social.tracing import current_trace_id, tracer
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import route_path
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+
+def _parse_traceparent(
+    scope: Scope
+) -> Tuple[Optional[str], Optional[str], Optional[bool]]:
+
+    # W3C trace context: continue the caller's trace and its sampling
+    for name, value in scope['headers']:
+        if name == b'traceparent':
+            match = TRACEPARENT.match(value.decode('latin-1').strip())
+            if match:
+                trace_id, parent_id, flags = match.groups()
+                return trace_id, parent_id, bool(int(flags, 16) & 1)
+    return None, None, None
+
+
+class TracingMiddleware:
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        trace_id, parent_id, sampled = _parse_traceparent(scope)
+        with tracer.start_trace(
+            scope['method'], trace_id, parent_id, sampled
+        ) as span:
+            header = (b'x-trace-id', current_trace_id().encode())
+
+            async def send_wrapper(message: Message) -> None:
+                if message['type'] == 'http.response.start':
+                    message['headers'] = [
+                        *message.get('headers', []), header
+                    ]
+                    span.set(status=message['status'])
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = route_path(scope)
+                span.rename('{} {}'.format(scope['method'], route))
+                span.set(route=route, path=scope['path'])
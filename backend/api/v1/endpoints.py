@@ -1,78 +1,409 @@
-from typing import List, Optional
+import itertools
+import math
+from typing import Any, AsyncIterator, List, Optional, Union
 
-from fastapi import APIRouter, HTTPException
+from core import settings
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.logger import logger
+from fastapi.responses import Response, StreamingResponse
+from social import codec
 from social import base as social_api
-from social.exceptions import SocialException, UserDoesNotExist
+from social.constants import BUNDLE_SECTIONS
+from social.exceptions import (DeadlineExceeded, RateLimitExceeded,
+                               SocialException, SourceUnavailable,
+                               UserDoesNotExist, WrongCursor)
+from social.models import UsersPage
+from social.resilience import set_deadline
+from social.snapshots import set_max_age
 
-from .schemas import Article, Source, User
+from ..conditional import conditional_response
+from .schemas import (Article, FeedRequest, Source, User, UserBundle,
+                      UsersBatchRequest, UsersBatchResponse)
 
-api_router = APIRouter()
+
+def _json(content: Any) -> Response:
+    # a ready Response skips FastAPI's second pass over `response_model`,
+    # the models were built by the clients already
+    return Response(
+        content=codec.dumps(content), media_type='application/json'
+    )
+
+
+async def request_deadline(x_request_timeout: Optional[float] = Header(None)):
+    # callers may only shorten the deadline, never extend it
+    timeout = settings.REQUEST_DEADLINE
+    if x_request_timeout is not None and x_request_timeout > 0:
+        timeout = min(timeout, x_request_timeout)
+    set_deadline(timeout)
+
+
+api_router = APIRouter(dependencies=[Depends(request_deadline)])
+
+# feed lines are sent in chunks rather than one write per article
+FEED_CHUNK_SIZE = 100
+
+
+def _source(source: Optional[Source]) -> Optional[str]:
+    return source.value if source is not None else None
+
+
+def _retry_later(
+    status_code: int, e: Union[RateLimitExceeded, SourceUnavailable]
+) -> HTTPException:
+    headers = None
+    if e.retry_after is not None:
+        headers = {'Retry-After': str(math.ceil(e.retry_after))}
+    return HTTPException(status_code=status_code, headers=headers)
 
 
 @api_router.get(
-    "/user/{user_id}", response_model=User, responses={404: {}, 500: {}}
+    "/user/{user_id}", response_model=User,
+    responses={404: {}, 429: {}, 500: {}, 503: {}, 504: {}}
 )
-def get_user(user_id: str, source: Optional[Source] = None):
+async def get_user(
+    user_id: str, source: Optional[Source] = None,
+    max_age: Optional[float] = None,
+    if_none_match: Optional[str] = Header(None),
+):
 
+    set_max_age(max_age)
     try:
-        user = social_api.get_user(user_id, source)
+        user = await social_api.get_user(user_id, source)
     except UserDoesNotExist:
         raise HTTPException(status_code=404)
+    except RateLimitExceeded as e:
+        raise _retry_later(429, e)
+    except SourceUnavailable as e:
+        raise _retry_later(503, e)
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504)
+    except SocialException:
+        raise HTTPException(status_code=500)
+
+    return conditional_response(
+        'get_user', (user_id, _source(source), None), user, if_none_match
+    )
+
+
+@api_router.post(
+    "/users:batch", response_model=UsersBatchResponse,
+    responses={429: {}, 500: {}, 503: {}, 504: {}}
+)
+async def get_users(request: UsersBatchRequest):
+
+    try:
+        users = await social_api.get_users(request.user_ids, request.source)
+    except RateLimitExceeded as e:
+        raise _retry_later(429, e)
+    except SourceUnavailable as e:
+        raise _retry_later(503, e)
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504)
     except SocialException:
         raise HTTPException(status_code=500)
 
-    return user.dict()
+    return _json({
+        'users': [
+            {
+                'user_id': user_id,
+                'status': _user_status(user),
+                'user': None if isinstance(user, Exception) else user,
+            }
+            for user_id, user in users.items()
+        ]
+    })
 
 
 @api_router.get(
     "/user/{user_id}/article", response_model=List[Article],
-    responses={404: {}, 500: {}}
+    responses={404: {}, 429: {}, 500: {}, 503: {}, 504: {}}
 )
-def get_articles(
-    user_id: str, source: Optional[Source] = None, count: int = 10
+async def get_articles(
+    user_id: str, source: Optional[Source] = None, count: int = 10,
+    since_id: Optional[int] = None, max_id: Optional[int] = None,
+    max_age: Optional[float] = None,
+    if_none_match: Optional[str] = Header(None),
 ):
 
+    set_max_age(max_age)
     try:
-        articles = social_api.get_articles(user_id, count, source)
+        articles = await social_api.get_articles(
+            user_id, count, source, since_id, max_id
+        )
     except UserDoesNotExist:
         raise HTTPException(status_code=404)
+    except RateLimitExceeded as e:
+        raise _retry_later(429, e)
+    except SourceUnavailable as e:
+        raise _retry_later(503, e)
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504)
     except SocialException:
         raise HTTPException(status_code=500)
 
-    return list(map(lambda x: x.dict(), articles))
+    return conditional_response(
+        'get_articles', (user_id, _source(source), count, since_id, max_id),
+        articles, if_none_match,
+    )
 
 
 @api_router.get(
     "/user/{user_id}/friend", response_model=List[User],
-    responses={404: {}, 500: {}}
+    responses={404: {}, 429: {}, 500: {}, 503: {}, 504: {}}
 )
-def get_friends(
-    user_id: str, source: Optional[Source] = None, count: int = 10
+async def get_friends(
+    user_id: str, source: Optional[Source] = None, count: int = 10,
+    max_age: Optional[float] = None,
+    if_none_match: Optional[str] = Header(None),
 ):
 
+    set_max_age(max_age)
     try:
-        users = social_api.get_friends(user_id, count, source)
+        users = await social_api.get_friends(user_id, count, source)
     except UserDoesNotExist:
         raise HTTPException(status_code=404)
+    except RateLimitExceeded as e:
+        raise _retry_later(429, e)
+    except SourceUnavailable as e:
+        raise _retry_later(503, e)
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504)
     except SocialException:
         raise HTTPException(status_code=500)
 
-    return list(map(lambda x: x.dict(), users))
+    return conditional_response(
+        'get_friends', (user_id, _source(source), count), users,
+        if_none_match,
+    )
 
 
 @api_router.get(
     "/user/{user_id}/follower", response_model=List[User],
-    responses={404: {}, 500: {}}
+    responses={404: {}, 429: {}, 500: {}, 503: {}, 504: {}}
+)
+async def get_followers(
+    user_id: str, source: Optional[Source] = None, count: int = 10,
+    max_age: Optional[float] = None,
+    if_none_match: Optional[str] = Header(None),
+):
+
+    set_max_age(max_age)
+    try:
+        users = await social_api.get_followers(user_id, count, source)
+    except UserDoesNotExist:
+        raise HTTPException(status_code=404)
+    except RateLimitExceeded as e:
+        raise _retry_later(429, e)
+    except SourceUnavailable as e:
+        raise _retry_later(503, e)
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504)
+    except SocialException:
+        raise HTTPException(status_code=500)
+
+    return conditional_response(
+        'get_followers', (user_id, _source(source), count), users,
+        if_none_match,
+    )
+
+
+@api_router.get(
+    "/user/{user_id}/friend/mutual/{other_id}", response_model=List[User],
+    responses={404: {}}
+)
+async def get_mutual_friends(
+    user_id: str, other_id: str, source: Optional[Source] = None
+):
+
+    # served from the snapshot store only, 404 until both friend lists
+    # have been fetched through /friend
+    try:
+        users = await social_api.get_mutual_friends(
+            user_id, other_id, source
+        )
+    except UserDoesNotExist:
+        raise HTTPException(status_code=404)
+
+    return _json(users)
+
+
+def _user_status(user: Any) -> int:
+    # a source that failed leaves its IDs unresolved, not missing
+    if user is None:
+        return 404
+    elif isinstance(user, Exception):
+        return _status_code(user)
+    return 200
+
+
+def _status_code(e: Exception) -> int:
+    if isinstance(e, UserDoesNotExist):
+        return 404
+    elif isinstance(e, RateLimitExceeded):
+        return 429
+    elif isinstance(e, SourceUnavailable):
+        return 503
+    elif isinstance(e, DeadlineExceeded):
+        return 504
+    return 500
+
+
+@api_router.get(
+    "/user/{user_id}/bundle", response_model=UserBundle,
+    responses={400: {}, 404: {}, 429: {}, 500: {}, 503: {}, 504: {}}
 )
-def get_followers(
-    user_id: str, source: Optional[Source] = None, count: int = 10
+async def get_bundle(
+    user_id: str, source: Optional[Source] = None,
+    include: str = ','.join(BUNDLE_SECTIONS), count: int = 10
 ):
 
+    sections = [x for x in include.split(',') if x]
+    if any(x not in BUNDLE_SECTIONS for x in sections):
+        raise HTTPException(status_code=400)
+
+    try:
+        bundle = await social_api.get_bundle(
+            user_id, sections, count, source
+        )
+    except UserDoesNotExist:
+        raise HTTPException(status_code=404)
+    except RateLimitExceeded as e:
+        raise _retry_later(429, e)
+    except SourceUnavailable as e:
+        raise _retry_later(503, e)
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504)
+    except SocialException:
+        raise HTTPException(status_code=500)
+
+    # sections fail one by one, each carries the status its standalone
+    # endpoint would have answered with
+    result = {'user': bundle.pop('user'), **dict.fromkeys(BUNDLE_SECTIONS)}
+    for section, value in bundle.items():
+        if isinstance(value, Exception):
+            result[section] = {'status': _status_code(value), 'items': None}
+        else:
+            result[section] = {'status': 200, 'items': value}
+    return _json(result)
+
+
+@api_router.post(
+    "/feed",
+    description=(
+        "Articles of all accounts merged newest first, as ndjson. The "
+        "order is only known once every timeline is in, so the first line "
+        "is sent after all accounts have been fetched or timed out; only "
+        "serialization is streamed. Failed accounts follow as status lines."
+    ),
+)
+async def get_feed(request: FeedRequest):
+
+    results = await social_api.get_timelines(
+        [(x.source, x.user_id) for x in request.accounts], request.count
+    )
+    items = itertools.islice(social_api.merge_feed(results), request.limit)
+
+    async def lines():
+        # newest first across all accounts, then one line per account
+        # that failed with the status its own endpoint would answer
+        while True:
+            chunk = [
+                codec.dumps({
+                    'source': resource_type,
+                    'user_id': user_id,
+                    'article': article,
+                }) + b'\n'
+                for resource_type, user_id, article in itertools.islice(
+                    items, FEED_CHUNK_SIZE
+                )
+            ]
+            if not chunk:
+                break
+            yield b''.join(chunk)
+        for (resource_type, user_id), result in results.items():
+            if isinstance(result, Exception):
+                yield codec.dumps({
+                    'source': resource_type,
+                    'user_id': user_id,
+                    'status': _status_code(result),
+                }) + b'\n'
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+
+async def _stream_pages(pages: AsyncIterator[UsersPage]) -> StreamingResponse:
+
+    # errors are only reported with a status code while nothing has been
+    # sent yet, so the first page is awaited before the response starts
     try:
-        users = social_api.get_followers(user_id, count, source)
+        first_page = await pages.__anext__()
+    except StopAsyncIteration:
+        first_page = None
     except UserDoesNotExist:
         raise HTTPException(status_code=404)
+    except WrongCursor:
+        raise HTTPException(status_code=400)
+    except RateLimitExceeded as e:
+        raise _retry_later(429, e)
+    except SourceUnavailable as e:
+        raise _retry_later(503, e)
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504)
     except SocialException:
         raise HTTPException(status_code=500)
 
-    return list(map(lambda x: x.dict(), users))
+    async def lines():
+        if first_page is None:
+            return
+        yield codec.dumps(first_page) + b'\n'
+        next_cursor = first_page.next_cursor
+        try:
+            async for page in pages:
+                yield codec.dumps(page) + b'\n'
+                next_cursor = page.next_cursor
+        except SocialException as e:
+            logger.warning("_stream_pages(), e = {}".format(repr(e)))
+            # the status is sent, so a failure mid-stream ends it with a
+            # line of its own: the list is cut short, resume from here
+            yield codec.dumps({
+                'status': _status_code(e),
+                'next_cursor': next_cursor,
+            }) + b'\n'
+
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+
+@api_router.get(
+    "/user/{user_id}/friend/stream",
+    responses={400: {}, 404: {}, 429: {}, 500: {}, 503: {}, 504: {}}
+)
+async def stream_friends(
+    user_id: str, source: Optional[Source] = None,
+    cursor: Optional[str] = None, count: Optional[int] = None
+):
+    return await _stream_pages(
+        social_api.iter_friends(user_id, source, cursor, count)
+    )
+
+
+@api_router.get(
+    "/user/{user_id}/follower/stream",
+    responses={400: {}, 404: {}, 429: {}, 500: {}, 503: {}, 504: {}}
+)
+async def stream_followers(
+    user_id: str, source: Optional[Source] = None,
+    cursor: Optional[str] = None, count: Optional[int] = None
+):
+    return await _stream_pages(
+        social_api.iter_followers(user_id, source, cursor, count)
+    )
+
+
+@api_router.get("/health")
+async def get_health():
+    return social_api.get_health()
+
+
+@api_router.get("/stats")
+async def get_stats():
+    return social_api.get_stats()
@@ -1,8 +1,61 @@
 from enum import Enum
+from typing import List, Optional
+
+from core import settings
+from pydantic import BaseModel, conint, conlist
 from social.models import User, Article
-from social.constants import RESOURCE_TYPE_VK, RESOURCE_TYPE_TWITTER
+from social.constants import (FEED_MAX_COUNT, RESOURCE_TYPE_TWITTER,
+                              RESOURCE_TYPE_VK)
 
 
 class Source(str, Enum):
     VKONTAKTE = RESOURCE_TYPE_VK
     TWITTER = RESOURCE_TYPE_TWITTER
+
+
+class UsersBatchRequest(BaseModel):
+    user_ids: conlist(
+        str, min_items=1, max_items=settings.BATCH_MAX_USER_IDS
+    )
+    source: Optional[Source] = None
+
+
+class FeedAccount(BaseModel):
+    source: Source
+    user_id: str
+
+
+class FeedRequest(BaseModel):
+    accounts: conlist(
+        FeedAccount, min_items=1, max_items=settings.FEED_MAX_ACCOUNTS
+    )
+    count: conint(ge=1, le=FEED_MAX_COUNT) = 10
+    # cuts the merged feed, every account still gets `count` articles
+    limit: Optional[conint(ge=0)] = None
+
+
+class UserResult(BaseModel):
+    user_id: str
+    status: int
+    user: Optional[User] = None
+
+
+class UsersBatchResponse(BaseModel):
+    users: List[UserResult]
+
+
+class ArticlesSection(BaseModel):
+    status: int
+    items: Optional[List[Article]] = None
+
+
+class UsersSection(BaseModel):
+    status: int
+    items: Optional[List[User]] = None
+
+
+class UserBundle(BaseModel):
+    user: User
+    articles: Optional[ArticlesSection] = None
+    friends: Optional[UsersSection] = None
+    followers: Optional[UsersSection] = None
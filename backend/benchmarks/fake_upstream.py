@@ -0,0 +1,285 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+# user IDs starting with this prefix do not exist on either source
+MISSING_PREFIX = 'missing'
+# post N of a user is published N * POST_INTERVAL seconds after this
+EPOCH = 1600000000
+POST_INTERVAL = 600
+
+EXECUTE_CALL = re.compile(r'"(\w+)":API\.([\w.]+)\((\{.*?\})\)')
+
+
+class Config:
+
+    def __init__(
+        self,
+        latency_ms: float = 50.0,
+        latency_sigma: float = 0.5,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        friends_count: int = 1000,
+        posts_count: int = 1000,
+        seed: Optional[int] = None,
+    ):
+        # latencies are log-normal around the median, like real APIs with
+        # their long tails
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.friends_count = friends_count
+        # posts are numbered 1..posts_count and listed newest first
+        self.posts_count = posts_count
+        self.random = random.Random(seed)
+
+    def latency(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        return self.random.lognormvariate(0, self.latency_sigma) * (
+            self.latency_ms / 1000
+        )
+
+    def outcome(self) -> str:
+        x = self.random.random()
+        if x < self.rate_limit_rate:
+            return 'rate_limit'
+        if x < self.rate_limit_rate + self.error_rate:
+            return 'error'
+        return 'ok'
+
+
+def _number(user_id: str) -> int:
+    if user_id.isdigit():
+        return int(user_id)
+    return zlib.crc32(user_id.encode()) % 10 ** 8 + 1
+
+
+def _exists(user_id: str) -> bool:
+    return not str(user_id).startswith(MISSING_PREFIX)
+
+
+def vk_user(user_id: str) -> dict:
+    number = _number(user_id)
+    return {
+        'id': number,
+        'first_name': 'User',
+        'last_name': str(number),
+        'screen_name': user_id if not user_id.isdigit() else
+        'id{}'.format(number),
+        'photo': 'https://vk.com/images/camera_50.png',
+        'followers_count': number % 1000,
+        'common_count': number % 10,
+    }
+
+
+def vk_post(number: int) -> dict:
+    return {
+        'id': number,
+        'text': 'Post {}'.format(number),
+        'likes': {'count': number % 100},
+        'comments': {'count': number % 10},
+        'reposts': {'count': number % 5},
+        'date': EPOCH + number * POST_INTERVAL,
+    }
+
+
+def twitter_user(user_id: str) -> dict:
+    number = _number(user_id)
+    return {
+        'id': number,
+        'screen_name': user_id if not user_id.isdigit() else
+        'user{}'.format(number),
+        'name': 'User {}'.format(number),
+        'followers_count': number % 1000,
+        'friends_count': number % 100,
+        'profile_image_url': 'http://pbs.twimg.com/profile_images/1.png',
+        'description': '',
+    }
+
+
+def twitter_status(number: int) -> dict:
+    return {
+        'id': number,
+        'text': 'Tweet {}'.format(number),
+        'favorite_count': number % 100,
+        'retweet_count': number % 10,
+        'created_at': datetime.fromtimestamp(
+            EPOCH + number * POST_INTERVAL, timezone.utc
+        ).strftime('%a %b %d %H:%M:%S %z %Y'),
+    }
+
+
+class VKError(Exception):
+
+    def __init__(self, code: int):
+        self.code = code
+
+
+def _vk_method(config: Config, method: str, params: Dict[str, Any]) -> Any:
+
+    if method == 'users.get':
+        user_ids = str(params.get('user_ids', '')).split(',')
+        users = [vk_user(x) for x in user_ids if x and _exists(x)]
+        if not users:
+            raise VKError(113)
+        return users
+
+    user_id = str(params.get('owner_id') or params.get('user_id') or '')
+    if not _exists(user_id):
+        raise VKError(113 if method != 'wall.get' else 30)
+
+    count = int(params.get('count', 10))
+    offset = int(params.get('offset', 0))
+    if method == 'wall.get':
+        newest = config.posts_count - offset
+        return {
+            'count': config.posts_count,
+            'items': [
+                vk_post(i) for i in range(newest, max(0, newest - count), -1)
+            ],
+        }
+    if method in ('friends.get', 'users.getFollowers'):
+        end = min(config.friends_count, offset + count)
+        return {
+            'count': config.friends_count,
+            'items': [vk_user(str(i + 1)) for i in range(offset, end)],
+        }
+    raise VKError(3)
+
+
+def _vk_execute(config: Config, code: str) -> dict:
+
+    response = {}
+    errors = []
+    for section, method, params in EXECUTE_CALL.findall(code):
+        try:
+            response[section] = _vk_method(config, method, json.loads(params))
+        except VKError as e:
+            response[section] = False
+            errors.append({'method': method, 'error_code': e.code})
+    result = {'response': response}
+    if errors:
+        result['execute_errors'] = errors
+    return result
+
+
+def create_app(config: Config) -> Starlette:
+
+    async def vk(request: Request) -> Response:
+        await asyncio.sleep(config.latency())
+        outcome = config.outcome()
+        if outcome == 'rate_limit':
+            return JSONResponse({'error': {'error_code': 6}})
+        if outcome == 'error':
+            return JSONResponse({'error': {'error_code': 10}})
+
+        method = request.path_params['method']
+        params = dict(request.query_params)
+        if method == 'execute':
+            return JSONResponse(_vk_execute(config, params.get('code', '')))
+        try:
+            response = _vk_method(config, method, params)
+        except VKError as e:
+            return JSONResponse({'error': {'error_code': e.code}})
+        return JSONResponse({'response': response})
+
+    async def twitter(request: Request) -> Response:
+        await asyncio.sleep(config.latency())
+        outcome = config.outcome()
+        if outcome == 'rate_limit':
+            return JSONResponse({'errors': []}, status_code=429, headers={
+                'x-rate-limit-remaining': '0',
+                'x-rate-limit-reset': str(int(time.time()) + 1),
+            })
+        if outcome == 'error':
+            return JSONResponse({'errors': []}, status_code=503)
+
+        endpoint = request.path_params['endpoint']
+        params = request.query_params
+        user_id = params.get('user_id') or params.get('screen_name') or ''
+
+        if endpoint == 'users/lookup.json':
+            user_ids = [
+                x for key in ('user_id', 'screen_name')
+                for x in params.get(key, '').split(',') if x
+            ]
+            users = [twitter_user(x) for x in user_ids if _exists(x)]
+            if not users:
+                return JSONResponse({'errors': []}, status_code=404)
+            return JSONResponse(users)
+
+        if not _exists(user_id):
+            return JSONResponse({'errors': []}, status_code=404)
+
+        count = int(params.get('count', 10))
+        if endpoint == 'statuses/user_timeline.json':
+            newest = min(
+                config.posts_count,
+                int(params.get('max_id', config.posts_count)),
+            )
+            oldest = max(int(params.get('since_id', 0)), newest - count)
+            return JSONResponse([
+                twitter_status(i) for i in range(newest, oldest, -1)
+            ])
+        if endpoint in ('friends/list.json', 'followers/list.json'):
+            cursor = max(0, int(params.get('cursor', -1)))
+            end = min(config.friends_count, cursor + count)
+            return JSONResponse({
+                'users': [
+                    twitter_user(str(i + 1)) for i in range(cursor, end)
+                ],
+                'next_cursor_str': str(end if end < config.friends_count
+                                       else 0),
+            })
+        return JSONResponse({'errors': []}, status_code=404)
+
+    return Starlette(routes=[
+        Route('/method/{method}', vk),
+        Route('/1.1/{endpoint:path}', twitter),
+    ])
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(
+        description='Local stand-in for the VK and Twitter APIs.'
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency-ms', type=float, default=50.0)
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--friends-count', type=int, default=1000)
+    parser.add_argument('--posts-count', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    app = create_app(Config(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        friends_count=args.friends_count,
+        posts_count=args.posts_count,
+        seed=args.seed,
+    ))
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
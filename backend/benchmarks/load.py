@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+SOURCES = ('vkontakte', 'twitter')
+SCENARIOS = ('user', 'articles', 'friends', 'followers', 'users_batch',
+             'bundle')
+CONCURRENCY = (1, 10, 50)
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('fake upstream did not start on port {}'.format(port))
+
+
+def _request(scenario: str, user_id: str, source: str, count: int) -> tuple:
+
+    if scenario == 'users_batch':
+        return 'POST', '/api/v1/users:batch', {
+            'user_ids': [user_id] + [
+                str(int(user_id) + i) for i in range(1, count)
+            ],
+            'source': source,
+        }
+    path = {
+        'user': '/api/v1/user/{}',
+        'articles': '/api/v1/user/{}/article',
+        'friends': '/api/v1/user/{}/friend',
+        'followers': '/api/v1/user/{}/follower',
+        'bundle': '/api/v1/user/{}/bundle',
+    }[scenario].format(user_id)
+    params = '?source={}'.format(source)
+    if scenario != 'user':
+        params += '&count={}'.format(count)
+    return 'GET', path + params, None
+
+
+async def _run_level(
+    client: Any, scenario: str, concurrency: int, requests: int,
+    sources: Sequence[str], users: int, count: int,
+) -> dict:
+
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    queue = iter(range(requests))
+
+    async def worker():
+        for _ in queue:
+            method, url, body = _request(
+                scenario, str(random.randint(1, users)),
+                random.choice(sources), count,
+            )
+            started_at = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - started_at)
+            statuses[response.status_code] = (
+                statuses.get(response.status_code, 0) + 1
+            )
+
+    cpu_started_at = time.process_time()
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+    cpu = time.process_time() - cpu_started_at
+
+    errors = sum(n for status, n in statuses.items() if status >= 500)
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': requests,
+        'throughput': round(requests / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'errors': errors,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+        'cpu_ms_per_request': round(cpu / requests * 1000, 3),
+        # ru_maxrss is in kilobytes on Linux, bytes on macOS
+        'max_rss_mb': round(resource.getrusage(
+            resource.RUSAGE_SELF
+        ).ru_maxrss / (1024 if sys.platform != 'darwin' else 1024 ** 2), 1),
+    }
+
+
+async def _run(args: argparse.Namespace, upstream_url: str) -> List[dict]:
+
+    # settings are read at import time, so the app is imported only once
+    # the environment points it at the fake upstream
+    os.environ['VK_API_BASE_URL'] = upstream_url + '/method/'
+    os.environ['TWITTER_API_BASE_URL'] = upstream_url + '/1.1/'
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('VK_ACCESS_TOKEN', 'benchmark')
+    os.environ.setdefault('TWITTER_CREDENTIALS', 'key:secret:token:secret')
+    if args.no_cache:
+        os.environ['CACHE_ENABLED'] = 'false'
+
+    import httpx
+    from main import app
+    from social.ratelimit import ANY_ENDPOINT, governor
+
+    # the stand-in has no quotas, its --rate-limit-rate stands in for them
+    governor.limits = {
+        resource_type: {ANY_ENDPOINT: (1e9, 1)}
+        for resource_type in governor.limits
+    }
+
+    results = []
+    await app.router.startup()
+    try:
+        async with httpx.AsyncClient(
+            app=app, base_url='http://benchmark'
+        ) as client:
+            for scenario in args.scenarios:
+                for concurrency in args.concurrency:
+                    result = await _run_level(
+                        client, scenario, concurrency, args.requests,
+                        args.sources, args.users, args.count,
+                    )
+                    results.append(result)
+                    print(
+                        '{scenario:>12} c={concurrency:<4} '
+                        '{throughput:>8.1f} req/s  p50 {p50_ms:>7.1f} ms  '
+                        'p95 {p95_ms:>7.1f} ms  p99 {p99_ms:>7.1f} ms  '
+                        'errors {errors:<4} cpu {cpu_ms_per_request:.2f} '
+                        'ms/req  rss {max_rss_mb} MB'.format(**result)
+                    )
+    finally:
+        await app.router.shutdown()
+    return results
+
+
+def run(args: argparse.Namespace) -> None:
+
+    port = _free_port()
+    upstream = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.fake_upstream',
+        '--port', str(port),
+        '--latency-ms', str(args.latency_ms),
+        '--latency-sigma', str(args.latency_sigma),
+        '--error-rate', str(args.error_rate),
+        '--rate-limit-rate', str(args.rate_limit_rate),
+        '--seed', str(args.seed),
+    ])
+    try:
+        _wait_for_port(port)
+        random.seed(args.seed)
+        results = asyncio.run(
+            _run(args, 'http://127.0.0.1:{}'.format(port))
+        )
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+    report = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'argv': sys.argv[1:],
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('saved to {}'.format(args.output))
+
+
+def compare(old: dict, new: dict, tolerance: float) -> List[str]:
+
+    # a regression is a throughput drop or a p95 rise beyond tolerance
+    baseline = {
+        (x['scenario'], x['concurrency']): x for x in old['results']
+    }
+    regressions = []
+    for result in new['results']:
+        before = baseline.get((result['scenario'], result['concurrency']))
+        if before is None:
+            continue
+        name = '{} c={}'.format(result['scenario'], result['concurrency'])
+        if result['throughput'] < before['throughput'] * (1 - tolerance):
+            regressions.append('{}: throughput {} -> {} req/s'.format(
+                name, before['throughput'], result['throughput']
+            ))
+        if result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append('{}: p95 {} -> {} ms'.format(
+                name, before['p95_ms'], result['p95_ms']
+            ))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+
+    parser = argparse.ArgumentParser(
+        description='Load test against a local fake VK/Twitter upstream.'
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument(
+        '--scenarios', type=lambda x: x.split(','), default=SCENARIOS
+    )
+    run_parser.add_argument(
+        '--concurrency', type=lambda x: [int(y) for y in x.split(',')],
+        default=CONCURRENCY,
+    )
+    run_parser.add_argument(
+        '--sources', type=lambda x: x.split(','), default=SOURCES
+    )
+    run_parser.add_argument('--requests', type=int, default=500)
+    # distinct user IDs to draw from, a small pool mostly hits the cache
+    run_parser.add_argument('--users', type=int, default=100000)
+    run_parser.add_argument('--count', type=int, default=10)
+    run_parser.add_argument('--no-cache', action='store_true')
+    run_parser.add_argument('--latency-ms', type=float, default=50.0)
+    run_parser.add_argument('--latency-sigma', type=float, default=0.5)
+    run_parser.add_argument('--error-rate', type=float, default=0.0)
+    run_parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--output', '-o', default='')
+
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--tolerance', type=float, default=0.1)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        run(args)
+        return
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare(old, new, args.tolerance)
+    for line in regressions:
+        print(line)
+    if regressions:
+        sys.exit(1)
+    print('no regressions')
+
+
+if __name__ == '__main__':
+    main()
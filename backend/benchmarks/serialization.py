@@ -0,0 +1,65 @@
+import json
+import timeit
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+from social import codec
+from social.models import User, VKUser
+
+ITEMS = 200
+NUMBER = 200
+
+
+def _payload() -> bytes:
+    return json.dumps({'response': {'count': ITEMS, 'items': [
+        {
+            'id': i,
+            'first_name': 'Pavel',
+            'last_name': 'Durov',
+            'screen_name': 'id{}'.format(i),
+            'photo': 'https://vk.com/images/camera_50.png',
+            'followers_count': i * 10,
+            'common_count': i,
+        }
+        for i in range(ITEMS)
+    ]}}).encode()
+
+
+def validated(payload: bytes) -> bytes:
+    # what a friend list went through before: decode, validate, dump to
+    # dicts, validate against response_model, encode
+    items = json.loads(payload)['response']['items']
+    users = [x.dict() for x in parse_obj_as(List[VKUser], items)]
+    content = jsonable_encoder(parse_obj_as(List[User], users))
+    return json.dumps(
+        content, ensure_ascii=False, separators=(',', ':')
+    ).encode('utf-8')
+
+
+def trusted(payload: bytes) -> bytes:
+    items = codec.loads(payload)['response']['items']
+    return codec.dumps([VKUser.from_trusted(x) for x in items])
+
+
+def main() -> None:
+    payload = _payload()
+    assert json.loads(validated(payload)) == json.loads(trusted(payload))
+
+    print('{} users per list, orjson {}'.format(
+        ITEMS, 'on' if codec.orjson is not None else 'off'
+    ))
+    results = {}
+    for name, func in (('validated', validated), ('trusted', trusted)):
+        seconds = min(timeit.repeat(
+            lambda: func(payload), number=NUMBER, repeat=5
+        ))
+        results[name] = seconds / NUMBER / ITEMS * 1e6
+        print('{:>10}: {:.2f} us/item'.format(name, results[name]))
+    print('{:>10}: {:.1f}x'.format(
+        'speedup', results['validated'] / results['trusted']
+    ))
+
+
+if __name__ == '__main__':
+    main()
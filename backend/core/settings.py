@@ -8,6 +8,171 @@ TWITTER_API_SECRET_KEY = os.environ.get('TWITTER_API_SECRET_KEY', '')
 TWITTER_ACCESS_TOKEN = os.environ.get('TWITTER_ACCESS_TOKEN', '')
 TWITTER_ACCESS_TOKEN_SECRET = os.environ.get('TWITTER_ACCESS_TOKEN_SECRET', '')
 
+# comma-separated pools, the single credentials above are the fallback
+VK_ACCESS_TOKENS = [
+    x for x in os.environ.get('VK_ACCESS_TOKENS', '').split(',') if x
+] or [VK_ACCESS_TOKEN]
+# api_key:api_secret_key:access_token:access_token_secret,...
+TWITTER_CREDENTIALS = [
+    tuple(x.split(':'))
+    for x in os.environ.get('TWITTER_CREDENTIALS', '').split(',') if x
+] or [(TWITTER_API_KEY, TWITTER_API_SECRET_KEY, TWITTER_ACCESS_TOKEN,
+       TWITTER_ACCESS_TOKEN_SECRET)]
+CREDENTIAL_QUARANTINE_SECONDS = float(
+    os.environ.get('CREDENTIAL_QUARANTINE_SECONDS', 600)
+)
+
+# overridable to point the clients at a stand-in, see benchmarks/
+VK_API_BASE_URL = os.environ.get(
+    'VK_API_BASE_URL', 'https://api.vk.com/method/'
+)
+TWITTER_API_BASE_URL = os.environ.get(
+    'TWITTER_API_BASE_URL', 'https://api.twitter.com/1.1/'
+)
+
 USE_PROXY_SERVER = os.environ.get('USE_PROXY_SERVER', None) == 'true'
 PROXY_SERVER_IP = os.environ.get('PROXY_SERVER_IP', '')
 PROXY_SERVER_PORT = os.environ.get('PROXY_SERVER_PORT', '')
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get(
+    'LOG_FORMAT',
+    '%(asctime)s %(levelname)s %(name)s [%(trace_id)s] %(message)s'
+)
+# raw upstream bodies are logged at DEBUG only, sampled and truncated
+LOG_UPSTREAM_BODIES = os.environ.get('LOG_UPSTREAM_BODIES', 'false') == 'true'
+LOG_BODY_SAMPLE_RATE = float(os.environ.get('LOG_BODY_SAMPLE_RATE', 1.0))
+LOG_BODY_MAX_BYTES = int(os.environ.get('LOG_BODY_MAX_BYTES', 2048))
+
+# shared by uvicorn workers to aggregate /metrics, unset for one process;
+# a worker that shuts down folds its counters into totals.json there
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+# share of requests whose spans are recorded and handed to the exporter,
+# one of memory, file or otel (needs opentelemetry installed)
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0.01))
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', '')
+TRACE_FILE_PATH = os.environ.get('TRACE_FILE_PATH', '/tmp/traces.jsonl')
+
+USE_ASYNC_CLIENTS = os.environ.get('USE_ASYNC_CLIENTS', 'true') == 'true'
+# build models from upstream payloads without validating them
+TRUST_UPSTREAM_PAYLOADS = (
+    os.environ.get('TRUST_UPSTREAM_PAYLOADS', 'false') == 'true'
+)
+HTTP_POOL_MAX_CONNECTIONS = int(
+    os.environ.get('HTTP_POOL_MAX_CONNECTIONS', 1000)
+)
+HTTP_POOL_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.environ.get('HTTP_POOL_MAX_KEEPALIVE_CONNECTIONS', 100)
+)
+HTTP_POOL_KEEPALIVE_EXPIRY = float(
+    os.environ.get('HTTP_POOL_KEEPALIVE_EXPIRY', 60)
+)
+
+SOURCE_FANOUT_POLICY = os.environ.get('SOURCE_FANOUT_POLICY', 'priority')
+SOURCE_FANOUT_DEADLINE = float(
+    os.environ.get('SOURCE_FANOUT_DEADLINE', 1.0)
+)
+
+CACHE_ENABLED = os.environ.get('CACHE_ENABLED', 'true') == 'true'
+CACHE_MAX_SIZE = int(os.environ.get('CACHE_MAX_SIZE', 10000))
+CACHE_USER_TTL = float(os.environ.get('CACHE_USER_TTL', 600))
+CACHE_ARTICLES_TTL = float(os.environ.get('CACHE_ARTICLES_TTL', 60))
+CACHE_FRIENDS_TTL = float(os.environ.get('CACHE_FRIENDS_TTL', 300))
+CACHE_FOLLOWERS_TTL = float(os.environ.get('CACHE_FOLLOWERS_TTL', 300))
+# expired entries are served for this long while one refresh runs
+CACHE_STALE_GRACE = float(os.environ.get('CACHE_STALE_GRACE', 60))
+# the N most requested keys are re-fetched before they expire, 0 is off
+CACHE_REFRESH_TOP_N = int(os.environ.get('CACHE_REFRESH_TOP_N', 0))
+CACHE_REFRESH_INTERVAL = float(os.environ.get('CACHE_REFRESH_INTERVAL', 5))
+CACHE_REFRESH_AHEAD = float(os.environ.get('CACHE_REFRESH_AHEAD', 15))
+CACHE_SHARED_BACKEND = os.environ.get('CACHE_SHARED_BACKEND', '')
+# files of the service's own, kept out of world-writable /tmp
+DATA_DIR = os.environ.get(
+    'DATA_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data'),
+)
+CACHE_SHARED_PATH = os.environ.get(
+    'CACHE_SHARED_PATH', os.path.join(DATA_DIR, 'cache.sqlite3')
+)
+
+# poll articles by fetching only posts newer than the ones already known,
+# a full fetch is made once per ARTICLES_TIMELINE_TTL
+ARTICLES_INCREMENTAL = (
+    os.environ.get('ARTICLES_INCREMENTAL', 'false') == 'true'
+)
+ARTICLES_TIMELINE_TTL = float(os.environ.get('ARTICLES_TIMELINE_TTL', 3600))
+# VK walls have no since_id or max_id: windows are looked for over at most
+# this many wall.get pages, the posts found by then are the answer
+VK_WALL_MAX_PAGES = int(os.environ.get('VK_WALL_MAX_PAGES', 5))
+
+NEGATIVE_CACHE_MAX_SIZE = int(
+    os.environ.get('NEGATIVE_CACHE_MAX_SIZE', 50000)
+)
+NEGATIVE_CACHE_TTL = float(os.environ.get('NEGATIVE_CACHE_TTL', 60))
+
+# users, articles and friend/follower lists kept on disk, '' is off:
+# read on a cold cache while younger than their cache ttl, on upstream
+# failures while younger than SNAPSHOT_STALE_MAX_AGE
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', '')
+SNAPSHOT_STALE_MAX_AGE = float(os.environ.get('SNAPSHOT_STALE_MAX_AGE', 86400))
+# snapshots not requested for this long are dropped
+SNAPSHOT_RETAIN = float(os.environ.get('SNAPSHOT_RETAIN', 7 * 24 * 3600))
+# up to BATCH snapshots older than AGE are re-fetched per INTERVAL, 0 is off
+SNAPSHOT_REFRESH_BATCH = int(os.environ.get('SNAPSHOT_REFRESH_BATCH', 20))
+SNAPSHOT_REFRESH_INTERVAL = float(
+    os.environ.get('SNAPSHOT_REFRESH_INTERVAL', 30)
+)
+SNAPSHOT_REFRESH_AGE = float(os.environ.get('SNAPSHOT_REFRESH_AGE', 600))
+
+# user_id -> sources it was found on, so unqualified lookups go straight
+# to the right network; kept in SOURCE_INDEX_PATH across restarts
+SOURCE_INDEX_MAX_SIZE = int(os.environ.get('SOURCE_INDEX_MAX_SIZE', 100000))
+SOURCE_INDEX_TTL = float(os.environ.get('SOURCE_INDEX_TTL', 7 * 24 * 3600))
+SOURCE_INDEX_PATH = os.environ.get(
+    'SOURCE_INDEX_PATH', os.path.join(DATA_DIR, 'sources.json')
+)
+
+BATCH_MAX_USER_IDS = int(os.environ.get('BATCH_MAX_USER_IDS', 1000))
+
+USER_BATCHING_ENABLED = (
+    os.environ.get('USER_BATCHING_ENABLED', 'false') == 'true'
+)
+USER_BATCHING_WINDOW = float(os.environ.get('USER_BATCHING_WINDOW', 0.005))
+USER_BATCHING_MAX_SIZE = int(os.environ.get('USER_BATCHING_MAX_SIZE', 100))
+
+# POST /feed: accounts per request, timelines fetched at once per source
+# and how long a single one may take
+FEED_MAX_ACCOUNTS = int(os.environ.get('FEED_MAX_ACCOUNTS', 2000))
+FEED_SOURCE_CONCURRENCY = int(os.environ.get('FEED_SOURCE_CONCURRENCY', 20))
+FEED_ACCOUNT_TIMEOUT = float(os.environ.get('FEED_ACCOUNT_TIMEOUT', 5))
+
+STREAM_PREFETCH_PAGES = int(os.environ.get('STREAM_PREFETCH_PAGES', 2))
+
+RATE_LIMIT_MAX_WAIT = float(os.environ.get('RATE_LIMIT_MAX_WAIT', 5))
+VK_RATE_LIMIT_PER_SECOND = float(
+    os.environ.get('VK_RATE_LIMIT_PER_SECOND', 3)
+)
+# share of every rate limit that background refreshes leave to requests
+RATE_LIMIT_BACKGROUND_RESERVE = float(
+    os.environ.get('RATE_LIMIT_BACKGROUND_RESERVE', 0.5)
+)
+
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 10))
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 15))
+RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', 3))
+RETRY_BACKOFF_BASE = float(os.environ.get('RETRY_BACKOFF_BASE', 0.1))
+RETRY_BACKOFF_MAX = float(os.environ.get('RETRY_BACKOFF_MAX', 2))
+HEDGE_ENABLED = os.environ.get('HEDGE_ENABLED', 'false') == 'true'
+HEDGE_MIN_DELAY = float(os.environ.get('HEDGE_MIN_DELAY', 0.05))
+
+BREAKER_WINDOW = int(os.environ.get('BREAKER_WINDOW', 20))
+BREAKER_MIN_CALLS = int(os.environ.get('BREAKER_MIN_CALLS', 10))
+BREAKER_FAILURE_RATE = float(os.environ.get('BREAKER_FAILURE_RATE', 0.5))
+BREAKER_SLOW_CALL_SECONDS = float(
+    os.environ.get('BREAKER_SLOW_CALL_SECONDS', 5)
+)
+BREAKER_OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', 30))
+BREAKER_HALF_OPEN_CALLS = int(os.environ.get('BREAKER_HALF_OPEN_CALLS', 3))
@@ -1,6 +1,42 @@
+from api.metrics import MetricsMiddleware
+from api.metrics import router as metrics_router
 from api.routers import router as api_router
+from api.tracing import TracingMiddleware
 from fastapi import FastAPI
+from social.async_clients import client_registry
+from social.base import refresher, snapshot_refresher
+from social.logs import start_logging, stop_logging
+from social.metrics import collector
+from social.resolution import source_index
 
 app = FastAPI()
 
+app.add_middleware(MetricsMiddleware)
+# added last, so it is the outermost: metrics and logs see its trace
+app.add_middleware(TracingMiddleware)
 app.include_router(api_router, prefix="/api")
+app.include_router(metrics_router)
+
+
+@app.on_event("startup")
+async def startup():
+    start_logging()
+    source_index.load()
+    client_registry.start()
+    refresher.start()
+    if snapshot_refresher is not None:
+        snapshot_refresher.start()
+    if collector is not None:
+        collector.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if collector is not None:
+        collector.stop()
+    if snapshot_refresher is not None:
+        snapshot_refresher.stop()
+    refresher.stop()
+    await client_registry.close()
+    source_index.save()
+    stop_logging()
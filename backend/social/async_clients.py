@@ -0,0 +1,532 @@
+import asyncio
+import time
+from abc import abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import oauth2
+from core import settings
+from starlette.concurrency import run_in_threadpool
+
+from .clients import Client, ClientFactory, TwitterClient, VKClient
+from .constants import RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK, RESOURCE_TYPES
+from .credentials import Credential, CredentialPool, get_credential_pool
+from .exceptions import (InvalidCredentials, RateLimitExceeded,
+                         SocialConnectionError, UserDoesNotExist,
+                         WrongResourceType)
+from .logs import log_error, log_response
+from .metrics import observe_upstream, upstream_in_flight
+from .models import Article, User, UsersPage
+from .ratelimit import governor
+from .sessions import close_async_sessions, get_async_session
+from .tracing import span
+
+
+class AsyncClient:
+
+    @abstractmethod
+    async def get_user(self, user_id: str) -> User:
+        pass
+
+    @abstractmethod
+    async def get_users(self, user_ids: List[str]) -> Dict[str, User]:
+        pass
+
+    @abstractmethod
+    async def get_articles(
+        self, user_id: str, count: int = 10, since_id: Optional[int] = None,
+        max_id: Optional[int] = None
+    ) -> List[Article]:
+        pass
+
+    @abstractmethod
+    async def get_friends(self, user_id: str, count: int = 10) -> List[User]:
+        pass
+
+    @abstractmethod
+    async def get_followers(
+        self, user_id: str, count: int = 10
+    ) -> List[User]:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def _get(
+        self, source: str, endpoint: str, url: str, **kwargs
+    ) -> httpx.Response:
+
+        upstream_in_flight.inc(source)
+        started_at = time.monotonic()
+        with span('http', source=source, endpoint=endpoint) as http_span:
+            try:
+                # streamed only to tell the first byte from the last one
+                async with self.session.stream(
+                    'GET', url, **kwargs
+                ) as response:
+                    http_span.event('first_byte')
+                    await response.aread()
+            except httpx.HTTPError as e:
+                observe_upstream(source, endpoint, 'error', started_at)
+                log_error(source, endpoint, started_at, e)
+                raise SocialConnectionError()
+            finally:
+                upstream_in_flight.dec(source)
+            http_span.set(
+                status=response.status_code, bytes=len(response.content)
+            )
+
+        observe_upstream(
+            source, endpoint, response.status_code, started_at,
+            len(response.content)
+        )
+        log_response(
+            source, endpoint, response.status_code, started_at,
+            response.content
+        )
+        return response
+
+    @abstractmethod
+    async def get_friends_page(
+        self, user_id: str, cursor: Optional[str] = None,
+        count: Optional[int] = None
+    ) -> UsersPage:
+        pass
+
+    @abstractmethod
+    async def get_followers_page(
+        self, user_id: str, cursor: Optional[str] = None,
+        count: Optional[int] = None
+    ) -> UsersPage:
+        pass
+
+
+class AsyncTwitterClient(AsyncClient, TwitterClient):
+
+    def __init__(
+        self,
+        session: Optional[httpx.AsyncClient] = None,
+        credentials: Optional[CredentialPool] = None,
+    ):
+        super().__init__()
+
+        self.signature_method = oauth2.SignatureMethod_HMAC_SHA1()
+        self._signers: Dict[str, Tuple[oauth2.Consumer, oauth2.Token]] = {}
+
+        if session is None:
+            session = get_async_session(self.api_base_URL, self._proxy_url())
+        self.session = session
+
+        if credentials is None:
+            credentials = get_credential_pool(RESOURCE_TYPE_TWITTER)
+        self.credentials = credentials
+
+    def _proxy_url(self) -> Optional[str]:
+        if self.proxy_server_ip:
+            return 'http://{}:{}'.format(
+                self.proxy_server_ip, self.proxy_server_port
+            )
+        return None
+
+    def _signer(
+        self, credential: Credential
+    ) -> Tuple[oauth2.Consumer, oauth2.Token]:
+
+        signer = self._signers.get(credential.token)
+        if signer is None:
+            key, secret, token, token_secret = credential.secrets
+            signer = self._signers[credential.token] = (
+                oauth2.Consumer(key=key, secret=secret),
+                oauth2.Token(key=token, secret=token_secret),
+            )
+        return signer
+
+    def _sign_url(self, request_url: str, credential: Credential) -> str:
+        consumer, token = self._signer(credential)
+        request = oauth2.Request.from_consumer_and_token(
+            consumer, token=token, http_method='GET', http_url=request_url
+        )
+        request.sign_request(self.signature_method, consumer, token)
+        return request.to_url()
+
+    async def _request(self, request_url: str) -> Any:
+
+        endpoint = self._endpoint(request_url)
+        while True:
+            try:
+                with self.credentials.use(endpoint) as credential:
+                    return await self._send(request_url, endpoint, credential)
+            except InvalidCredentials:
+                # the token is quarantined now, try the next one
+                if not self.credentials.available():
+                    raise
+
+    async def _send(
+        self, request_url: str, endpoint: str, credential: Credential
+    ) -> Any:
+
+        await governor.acquire(
+            RESOURCE_TYPE_TWITTER, endpoint, credential.token
+        )
+
+        response = await self._get(
+            RESOURCE_TYPE_TWITTER, endpoint,
+            self._sign_url(request_url, credential)
+        )
+
+        reset_in = governor.update_from_headers(
+            RESOURCE_TYPE_TWITTER, endpoint, credential.token,
+            response.headers
+        )
+
+        try:
+            return self._parse_response(
+                response.status_code, response.content
+            )
+        except RateLimitExceeded:
+            retry_after = reset_in or self.rate_limit_backoff
+            governor.block(
+                RESOURCE_TYPE_TWITTER, endpoint, credential.token,
+                retry_after
+            )
+            raise RateLimitExceeded(retry_after=retry_after)
+
+    async def get_user(self, user_id: str) -> User:
+        data = await self._request(
+            self._build_url(self.user_api_url, user_id)
+        )
+        return self._parse_user(data)
+
+    async def _get_user_list(self, user_ids: List[str]) -> List[User]:
+        try:
+            data = await self._request(self._build_lookup_url(user_ids))
+        except UserDoesNotExist:
+            return []
+        return self._parse_user_list(data)
+
+    async def get_users(self, user_ids: List[str]) -> Dict[str, User]:
+        chunks = await asyncio.gather(*[
+            self._get_user_list(chunk) for chunk in self._chunks(user_ids)
+        ])
+        return self._match_users(user_ids, sum(chunks, []))
+
+    async def get_articles(
+        self, user_id: str, count: int = 10, since_id: Optional[int] = None,
+        max_id: Optional[int] = None
+    ) -> List[Article]:
+        data = await self._request(
+            self._build_articles_url(user_id, count, since_id, max_id)
+        )
+        return self._parse_articles(data)
+
+    async def get_friends(self, user_id: str, count: int = 10) -> List[User]:
+        data = await self._request(
+            self._build_url(self.friends_api_url, user_id, count=count)
+        )
+        return self._parse_users(data)
+
+    async def get_followers(
+        self, user_id: str, count: int = 10
+    ) -> List[User]:
+        data = await self._request(
+            self._build_url(self.followers_api_url, user_id, count=count)
+        )
+        return self._parse_users(data)
+
+    async def get_friends_page(
+        self, user_id: str, cursor: Optional[str] = None,
+        count: Optional[int] = None
+    ) -> UsersPage:
+        data = await self._request(self._build_page_url(
+            self.friends_api_url, user_id, cursor, count,
+            self.friends_page_size
+        ))
+        return self._parse_users_page(data)
+
+    async def get_followers_page(
+        self, user_id: str, cursor: Optional[str] = None,
+        count: Optional[int] = None
+    ) -> UsersPage:
+        data = await self._request(self._build_page_url(
+            self.followers_api_url, user_id, cursor, count,
+            self.followers_page_size
+        ))
+        return self._parse_users_page(data)
+
+
+class AsyncVKClient(AsyncClient, VKClient):
+
+    def __init__(
+        self,
+        session: Optional[httpx.AsyncClient] = None,
+        credentials: Optional[CredentialPool] = None,
+    ):
+        super().__init__()
+
+        if session is None:
+            session = get_async_session(self.api_base_URL, self._proxy_url())
+        self.session = session
+
+        if credentials is None:
+            credentials = get_credential_pool(RESOURCE_TYPE_VK)
+        self.credentials = credentials
+
+    def _proxy_url(self) -> Optional[str]:
+        if self.proxies:
+            return 'http://{}'.format(self.proxies['https'])
+        return None
+
+    def _endpoint(self, api_url: str) -> str:
+        return api_url[len(self.api_base_URL):]
+
+    async def _request(
+        self, api_url: str, params: dict,
+        parse: Optional[Callable[[bytes], Any]] = None,
+    ) -> Any:
+
+        endpoint = self._endpoint(api_url)
+        while True:
+            try:
+                with self.credentials.use(endpoint) as credential:
+                    return await self._send(
+                        api_url, endpoint, credential,
+                        dict(params, access_token=credential.token),
+                        parse or self._parse_response,
+                    )
+            except InvalidCredentials:
+                # the token is quarantined now, try the next one
+                if not self.credentials.available():
+                    raise
+
+    async def _send(
+        self, api_url: str, endpoint: str, credential: Credential,
+        params: dict, parse: Callable[[bytes], Any],
+    ) -> Any:
+
+        await governor.acquire(RESOURCE_TYPE_VK, endpoint, credential.token)
+
+        response = await self._get(
+            RESOURCE_TYPE_VK, endpoint, api_url, params=params
+        )
+
+        try:
+            return parse(response.content)
+        except RateLimitExceeded:
+            governor.block(
+                RESOURCE_TYPE_VK, endpoint, credential.token,
+                self.rate_limit_backoff
+            )
+            raise RateLimitExceeded(retry_after=self.rate_limit_backoff)
+
+    async def get_user(self, user_id: str) -> User:
+        data = await self._request(
+            self.user_api_url, self._user_params(user_id)
+        )
+        return self._parse_user(data)
+
+    async def _get_user_list(self, user_ids: List[str]) -> List[User]:
+        try:
+            data = await self._request(
+                self.user_api_url, self._user_params(','.join(user_ids))
+            )
+        except UserDoesNotExist:
+            return []
+        return self._parse_user_list(data)
+
+    async def get_users(self, user_ids: List[str]) -> Dict[str, User]:
+        chunks = await asyncio.gather(*[
+            self._get_user_list(chunk) for chunk in self._chunks(user_ids)
+        ])
+        return self._match_users(user_ids, sum(chunks, []))
+
+    async def get_articles(
+        self, user_id: str, count: int = 10, since_id: Optional[int] = None,
+        max_id: Optional[int] = None
+    ) -> List[Article]:
+
+        if since_id is None and max_id is None:
+            data = await self._request(
+                self.wall_api_url, self._articles_params(user_id, count)
+            )
+            return self._parse_articles(data)
+
+        items = []
+        for offset, page in self._wall_pages(count, since_id):
+            data = await self._request(
+                self.wall_api_url,
+                self._articles_params(user_id, page, offset)
+            )
+            kept, done = self._wall_page(data, offset, page, since_id, max_id)
+            items.extend(kept)
+            if done or len(items) >= count:
+                break
+        return self._parse_wall(items, count)
+
+    async def get_friends(self, user_id: str, count: int = 10) -> List[User]:
+        data = await self._request(
+            self.friends_api_url, self._users_params(user_id, count)
+        )
+        return self._parse_users(data)
+
+    async def get_followers(
+        self, user_id: str, count: int = 10
+    ) -> List[User]:
+        data = await self._request(
+            self.followers_api_url, self._users_params(user_id, count)
+        )
+        return self._parse_users(data)
+
+    async def get_friends_page(
+        self, user_id: str, cursor: Optional[str] = None,
+        count: Optional[int] = None
+    ) -> UsersPage:
+        params = self._users_page_params(
+            user_id, cursor, count, self.friends_page_size
+        )
+        data = await self._request(self.friends_api_url, params)
+        return self._parse_users_page(data, params['offset'])
+
+    async def get_followers_page(
+        self, user_id: str, cursor: Optional[str] = None,
+        count: Optional[int] = None
+    ) -> UsersPage:
+        params = self._users_page_params(
+            user_id, cursor, count, self.followers_page_size
+        )
+        data = await self._request(self.followers_api_url, params)
+        return self._parse_users_page(data, params['offset'])
+
+    async def get_bundle(
+        self, user_id: str, include: List[str], count: int = 10
+    ) -> Dict[str, Any]:
+        calls = self._bundle_calls(user_id, include, count)
+        data = await self._request(
+            self.execute_api_url, self._execute_params(calls),
+            parse=self._parse_body,
+        )
+        return self._parse_bundle(calls, data)
+
+    async def get_timelines(
+        self, user_ids: List[str], count: int = 10
+    ) -> Dict[str, Any]:
+        # up to EXECUTE_MAX_CALLS walls for a single request of the limit
+        calls = self._timeline_calls(user_ids, count)
+        data = await self._request(
+            self.execute_api_url, self._execute_params(calls),
+            parse=self._parse_body,
+        )
+        return self._parse_timelines(user_ids, calls, data)
+
+
+class ThreadPoolClient(AsyncClient):
+
+    def __init__(self, client: Client):
+        self.client = client
+        self.supports_bundle = client.supports_bundle
+
+    async def close(self) -> None:
+        await run_in_threadpool(self.client.close)
+
+    async def get_user(self, user_id: str) -> User:
+        return await run_in_threadpool(self.client.get_user, user_id)
+
+    async def get_users(self, user_ids: List[str]) -> Dict[str, User]:
+        return await run_in_threadpool(self.client.get_users, user_ids)
+
+    async def get_articles(
+        self, user_id: str, count: int = 10, since_id: Optional[int] = None,
+        max_id: Optional[int] = None
+    ) -> List[Article]:
+        return await run_in_threadpool(
+            self.client.get_articles, user_id, count, since_id, max_id
+        )
+
+    async def get_friends(self, user_id: str, count: int = 10) -> List[User]:
+        return await run_in_threadpool(
+            self.client.get_friends, user_id, count
+        )
+
+    async def get_followers(
+        self, user_id: str, count: int = 10
+    ) -> List[User]:
+        return await run_in_threadpool(
+            self.client.get_followers, user_id, count
+        )
+
+    async def get_friends_page(
+        self, user_id: str, cursor: Optional[str] = None,
+        count: Optional[int] = None
+    ) -> UsersPage:
+        return await run_in_threadpool(
+            self.client.get_friends_page, user_id, cursor, count
+        )
+
+    async def get_followers_page(
+        self, user_id: str, cursor: Optional[str] = None,
+        count: Optional[int] = None
+    ) -> UsersPage:
+        return await run_in_threadpool(
+            self.client.get_followers_page, user_id, cursor, count
+        )
+
+    async def get_bundle(
+        self, user_id: str, include: List[str], count: int = 10
+    ) -> Dict[str, Any]:
+        return await run_in_threadpool(
+            self.client.get_bundle, user_id, include, count
+        )
+
+    async def get_timelines(
+        self, user_ids: List[str], count: int = 10
+    ) -> Dict[str, Any]:
+        return await run_in_threadpool(
+            self.client.get_timelines, user_ids, count
+        )
+
+
+class ClientRegistry:
+
+    def __init__(self):
+        self._clients: Dict[str, AsyncClient] = {}
+
+    @staticmethod
+    def _create(resource_type: str) -> AsyncClient:
+
+        if not getattr(settings, 'USE_ASYNC_CLIENTS', True):
+            return ThreadPoolClient(ClientFactory.create_client(resource_type))
+
+        if resource_type == RESOURCE_TYPE_VK:
+            return AsyncVKClient()
+        elif resource_type == RESOURCE_TYPE_TWITTER:
+            return AsyncTwitterClient()
+        else:
+            raise WrongResourceType()
+
+    def get(self, resource_type: str) -> AsyncClient:
+
+        client = self._clients.get(resource_type)
+        if client is None:
+            client = self._create(resource_type)
+            self._clients[resource_type] = client
+        return client
+
+    def start(self) -> None:
+        for resource_type in RESOURCE_TYPES:
+            self.get(resource_type)
+
+    async def close(self) -> None:
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.close()
+        await close_async_sessions()
+
+
+client_registry = ClientRegistry()
+
+
+class AsyncClientFactory():
+
+    @staticmethod
+    def create_client(resource_type: str) -> AsyncClient:
+        return client_registry.get(resource_type)
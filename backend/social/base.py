@@ -1,80 +1,805 @@
-from typing import List
+import asyncio
+import functools
+import heapq
+import itertools
+import weakref
+from typing import (Any, AsyncIterator, Awaitable, Callable, Dict, Iterator,
+                    List, Optional, Tuple, Type, Union)
 
-from .clients import ClientFactory
-from .constants import RESOURCE_TYPES
-from .exceptions import SocialException, UserDoesNotExist
-from .models import Article, User
+from core import settings
+from fastapi.logger import logger
+from starlette.concurrency import run_in_threadpool
 
+from .async_clients import AsyncClientFactory
+from .batching import UserBatcher
+from .breaker import breakers
+from .cache import negative_cache, response_cache, timelines
+from .constants import (BUNDLE_ARTICLES, BUNDLE_FOLLOWERS, BUNDLE_FRIENDS,
+                        BUNDLE_SECTIONS, BUNDLE_USER, EXECUTE_MAX_CALLS,
+                        FANOUT_POLICY_MERGE, FANOUT_POLICY_PRIORITY,
+                        RESOURCE_TYPES)
+from .credentials import get_credential_stats
+from .exceptions import (DeadlineExceeded, RateLimitExceeded,
+                         SocialConnectionError, SocialException,
+                         SourceUnavailable, UnknownError, UserDoesNotExist,
+                         WrongCursor, WrongServerResponse)
+from .fanout import fan_out
+from .metrics import social_errors
+from .models import Article, User, UsersPage
+from .pagination import prefetch
+from .ratelimit import governor
+from .refresher import Refresher
+from .resilience import resilience, set_deadline
+from .resolution import guess_sources, source_index
+from .singleflight import single_flight
+from .snapshots import (OPERATIONS, SnapshotRefresher, get_max_age,
+                        snapshots)
+from .tracing import span
 
-def get_user(user_id: str, resource_type: str = None) -> User:
 
-    if resource_type:
-        client = ClientFactory.create_client(resource_type)
-        return client.get_user(user_id)
+# upstream failures answered with a snapshot when there is one
+SNAPSHOT_FALLBACK_ERRORS = (
+    RateLimitExceeded, SourceUnavailable, DeadlineExceeded, UnknownError,
+    SocialConnectionError, WrongServerResponse,
+)
+
+user_batcher = UserBatcher(
+    window=settings.USER_BATCHING_WINDOW,
+    max_size=settings.USER_BATCHING_MAX_SIZE,
+    create_client=lambda x: AsyncClientFactory.create_client(x),
+)
+
+
+def _concat(results: List[list]) -> list:
+    return list(itertools.chain.from_iterable(results))
+
 
-    for resource_type in RESOURCE_TYPES:
-        client = ClientFactory.create_client(resource_type)
+def _resource_type(resource_type: str) -> str:
+    # `Source` enum members hash by name, keep keys on the plain value
+    return getattr(resource_type, 'value', resource_type)
+
+
+async def _upstream(
+    resource_type: str, breaker: str, operation: str,
+    request: Callable[[], Awaitable[Any]],
+) -> Any:
+
+    # the breaker guards the whole operation, retries and hedges included
+    with span('upstream', source=resource_type, operation=operation):
         try:
-            user = client.get_user(user_id)
-            return user
-        except UserDoesNotExist:
-            continue
-    else:
-        raise UserDoesNotExist()
+            return await breakers.call(
+                resource_type, breaker,
+                lambda: resilience.call((resource_type, operation), request)
+            )
+        except SocialException as e:
+            social_errors.inc(resource_type, operation, type(e).__name__)
+            raise
+
+
+def _key(
+    resource_type: str, operation: str, user_id: str, args: tuple
+) -> tuple:
+    # plain calls are keyed on their count, delta calls on all arguments
+    return (resource_type, operation, user_id,
+            args[0] if len(args) == 1 else args or None)
 
 
-def get_articles(
-    user_id: str, count: int, resource_type: str = None
+def _args(key: tuple) -> tuple:
+    arg = key[3]
+    if arg is None:
+        return ()
+    return arg if isinstance(arg, tuple) else (arg,)
+
+
+async def _incremental_articles(
+    client: Any, resource_type: str, user_id: str, count: int
 ) -> List[Article]:
 
-    if resource_type:
-        client = ClientFactory.create_client(resource_type)
-        return client.get_articles(user_id, count)
+    # the newest posts of a user are kept between polls, once they are
+    # known only the posts after them are asked for
+    key = (resource_type, user_id)
+    found, entry = timelines.get(key)
+    if not found or entry[0] < count or not entry[1]:
+        articles = await client.get_articles(user_id, count)
+        timelines.set(key, (count, articles), settings.ARTICLES_TIMELINE_TTL)
+        return articles
+
+    size, timeline = entry
+    delta = await client.get_articles(
+        user_id, size, since_id=max(x.id for x in timeline)
+    )
+    if delta:
+        # a full delta may leave a gap to the known posts, so it replaces
+        # them instead
+        if len(delta) < size:
+            ids = {x.id for x in delta}
+            delta = delta + [x for x in timeline if x.id not in ids]
+        timeline = delta[:size]
+        # the expiry is kept: counters of older posts are only refreshed
+        # by a full fetch
+        timelines.set(key, (size, timeline), timelines.ttl(key) or 0)
+    return timeline[:count]
 
-    for resource_type in RESOURCE_TYPES:
-        client = ClientFactory.create_client(resource_type)
+
+async def _get_snapshot(
+    resource_type: str, operation: str, user_id: str, args: tuple,
+    max_age: float,
+) -> Tuple[bool, Any]:
+
+    # only plain calls are kept, delta and cursor calls are not
+    if snapshots is None or operation not in OPERATIONS or len(args) > 1:
+        return False, None
+    found, value, _ = await run_in_threadpool(
+        snapshots.get, resource_type, operation, user_id,
+        args[0] if args else None, max_age
+    )
+    return found, value
+
+
+async def _put_snapshot(
+    resource_type: str, operation: str, user_id: str, args: tuple,
+    value: Any, requested: bool,
+) -> None:
+
+    if snapshots is None or operation not in OPERATIONS or len(args) > 1:
+        return
+    try:
+        await run_in_threadpool(
+            snapshots.put, resource_type, operation, user_id,
+            args[0] if args else None, value, requested
+        )
+    except Exception as e:
+        logger.warning("_put_snapshot(), e = {}".format(repr(e)))
+
+
+def _fetcher(
+    key: tuple, resource_type: str, operation: str, user_id: str, *args,
+    background: bool = False, requested: bool = True,
+) -> Callable[[], Awaitable[Any]]:
+
+    async def request():
+        if operation == 'get_user' and settings.USER_BATCHING_ENABLED:
+            return await user_batcher.get_user(resource_type, user_id)
+        client = AsyncClientFactory.create_client(resource_type)
+        if (operation == 'get_articles' and len(args) == 1
+                and settings.ARTICLES_INCREMENTAL):
+            return await _incremental_articles(
+                client, resource_type, user_id, *args
+            )
+        return await getattr(client, operation)(user_id, *args)
+
+    async def fetch():
+        # a cold cache, e.g. right after a restart, is filled from the
+        # snapshots as long as they are within the cache ttl; refreshes
+        # are there to replace them and always go upstream
+        if not background:
+            found, value = await _get_snapshot(
+                resource_type, operation, user_id, args,
+                response_cache.ttls.get(operation, 0)
+            )
+            if found:
+                return value
         try:
-            articles = client.get_articles(user_id, count)
-            return articles
-        except SocialException:
-            continue
-    else:
+            value = await _upstream(
+                resource_type, operation, operation, request
+            )
+        except UserDoesNotExist:
+            negative_cache.add(resource_type, user_id, operation)
+            if operation == negative_cache.authoritative_operation:
+                source_index.discard(user_id, resource_type)
+            raise
+        except SNAPSHOT_FALLBACK_ERRORS:
+            if background:
+                raise
+            found, value = await _get_snapshot(
+                resource_type, operation, user_id, args,
+                settings.SNAPSHOT_STALE_MAX_AGE
+            )
+            if not found:
+                raise
+            return value
+        source_index.add(user_id, resource_type)
+        await _put_snapshot(
+            resource_type, operation, user_id, args, value, requested
+        )
+        return value
+
+    # refreshes queue behind the rate limit reserve and never fall back to
+    # snapshots, so requests don't join them and wait on their terms
+    flight = key + ('background',) if background else key
+    return lambda: single_flight.do(flight, fetch)
+
+
+async def _call(
+    resource_type: str, operation: str, user_id: str, *args
+) -> Any:
+
+    resource_type = _resource_type(resource_type)
+    key = _key(resource_type, operation, user_id, args)
+
+    # one span per source attempted, cache hits included
+    with span('source', source=resource_type, operation=operation):
+        if negative_cache.is_missing(resource_type, user_id, operation):
+            raise UserDoesNotExist()
+
+        max_age = get_max_age()
+        if max_age is not None:
+            found, value = await _get_snapshot(
+                resource_type, operation, user_id, args, max_age
+            )
+            if found:
+                return value
+
+        return await response_cache.get_or_fetch(
+            key, operation,
+            _fetcher(key, resource_type, operation, user_id, *args)
+        )
+
+
+async def _refresh(key: tuple) -> None:
+    resource_type, operation, user_id, _ = key
+    await response_cache.refresh(
+        key, operation,
+        _fetcher(
+            key, resource_type, operation, user_id, *_args(key),
+            background=True,
+        )
+    )
+
+
+async def _refresh_snapshot(key: tuple) -> None:
+    # leaves the response cache alone, the key may be long gone from it
+    resource_type, operation, user_id, _ = key
+    await _fetcher(
+        key, resource_type, operation, user_id, *_args(key),
+        background=True, requested=False,
+    )()
+
+
+refresher = Refresher(
+    response_cache, _refresh,
+    top_n=settings.CACHE_REFRESH_TOP_N,
+    interval=settings.CACHE_REFRESH_INTERVAL,
+    ahead=settings.CACHE_REFRESH_AHEAD,
+)
+
+snapshot_refresher: Optional[SnapshotRefresher] = None
+if snapshots is not None:
+    snapshot_refresher = SnapshotRefresher(
+        snapshots, _refresh_snapshot,
+        batch=settings.SNAPSHOT_REFRESH_BATCH,
+        interval=settings.SNAPSHOT_REFRESH_INTERVAL,
+        older_than=settings.SNAPSHOT_REFRESH_AGE,
+    )
+
+
+def _sources(operation: str, user_id: Optional[str] = None) -> List[str]:
+
+    # the ID's format alone rules some sources out
+    sources = [
+        resource_type for resource_type in (
+            RESOURCE_TYPES if user_id is None else guess_sources(user_id)
+        )
+        if user_id is None
+        or not negative_cache.is_missing(resource_type, user_id, operation)
+    ]
+    if not sources:
         raise UserDoesNotExist()
 
+    # an open breaker takes its source out of the fan-out altogether
+    sources = [
+        resource_type for resource_type in sources
+        if not breakers.is_open(resource_type, operation)
+    ]
+    if not sources:
+        raise SourceUnavailable()
 
-def get_friends(
-    user_id: str, count: int = 10, resource_type: str = None
-) -> List[User]:
+    return sources
+
+
+async def _resolve(
+    operation: str,
+    user_id: str,
+    call: Callable[[str], Awaitable[Any]],
+    ignore: Tuple[Type[Exception], ...],
+    merge=None,
+) -> Any:
+
+    # sources the user was found on before are asked alone, the others
+    # only once those have failed
+    preferred, fallback = source_index.rank(
+        user_id, _sources(operation, user_id)
+    )
+    policy = getattr(settings, 'SOURCE_FANOUT_POLICY', FANOUT_POLICY_PRIORITY)
+    if policy == FANOUT_POLICY_MERGE:
+        preferred, fallback = preferred + fallback, []
+
+    try:
+        return await fan_out(
+            {x: functools.partial(call, x) for x in preferred},
+            ignore, merge=merge,
+        )
+    except UserDoesNotExist:
+        if not fallback:
+            raise
+
+    return await fan_out(
+        {x: functools.partial(call, x) for x in fallback},
+        ignore, merge=merge,
+    )
+
+
+async def _fetch(
+    operation: str,
+    user_id: str,
+    resource_type: str,
+    ignore: Tuple[Type[Exception], ...],
+    *args,
+    merge=None,
+) -> Any:
 
     if resource_type:
-        client = ClientFactory.create_client(resource_type)
-        return client.get_friends(user_id, count)
+        return await _call(resource_type, operation, user_id, *args)
 
-    for resource_type in RESOURCE_TYPES:
-        client = ClientFactory.create_client(resource_type)
-        try:
-            users = client.get_friends(user_id, count)
-            return users
-        except SocialException:
+    return await _resolve(
+        operation, user_id,
+        lambda x: _call(x, operation, user_id, *args),
+        ignore, merge=merge,
+    )
+
+
+async def get_user(user_id: str, resource_type: str = None) -> User:
+    return await _fetch(
+        'get_user', user_id, resource_type, (UserDoesNotExist,)
+    )
+
+
+async def _call_batch(
+    resource_type: str, user_ids: List[str]
+) -> Dict[str, User]:
+
+    resource_type = _resource_type(resource_type)
+    users = {}
+    missing = []
+    for user_id in user_ids:
+        if negative_cache.is_missing(resource_type, user_id, 'get_user'):
             continue
-    else:
-        raise UserDoesNotExist()
+        key = (resource_type, 'get_user', user_id, None)
+        found, user = await response_cache.get(key, 'get_user')
+        if found:
+            users[user_id] = user
+        else:
+            missing.append(user_id)
+
+    if not missing:
+        return users
+
+    client = AsyncClientFactory.create_client(resource_type)
+    fetched = await _upstream(
+        resource_type, 'get_user', 'get_users',
+        lambda: client.get_users(missing)
+    )
+    for user_id in missing:
+        user = fetched.get(user_id)
+        if user is None:
+            negative_cache.add(resource_type, user_id, 'get_user')
+            source_index.discard(user_id, resource_type)
+            continue
+        source_index.add(user_id, resource_type)
+        key = (resource_type, 'get_user', user_id, None)
+        await response_cache.set(key, 'get_user', user)
+        users[user_id] = user
+
+    return users
+
+
+async def get_users(
+    user_ids: List[str], resource_type: str = None
+) -> Dict[str, Union[User, SocialException, None]]:
+
+    # None for IDs no source has, the error of a failed source for IDs
+    # the sources that answered do not have
+    user_ids = list(dict.fromkeys(user_ids))
+    if resource_type:
+        users = await _call_batch(resource_type, user_ids)
+        return {user_id: users.get(user_id) for user_id in user_ids}
+
+    results = await asyncio.gather(*[
+        _call_batch(resource_type, user_ids)
+        for resource_type in _sources('get_user')
+    ], return_exceptions=True)
+    errors = [x for x in results if isinstance(x, Exception)]
+    for error in errors:
+        if not isinstance(error, SocialException):
+            raise error
+    if len(errors) == len(results):
+        raise errors[0]
+
+    users = {}
+    # earlier resource types take priority for IDs found on several
+    for result in reversed(results):
+        if not isinstance(result, Exception):
+            users.update(result)
 
+    failed = errors[0] if errors else None
+    return {user_id: users.get(user_id, failed) for user_id in user_ids}
 
-def get_followers(
+
+async def get_articles(
+    user_id: str, count: int, resource_type: str = None,
+    since_id: Optional[int] = None, max_id: Optional[int] = None
+) -> List[Article]:
+    args = (count,)
+    if since_id is not None or max_id is not None:
+        args = (count, since_id, max_id)
+    return await _fetch(
+        'get_articles', user_id, resource_type, (SocialException,), *args,
+        merge=_concat,
+    )
+
+
+async def get_friends(
     user_id: str, count: int = 10, resource_type: str = None
 ) -> List[User]:
+    return await _fetch(
+        'get_friends', user_id, resource_type, (SocialException,), count,
+        merge=_concat,
+    )
 
-    if resource_type:
-        client = ClientFactory.create_client(resource_type)
-        return client.get_followers(user_id, count)
 
-    for resource_type in RESOURCE_TYPES:
-        client = ClientFactory.create_client(resource_type)
+async def get_followers(
+    user_id: str, count: int = 10, resource_type: str = None
+) -> List[User]:
+    return await _fetch(
+        'get_followers', user_id, resource_type, (SocialException,), count,
+        merge=_concat,
+    )
+
+
+# feed fetches per source in flight at once, shared by all feed requests;
+# one set per event loop, which python 3.8 binds a semaphore to
+_feed_slots: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+
+
+def _feed_slot(resource_type: str) -> asyncio.Semaphore:
+    slots = _feed_slots.setdefault(asyncio.get_running_loop(), {})
+    if resource_type not in slots:
+        slots[resource_type] = asyncio.Semaphore(
+            settings.FEED_SOURCE_CONCURRENCY
+        )
+    return slots[resource_type]
+
+
+async def _feed_call(call: Callable[[], Awaitable[Any]]) -> Any:
+
+    # the timeout starts once a slot is free, not while queued for one
+    try:
+        return await asyncio.wait_for(call(), settings.FEED_ACCOUNT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded()
+
+
+async def _fetch_timeline(resource_type: str, user_id: str, count: int) -> Any:
+    async with _feed_slot(resource_type):
+        try:
+            return await _feed_call(
+                lambda: _call(resource_type, 'get_articles', user_id, count)
+            )
+        except SocialException as e:
+            return e
+
+
+async def _fetch_timelines(
+    resource_type: str, user_ids: List[str], count: int
+) -> Dict[str, Any]:
+
+    # a whole chunk of walls costs one request of the rate limit, a failure
+    # of the call as a whole is the result of every account in it
+    client = AsyncClientFactory.create_client(resource_type)
+    async with _feed_slot(resource_type):
         try:
-            users = client.get_followers(user_id, count)
-            return users
-        except SocialException:
+            fetched = await _feed_call(lambda: _upstream(
+                resource_type, 'get_articles', 'get_timelines',
+                lambda: client.get_timelines(user_ids, count)
+            ))
+        except SocialException as e:
+            return dict.fromkeys(user_ids, e)
+
+    for user_id, value in fetched.items():
+        if isinstance(value, UserDoesNotExist):
+            negative_cache.add(resource_type, user_id, 'get_articles')
+        elif not isinstance(value, Exception):
+            source_index.add(user_id, resource_type)
+            await response_cache.set(
+                (resource_type, 'get_articles', user_id, count),
+                'get_articles', value
+            )
+    return fetched
+
+
+async def get_timelines(
+    accounts: List[Tuple[str, str]], count: int
+) -> Dict[Tuple[str, str], Any]:
+
+    # a slow or missing account only costs its own entry: the articles or
+    # the exception it ended with
+    accounts = list(dict.fromkeys(
+        (_resource_type(resource_type), user_id)
+        for resource_type, user_id in accounts
+    ))
+    results: Dict[Tuple[str, str], Any] = {}
+    singles: List[Tuple[str, str]] = []
+    batched: Dict[str, List[str]] = {}
+    for resource_type, user_id in accounts:
+        client = AsyncClientFactory.create_client(resource_type)
+        if not getattr(client, 'supports_bundle', False):
+            singles.append((resource_type, user_id))
             continue
+        # sources with `execute` get the walls the caches do not have
+        # fetched EXECUTE_MAX_CALLS at a time
+        if negative_cache.is_missing(resource_type, user_id, 'get_articles'):
+            results[(resource_type, user_id)] = UserDoesNotExist()
+            continue
+        found, value = await response_cache.get(
+            (resource_type, 'get_articles', user_id, count), 'get_articles'
+        )
+        if found:
+            results[(resource_type, user_id)] = value
+        else:
+            batched.setdefault(resource_type, []).append(user_id)
+
+    chunks = [
+        (resource_type, user_ids[i:i + EXECUTE_MAX_CALLS])
+        for resource_type, user_ids in batched.items()
+        for i in range(0, len(user_ids), EXECUTE_MAX_CALLS)
+    ]
+    values = await asyncio.gather(
+        *[_fetch_timeline(*x, count) for x in singles],
+        *[_fetch_timelines(*x, count) for x in chunks],
+    )
+    results.update(zip(singles, values))
+    for (resource_type, _), fetched in zip(chunks, values[len(singles):]):
+        results.update(
+            ((resource_type, user_id), value)
+            for user_id, value in fetched.items()
+        )
+    return {x: results[x] for x in accounts}
+
+
+def merge_feed(
+    results: Dict[Tuple[str, str], Any]
+) -> Iterator[Tuple[str, str, Article]]:
+
+    # a k-way merge: one heap entry per timeline, items are produced as
+    # the consumer asks for them
+    streams = [
+        [(resource_type, user_id, x) for x in sorted(
+            articles, key=lambda x: x.created_at, reverse=True
+        )]
+        for (resource_type, user_id), articles in results.items()
+        if not isinstance(articles, Exception)
+    ]
+    return heapq.merge(
+        *streams, key=lambda x: x[2].created_at, reverse=True
+    )
+
+
+async def get_mutual_friends(
+    user_id: str, other_id: str, resource_type: str = None
+) -> List[User]:
+
+    # answered from the snapshots alone, both friend lists have to have
+    # been fetched before
+    if snapshots is not None:
+        sources = guess_sources(user_id)
+        if resource_type:
+            sources = [_resource_type(resource_type)]
+        for resource_type in sources:
+            users = await run_in_threadpool(
+                snapshots.mutual, resource_type, user_id, other_id
+            )
+            if users is not None:
+                return users
+    raise UserDoesNotExist()
+
+
+_BUNDLE_OPERATIONS = {
+    BUNDLE_USER: 'get_user',
+    BUNDLE_ARTICLES: 'get_articles',
+    BUNDLE_FRIENDS: 'get_friends',
+    BUNDLE_FOLLOWERS: 'get_followers',
+}
+
+
+async def _call_bundle(
+    resource_type: str, user_id: str, include: List[str], count: int
+) -> Dict[str, Any]:
+
+    resource_type = _resource_type(resource_type)
+    sections = [BUNDLE_USER] + [x for x in BUNDLE_SECTIONS if x in include]
+    client = AsyncClientFactory.create_client(resource_type)
+
+    if not getattr(client, 'supports_bundle', False):
+        results = await asyncio.gather(*[
+            _call(
+                resource_type, _BUNDLE_OPERATIONS[section], user_id,
+                *([] if section == BUNDLE_USER else [count])
+            )
+            for section in sections
+        ], return_exceptions=True)
+        bundle = dict(zip(sections, results))
     else:
+        # sections share cache entries with their standalone endpoints,
+        # only the ones missing there go into the combined upstream call
+        bundle = {}
+        missing = []
+        for section in sections:
+            operation = _BUNDLE_OPERATIONS[section]
+            if negative_cache.is_missing(resource_type, user_id, operation):
+                bundle[section] = UserDoesNotExist()
+                continue
+            key = (resource_type, operation, user_id,
+                   None if section == BUNDLE_USER else count)
+            found, value = await response_cache.get(key, operation)
+            if found:
+                bundle[section] = value
+            else:
+                missing.append(section)
+
+        if missing:
+            # the user is part of every combined call
+            include = [x for x in missing if x != BUNDLE_USER]
+            # a combined call fails with the profile lookup, so it feeds
+            # the breaker _sources checks for the whole bundle
+            fetched = await _upstream(
+                resource_type, 'get_user', 'get_bundle',
+                lambda: client.get_bundle(user_id, include, count)
+            )
+            for section, value in fetched.items():
+                operation = _BUNDLE_OPERATIONS[section]
+                if isinstance(value, UserDoesNotExist):
+                    negative_cache.add(resource_type, user_id, operation)
+                elif not isinstance(value, Exception):
+                    key = (resource_type, operation, user_id,
+                           None if section == BUNDLE_USER else count)
+                    await response_cache.set(key, operation, value)
+                bundle[section] = value
+
+    if isinstance(bundle[BUNDLE_USER], Exception):
+        raise bundle[BUNDLE_USER]
+    source_index.add(user_id, resource_type)
+    return bundle
+
+
+async def get_bundle(
+    user_id: str, include: List[str], count: int = 10,
+    resource_type: str = None
+) -> Dict[str, Any]:
+
+    if resource_type:
+        return await _call_bundle(resource_type, user_id, include, count)
+
+    return await _resolve(
+        'get_user', user_id,
+        lambda x: _call_bundle(x, user_id, include, count),
+        (UserDoesNotExist,),
+    )
+
+
+async def _call_page(
+    resource_type: str, operation: str, user_id: str,
+    cursor: Optional[str], count: Optional[int]
+) -> Tuple[str, UsersPage]:
+
+    if negative_cache.is_missing(resource_type, user_id, operation):
         raise UserDoesNotExist()
+
+    client = AsyncClientFactory.create_client(resource_type)
+    request = getattr(client, operation + '_page')
+    try:
+        page = await _upstream(
+            resource_type, operation, operation + '_page',
+            lambda: request(user_id, cursor, count)
+        )
+    except UserDoesNotExist:
+        negative_cache.add(resource_type, user_id, operation)
+        raise
+
+    source_index.add(user_id, resource_type)
+    return resource_type, page
+
+
+async def _iter_pages(
+    operation: str, user_id: str, resource_type: Optional[str],
+    cursor: Optional[str], count: Optional[int]
+) -> AsyncIterator[UsersPage]:
+
+    # pages keep arriving after the endpoint returned, so every page gets
+    # a deadline of its own instead of sharing the request's one
+    set_deadline(settings.REQUEST_DEADLINE)
+
+    # cursors handed out are prefixed with the source they belong to, so
+    # a stream can be resumed without knowing where the user was found
+    if cursor:
+        source, _, cursor = cursor.partition(':')
+        # a cursor of another source than the one asked for is a mistake,
+        # not something to quietly follow
+        if source not in RESOURCE_TYPES or (
+                resource_type and _resource_type(resource_type) != source):
+            raise WrongCursor()
+        resource_type = source
+
+    if resource_type:
+        resource_type, page = await _call_page(
+            _resource_type(resource_type), operation, user_id, cursor, count
+        )
+    else:
+        resource_type, page = await _resolve(
+            operation, user_id,
+            lambda x: _call_page(x, operation, user_id, None, count),
+            (SocialException,),
+        )
+
+    while True:
+        next_cursor = None
+        if page.next_cursor:
+            next_cursor = '{}:{}'.format(resource_type, page.next_cursor)
+        yield UsersPage(users=page.users, next_cursor=next_cursor)
+
+        if not page.next_cursor:
+            return
+        set_deadline(settings.REQUEST_DEADLINE)
+        _, page = await _call_page(
+            resource_type, operation, user_id, page.next_cursor, count
+        )
+
+
+def iter_friends(
+    user_id: str, resource_type: str = None, cursor: str = None,
+    count: int = None
+) -> AsyncIterator[UsersPage]:
+    return prefetch(
+        _iter_pages('get_friends', user_id, resource_type, cursor, count),
+        settings.STREAM_PREFETCH_PAGES,
+    )
+
+
+def iter_followers(
+    user_id: str, resource_type: str = None, cursor: str = None,
+    count: int = None
+) -> AsyncIterator[UsersPage]:
+    return prefetch(
+        _iter_pages('get_followers', user_id, resource_type, cursor, count),
+        settings.STREAM_PREFETCH_PAGES,
+    )
+
+
+def get_health() -> dict:
+    states = breakers.stats()
+    degraded = any(x['state'] != 'closed' for x in states.values())
+    return {
+        'status': 'degraded' if degraded else 'ok',
+        'breakers': states,
+    }
+
+
+def get_stats() -> dict:
+    return {
+        'cache': response_cache.stats(),
+        'refresher': refresher.stats(),
+        'snapshots': (
+            snapshot_refresher.stats()
+            if snapshot_refresher is not None else None
+        ),
+        'negative_cache': negative_cache.stats(),
+        'source_index': source_index.stats(),
+        'singleflight': single_flight.stats(),
+        'batching': {
+            'enabled': settings.USER_BATCHING_ENABLED,
+            **user_batcher.stats(),
+        },
+        'rate_limits': governor.stats(),
+        'resilience': resilience.stats(),
+        'breakers': breakers.stats(),
+        'credentials': get_credential_stats(),
+    }
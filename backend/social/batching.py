@@ -0,0 +1,106 @@
+import asyncio
+from collections import Counter
+from typing import Callable, Dict, List
+
+from .async_clients import AsyncClient
+from .exceptions import UserDoesNotExist
+from .models import User
+
+
+class UserBatcher:
+
+    def __init__(
+        self,
+        window: float,
+        max_size: int,
+        create_client: Callable[[str], AsyncClient],
+    ):
+        self.window = window
+        self.max_size = max_size
+        self.create_client = create_client
+
+        self._pending: Dict[str, Dict[str, List[asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+
+        self.requests = 0
+        self.batches = 0
+        self.batched_ids = 0
+        self.batch_sizes = Counter()
+
+    async def get_user(self, resource_type: str, user_id: str) -> User:
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        pending = self._pending.setdefault(resource_type, {})
+        pending.setdefault(user_id, []).append(future)
+        self.requests += 1
+
+        if len(pending) >= self.max_size:
+            self._flush(resource_type)
+        elif resource_type not in self._timers:
+            self._timers[resource_type] = loop.call_later(
+                self.window, self._flush, resource_type
+            )
+
+        return await future
+
+    def _flush(self, resource_type: str) -> None:
+
+        timer = self._timers.pop(resource_type, None)
+        if timer is not None:
+            timer.cancel()
+
+        pending = self._pending.pop(resource_type, None)
+        if pending:
+            asyncio.ensure_future(self._dispatch(resource_type, pending))
+
+    async def _dispatch(
+        self, resource_type: str, pending: Dict[str, List[asyncio.Future]]
+    ) -> None:
+
+        self.batches += 1
+        self.batched_ids += len(pending)
+        self.batch_sizes[self._size_bucket(len(pending))] += 1
+
+        try:
+            client = self.create_client(resource_type)
+            users = await client.get_users(list(pending))
+        except Exception as e:
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for user_id, futures in pending.items():
+            user = users.get(user_id)
+            for future in futures:
+                if future.done():
+                    continue
+                if user is None:
+                    future.set_exception(UserDoesNotExist())
+                else:
+                    future.set_result(user)
+
+    @staticmethod
+    def _size_bucket(size: int) -> int:
+        bucket = 1
+        while bucket < size:
+            bucket *= 2
+        return bucket
+
+    def stats(self) -> dict:
+        return {
+            'window': self.window,
+            'max_size': self.max_size,
+            'requests': self.requests,
+            'batches': self.batches,
+            'average_batch_size': (
+                self.batched_ids / self.batches if self.batches else 0
+            ),
+            'batch_sizes': {
+                '<={}'.format(bucket): count
+                for bucket, count in sorted(self.batch_sizes.items())
+            },
+        }
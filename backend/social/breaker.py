@@ -0,0 +1,181 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Tuple
+
+from core import settings
+
+from .exceptions import (DeadlineExceeded, SocialConnectionError,
+                         SourceUnavailable, UnknownError, WrongServerResponse)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+# errors that say something about the upstream's health, a missing user
+# or a spent rate limit do not
+FAILURES = (
+    SocialConnectionError, UnknownError, WrongServerResponse,
+    DeadlineExceeded,
+)
+
+
+class CircuitBreaker:
+
+    def __init__(
+        self,
+        window: int,
+        min_calls: int,
+        failure_rate: float,
+        slow_call_seconds: float,
+        open_seconds: float,
+        half_open_calls: int,
+    ):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+
+        self.state = STATE_CLOSED
+        self.opened_at = 0.0
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._probes = 0
+        self._probe_successes = 0
+
+        self.opened = 0
+        self.rejected = 0
+
+    def _current_failure_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(self._outcomes) / len(self._outcomes)
+
+    def _open(self) -> None:
+        self.state = STATE_OPEN
+        self.opened_at = time.monotonic()
+        self.opened += 1
+
+    def _close(self) -> None:
+        self.state = STATE_CLOSED
+        self._outcomes.clear()
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.open_seconds - time.monotonic())
+
+    def is_open(self) -> bool:
+        return self.state == STATE_OPEN and self.retry_after() > 0
+
+    def allow(self) -> bool:
+
+        if self.state == STATE_OPEN:
+            if self.retry_after() > 0:
+                self.rejected += 1
+                return False
+            self.state = STATE_HALF_OPEN
+            self._probes = 0
+            self._probe_successes = 0
+
+        if self.state == STATE_HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                self.rejected += 1
+                return False
+            self._probes += 1
+
+        return True
+
+    def release(self) -> None:
+        # a cancelled probe says nothing, let another caller take its slot
+        if self.state == STATE_HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record(self, failed: bool, latency: float) -> None:
+
+        failed = failed or latency > self.slow_call_seconds
+
+        if self.state == STATE_HALF_OPEN:
+            if failed:
+                self._open()
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_calls:
+                self._close()
+            return
+
+        self._outcomes.append(failed)
+        if (len(self._outcomes) >= self.min_calls
+                and self._current_failure_rate() >= self.failure_rate):
+            self._open()
+
+    def stats(self) -> dict:
+        return {
+            'state': STATE_OPEN if self.is_open() else self.state,
+            'failure_rate': round(self._current_failure_rate(), 3),
+            'calls': len(self._outcomes),
+            'opened': self.opened,
+            'rejected': self.rejected,
+            'retry_after': round(self.retry_after(), 2),
+        }
+
+
+class BreakerRegistry:
+
+    def __init__(self, **params):
+        self.params = params
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, resource_type: str, operation: str) -> CircuitBreaker:
+        breaker = self._breakers.get((resource_type, operation))
+        if breaker is None:
+            breaker = CircuitBreaker(**self.params)
+            self._breakers[(resource_type, operation)] = breaker
+        return breaker
+
+    def is_open(self, resource_type: str, operation: str) -> bool:
+        breaker = self._breakers.get((resource_type, operation))
+        return breaker is not None and breaker.is_open()
+
+    async def call(
+        self, resource_type: str, operation: str,
+        fetch: Callable[[], Awaitable[Any]],
+    ) -> Any:
+
+        breaker = self.get(resource_type, operation)
+        if not breaker.allow():
+            raise SourceUnavailable(retry_after=breaker.retry_after())
+
+        started_at = time.monotonic()
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except FAILURES:
+            breaker.record(True, time.monotonic() - started_at)
+            raise
+        except Exception:
+            breaker.record(False, time.monotonic() - started_at)
+            raise
+
+        breaker.record(False, time.monotonic() - started_at)
+        return result
+
+    def reset(self) -> None:
+        self._breakers.clear()
+
+    def stats(self) -> dict:
+        return {
+            '{}:{}'.format(*key): breaker.stats()
+            for key, breaker in self._breakers.items()
+        }
+
+
+breakers = BreakerRegistry(
+    window=settings.BREAKER_WINDOW,
+    min_calls=settings.BREAKER_MIN_CALLS,
+    failure_rate=settings.BREAKER_FAILURE_RATE,
+    slow_call_seconds=settings.BREAKER_SLOW_CALL_SECONDS,
+    open_seconds=settings.BREAKER_OPEN_SECONDS,
+    half_open_calls=settings.BREAKER_HALF_OPEN_CALLS,
+)
@@ -0,0 +1,430 @@
+import asyncio
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import abstractmethod
+from collections import OrderedDict
+from typing import (Any, Awaitable, Callable, Dict, Hashable, List, Optional,
+                    Tuple)
+
+from core import settings
+from fastapi.logger import logger
+from starlette.concurrency import run_in_threadpool
+
+from . import codec
+from .models import Article, User
+from .resilience import set_deadline
+from .tracing import tracer
+
+
+class LRUCache:
+
+    def __init__(self, maxsize: int, grace: float = 0.0):
+        self.maxsize = maxsize
+        # expired entries are kept this much longer to be served stale
+        self.grace = grace
+        self._data: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def ttl(self, key: Hashable) -> Optional[float]:
+
+        # negative for stale entries, None once they are gone
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        remaining = entry[0] - time.monotonic()
+        if remaining <= -self.grace:
+            del self._data[key]
+            return None
+        return remaining
+
+    def get_with_ttl(self, key: Hashable) -> Tuple[bool, Any, float]:
+
+        remaining = self.ttl(key)
+        if remaining is None:
+            self.misses += 1
+            return False, None, 0.0
+
+        self._data.move_to_end(key)
+        if remaining > 0:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+        return True, self._data[key][1], remaining
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+
+        remaining = self.ttl(key)
+        if remaining is None or remaining <= 0:
+            self.misses += 1
+            return False, None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return True, self._data[key][1]
+
+    def set(self, key: Hashable, value: Any, ttl: float) -> None:
+
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def items(self) -> List[Tuple[Hashable, Any, float]]:
+        # live entries with their remaining ttl, least recently used first
+        now = time.monotonic()
+        return [
+            (key, value, expires_at - now)
+            for key, (expires_at, value) in self._data.items()
+            if expires_at > now
+        ]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+class HotKeys:
+
+    # request counts per key, halved on every decay so the ranking follows
+    # current traffic rather than all-time totals
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.counts: Dict[Hashable, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def add(self, key: Hashable) -> None:
+        if self.maxsize <= 0:
+            return
+        self.counts[key] = self.counts.get(key, 0.0) + 1
+        if len(self.counts) > 2 * self.maxsize:
+            self.counts = dict(self._largest(self.maxsize))
+
+    def _largest(self, n: int) -> List[Tuple[Hashable, float]]:
+        return heapq.nlargest(n, self.counts.items(), key=lambda x: x[1])
+
+    def top(self, n: int) -> List[Hashable]:
+        return [key for key, _ in self._largest(n)]
+
+    def decay(self) -> None:
+        self.counts = {
+            key: count / 2 for key, count in self.counts.items()
+            if count >= 1
+        }
+
+
+class CacheBackend:
+
+    @abstractmethod
+    def get(self, key: str) -> Tuple[bool, Any, float]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        pass
+
+
+class SQLiteCacheBackend(CacheBackend):
+
+    purge_every = 1000
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', mode=0o700, exist_ok=True)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._connection = sqlite3.connect(
+            path, timeout=5, check_same_thread=False, isolation_level=None
+        )
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS response_cache ('
+                'key TEXT PRIMARY KEY, value BLOB, expires_at REAL)'
+            )
+
+    def get(self, key: str) -> Tuple[bool, Any, float]:
+
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value, expires_at FROM response_cache '
+                'WHERE key = ? AND expires_at > ?',
+                (key, time.time())
+            ).fetchone()
+
+        if row is None:
+            return False, None, 0
+        # plain JSON: the file is shared, unlike pickle reading it never
+        # runs code
+        return True, codec.loads(row[0]), row[1] - time.time()
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO response_cache '
+                '(key, value, expires_at) VALUES (?, ?, ?)',
+                (key, codec.dumps(value), now + ttl)
+            )
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._connection.execute(
+                    'DELETE FROM response_cache WHERE expires_at <= ?',
+                    (now,)
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class ResponseCache:
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttls: Dict[str, float],
+        shared: Optional[CacheBackend] = None,
+        grace: float = 0.0,
+        hot_keys: int = 0,
+        models: Optional[Dict[str, type]] = None,
+    ):
+        self.local = LRUCache(maxsize, grace)
+        self.shared = shared
+        self.ttls = ttls
+        # operation -> model its values are rebuilt as from the shared tier
+        self.models = models or {}
+        self.hot_keys = HotKeys(hot_keys)
+        self._refreshing: Dict[Hashable, asyncio.Future] = {}
+
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self.revalidations = 0
+        self.refresh_errors = 0
+
+    @staticmethod
+    def _shared_key(key: tuple) -> str:
+        return json.dumps(key)
+
+    async def get(self, key: tuple, operation: str) -> Tuple[bool, Any]:
+
+        if self.ttls.get(operation, 0) <= 0:
+            return False, None
+
+        found, value = self.local.get(key)
+        if found or self.shared is None:
+            return found, value
+        return await self._get_shared(key, operation)
+
+    async def _get_shared(
+        self, key: tuple, operation: str
+    ) -> Tuple[bool, Any]:
+
+        found, value, remaining = await run_in_threadpool(
+            self.shared.get, self._shared_key(key)
+        )
+        if found:
+            value = self._rebuild(operation, value)
+            self.shared_hits += 1
+            self.local.set(key, value, min(self.ttls[operation], remaining))
+        else:
+            self.shared_misses += 1
+        return found, value
+
+    def _rebuild(self, operation: str, value: Any) -> Any:
+        model = self.models.get(operation)
+        if model is None:
+            return value
+        if isinstance(value, list):
+            return [model.construct(**x) for x in value]
+        return model.construct(**value)
+
+    async def set(self, key: tuple, operation: str, value: Any) -> None:
+
+        ttl = self.ttls.get(operation, 0)
+        if ttl <= 0:
+            return
+
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            await run_in_threadpool(
+                self.shared.set, self._shared_key(key), value, ttl
+            )
+
+    async def get_or_fetch(
+        self, key: tuple, operation: str,
+        fetch: Callable[[], Awaitable[Any]],
+    ) -> Any:
+
+        if self.ttls.get(operation, 0) <= 0:
+            return await fetch()
+
+        self.hot_keys.add(key)
+        found, value, remaining = self.local.get_with_ttl(key)
+        if found:
+            if remaining <= 0:
+                # within the grace window: answer with the stale value, a
+                # single refresh runs behind it
+                self.revalidate(key, operation, fetch)
+            return value
+
+        if self.shared is not None:
+            found, value = await self._get_shared(key, operation)
+            if found:
+                return value
+
+        value = await fetch()
+        await self.set(key, operation, value)
+        return value
+
+    async def refresh(
+        self, key: tuple, operation: str,
+        fetch: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        value = await fetch()
+        await self.set(key, operation, value)
+        return value
+
+    def is_refreshing(self, key: tuple) -> bool:
+        return key in self._refreshing
+
+    def revalidate(
+        self, key: tuple, operation: str,
+        fetch: Callable[[], Awaitable[Any]],
+    ) -> None:
+
+        if key in self._refreshing:
+            return
+        task = asyncio.ensure_future(self._revalidate(key, operation, fetch))
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+        self._refreshing[key] = task
+
+    async def _revalidate(
+        self, key: tuple, operation: str,
+        fetch: Callable[[], Awaitable[Any]],
+    ) -> None:
+
+        # outlives the request that found the stale entry, so it gets a
+        # trace and a deadline of its own
+        set_deadline(settings.REQUEST_DEADLINE)
+        with tracer.start_trace('cache.revalidate'):
+            try:
+                await self.refresh(key, operation, fetch)
+                self.revalidations += 1
+            except Exception as e:
+                self.refresh_errors += 1
+                logger.warning(
+                    "ResponseCache._revalidate(), e = {}".format(repr(e))
+                )
+
+    def clear(self) -> None:
+        self.local.clear()
+
+    def stats(self) -> dict:
+        stats = self.local.stats()
+        if self.shared is not None:
+            stats['shared_hits'] = self.shared_hits
+            stats['shared_misses'] = self.shared_misses
+        stats['revalidations'] = self.revalidations
+        stats['refresh_errors'] = self.refresh_errors
+        stats['refreshing'] = len(self._refreshing)
+        return stats
+
+
+class NegativeCache:
+
+    # A missing profile means every lookup for that ID is missing, other
+    # operations may fail for a private wall or list only.
+    authoritative_operation = 'get_user'
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.entries = LRUCache(maxsize)
+        self.ttl = ttl
+
+    def is_missing(
+        self, resource_type: str, user_id: str, operation: str
+    ) -> bool:
+
+        found, operations = self.entries.get((resource_type, user_id))
+        if not found:
+            return False
+        return (self.authoritative_operation in operations
+                or operation in operations)
+
+    def add(self, resource_type: str, user_id: str, operation: str) -> None:
+
+        found, operations = self.entries.get((resource_type, user_id))
+        operations = (operations if found else frozenset()) | {operation}
+        self.entries.set((resource_type, user_id), operations, self.ttl)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        return self.entries.stats()
+
+
+def _create_shared_backend() -> Optional[CacheBackend]:
+
+    backend = getattr(settings, 'CACHE_SHARED_BACKEND', '')
+    if backend == 'sqlite':
+        return SQLiteCacheBackend(settings.CACHE_SHARED_PATH)
+    return None
+
+
+def create_response_cache() -> ResponseCache:
+
+    enabled = getattr(settings, 'CACHE_ENABLED', True)
+    return ResponseCache(
+        maxsize=settings.CACHE_MAX_SIZE if enabled else 0,
+        ttls={
+            'get_user': settings.CACHE_USER_TTL,
+            'get_articles': settings.CACHE_ARTICLES_TTL,
+            'get_friends': settings.CACHE_FRIENDS_TTL,
+            'get_followers': settings.CACHE_FOLLOWERS_TTL,
+        } if enabled else {},
+        shared=_create_shared_backend() if enabled else None,
+        grace=settings.CACHE_STALE_GRACE,
+        # candidates tracked for the proactive refresher, none when it is off
+        hot_keys=settings.CACHE_REFRESH_TOP_N * 10,
+        models={
+            'get_user': User,
+            'get_articles': Article,
+            'get_friends': User,
+            'get_followers': User,
+        },
+    )
+
+
+response_cache = create_response_cache()
+# newest posts per user for incremental article fetching
+timelines = LRUCache(settings.CACHE_MAX_SIZE)
+negative_cache = NegativeCache(
+    maxsize=settings.NEGATIVE_CACHE_MAX_SIZE,
+    ttl=settings.NEGATIVE_CACHE_TTL,
+)
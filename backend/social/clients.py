@@ -1,31 +1,73 @@
 import json
+import threading
+import time
 from abc import abstractmethod
-from typing import List
+from typing import (Any, Callable, Dict, Iterator, List, Optional, Tuple,
+                    Type)
 from urllib.parse import urlencode, urljoin
 
 import httplib2
 import oauth2
 import requests
 from core import settings
-from fastapi.logger import logger
-from pydantic import ValidationError, parse_obj_as
-
-from .constants import RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK
-from .exceptions import (AuthorizationError, SocialConnectionError,
-                         UnknownError, UserDoesNotExist, WrongResourceType,
+from pydantic import BaseModel, ValidationError, parse_obj_as
+
+from . import codec
+from .constants import (BUNDLE_ARTICLES, BUNDLE_FOLLOWERS, BUNDLE_FRIENDS,
+                        BUNDLE_USER, RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK)
+from .exceptions import (AuthorizationError, InvalidCredentials,
+                         RateLimitExceeded, SocialConnectionError,
+                         SocialException, UnknownError, UpstreamServerError,
+                         UserDoesNotExist, WrongCursor, WrongResourceType,
                          WrongServerResponse)
-from .models import (Article, TwitterArticle, TwitterUser, User, VKArticle,
-                     VKUser)
+from .logs import log_error, log_response
+from .metrics import observe_upstream, upstream_in_flight
+from .models import (Article, TwitterArticle, TwitterUser, User, UsersPage,
+                     VKArticle, VKUser)
+from .ratelimit import governor
+from .tracing import span
+
+
+def _decode(body: bytes) -> Any:
+    with span('json.decode', bytes=len(body)):
+        try:
+            return codec.loads(body)
+        except json.JSONDecodeError:
+            raise WrongServerResponse()
+
+
+def _parse_models(model: Type[BaseModel], items: Any) -> list:
+
+    # trusted payloads skip validation and are mapped field by field,
+    # a shape mismatch still surfaces as a bad server response
+    with span('models.parse', model=model.__name__):
+        try:
+            if settings.TRUST_UPSTREAM_PAYLOADS:
+                return [model.from_trusted(x) for x in items]
+            return parse_obj_as(List[model], items)
+        except (ValidationError, KeyError, TypeError, AttributeError):
+            raise WrongServerResponse()
 
 
 class Client:
 
+    users_batch_size = 100
+    # whether get_bundle() folds all sections into a single upstream call
+    supports_bundle = False
+
     @abstractmethod
     def get_user(self, user_id: str) -> User:
         pass
 
     @abstractmethod
-    def get_articles(self, user_id: str, count: int = 10) -> List[Article]:
+    def get_users(self, user_ids: List[str]) -> Dict[str, User]:
+        pass
+
+    @abstractmethod
+    def get_articles(
+        self, user_id: str, count: int = 10, since_id: Optional[int] = None,
+        max_id: Optional[int] = None
+    ) -> List[Article]:
         pass
 
     @abstractmethod
@@ -36,16 +78,59 @@ class Client:
     def get_followers(self, user_id: str, count: int = 10) -> List[User]:
         pass
 
+    @abstractmethod
+    def get_friends_page(
+        self, user_id: str, cursor: Optional[str] = None,
+        count: Optional[int] = None
+    ) -> UsersPage:
+        pass
+
+    @abstractmethod
+    def get_followers_page(
+        self, user_id: str, cursor: Optional[str] = None,
+        count: Optional[int] = None
+    ) -> UsersPage:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    @classmethod
+    def _chunks(cls, user_ids: List[str]) -> Iterator[List[str]]:
+        user_ids = list(dict.fromkeys(user_ids))
+        for i in range(0, len(user_ids), cls.users_batch_size):
+            yield user_ids[i:i + cls.users_batch_size]
+
+    @staticmethod
+    def _match_users(
+        user_ids: List[str], users: List[User]
+    ) -> Dict[str, User]:
+
+        index = {}
+        for user in users:
+            index[str(user.id)] = user
+            index[user.screen_name.lower()] = user
+
+        return {
+            user_id: index[user_id.lower()]
+            for user_id in user_ids if user_id.lower() in index
+        }
+
 
 class TwitterClient(Client):
 
-    api_base_URL = 'https://api.twitter.com/1.1/'
+    api_base_URL = settings.TWITTER_API_BASE_URL
+    # used when a 429 comes without x-rate-limit-reset
+    rate_limit_backoff = 60
 
     user_api_url = urljoin(api_base_URL, 'users/lookup.json')
     friends_api_url = urljoin(api_base_URL, 'friends/list.json')
     followers_api_url = urljoin(api_base_URL, 'followers/list.json')
     articles_api_url = urljoin(api_base_URL, 'statuses/user_timeline.json')
 
+    friends_page_size = 200
+    followers_page_size = 200
+
     def __init__(self):
         self.consumer_key = settings.TWITTER_API_KEY
         self.consumer_secret = settings.TWITTER_API_SECRET_KEY
@@ -63,11 +148,21 @@ class TwitterClient(Client):
             self.proxy_server_ip = None
             self.proxy_server_port = None
 
+        self.consumer = oauth2.Consumer(key=self.consumer_key,
+                                        secret=self.consumer_secret)
+        self.token = oauth2.Token(key=self.access_token,
+                                  secret=self.access_token_secret)
+
+        # httplib2 connections are not thread-safe, keep one per thread
+        self._local = threading.local()
+        self._oauth_clients: List[oauth2.Client] = []
+
     def _get_oauth_client(self) -> oauth2.Client:
-        consumer = oauth2.Consumer(key=self.consumer_key,
-                                   secret=self.consumer_secret)
-        access_token = oauth2.Token(key=self.access_token,
-                                    secret=self.access_token_secret)
+
+        client = getattr(self._local, 'oauth_client', None)
+        if client is not None:
+            return client
+
         if self.proxy_server_ip:
             proxy_info = httplib2.ProxyInfo(
                 httplib2.socks.PROXY_TYPE_HTTP_NO_TUNNEL,
@@ -77,165 +172,249 @@ class TwitterClient(Client):
         else:
             proxy_info = None
 
-        return oauth2.Client(consumer, access_token, proxy_info=proxy_info)
-
-    def get_user(self, user_id: str) -> User:
-
-        client = self._get_oauth_client()
-        params = {'user_id' if user_id.isnumeric() else 'screen_name': user_id}
-        request_url = '{}?{}'.format(self.user_api_url, urlencode(params))
-
-        try:
-            response, data = client.request(request_url)
-        except (requests.exceptions.HTTPError,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.Timeout,
-                requests.exceptions.RequestException) as e:
-            logger.warning("TwitterClient.get_user(), e = {}".format(e))
-            raise SocialConnectionError()
-
-        logger.info("TwitterClient.get_user(), data = {}".format(data))
-
-        if response.status == 404:
-            raise UserDoesNotExist()
-        elif response.status == 401:
-            raise AuthorizationError()
-        elif response.status != 200:
-            raise UnknownError()
-
-        try:
-            data = json.loads(data)
-        except json.JSONDecodeError:
-            raise WrongServerResponse()
-
-        if not data:
-            raise UserDoesNotExist()
-
-        try:
-            return parse_obj_as(TwitterUser, data[0])
-        except ValidationError:
-            raise WrongServerResponse()
+        client = oauth2.Client(self.consumer, self.token,
+                               proxy_info=proxy_info,
+                               timeout=settings.HTTP_READ_TIMEOUT)
+        self._local.oauth_client = client
+        self._oauth_clients.append(client)
+        return client
 
-    def get_articles(self, user_id: str, count: int = 10) -> List[Article]:
+    def close(self) -> None:
+        clients, self._oauth_clients = self._oauth_clients, []
+        for client in clients:
+            client.close()
+        self._local = threading.local()
 
-        client = self._get_oauth_client()
+    @staticmethod
+    def _build_url(api_url: str, user_id: str, **params) -> str:
         params = {
             'user_id' if user_id.isnumeric() else 'screen_name': user_id,
-            'count': count,
+            **params,
         }
-        request_url = '{}?{}'.format(self.articles_api_url, urlencode(params))
-
-        try:
-            response, data = client.request(request_url)
-        except (requests.exceptions.HTTPError,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.Timeout,
-                requests.exceptions.RequestException) as e:
-            logger.warning("TwitterClientt.get_articles(), e = {}".format(e))
-            raise SocialConnectionError()
+        return '{}?{}'.format(api_url, urlencode(params))
+
+    def _build_page_url(
+        self, api_url: str, user_id: str, cursor: Optional[str],
+        count: Optional[int], max_count: int
+    ) -> str:
+        if cursor and not cursor.lstrip('-').isdigit():
+            raise WrongCursor()
+        count = min(count or max_count, max_count)
+        return self._build_url(
+            api_url, user_id, count=count, cursor=cursor or -1
+        )
 
-        logger.info("TwitterClient.get_articles(), data = {}".format(data))
+    def _build_articles_url(
+        self, user_id: str, count: int, since_id: Optional[int],
+        max_id: Optional[int]
+    ) -> str:
+        params = {'count': count}
+        if since_id is not None:
+            params['since_id'] = since_id
+        if max_id is not None:
+            params['max_id'] = max_id
+        return self._build_url(self.articles_api_url, user_id, **params)
+
+    def _build_lookup_url(self, user_ids: List[str]) -> str:
+        user_id = [x for x in user_ids if x.isnumeric()]
+        screen_name = [x for x in user_ids if not x.isnumeric()]
+
+        params = {}
+        if user_id:
+            params['user_id'] = ','.join(user_id)
+        if screen_name:
+            params['screen_name'] = ','.join(screen_name)
+        return '{}?{}'.format(self.user_api_url, urlencode(params))
+
+    def _endpoint(self, request_url: str) -> str:
+        return request_url[len(self.api_base_URL):].split('?', 1)[0]
+
+    def _request(self, request_url: str) -> Any:
 
-        if response.status == 404:
-            raise UserDoesNotExist()
-        elif response.status == 401:
-            raise AuthorizationError()
-        elif response.status != 200:
-            raise UnknownError()
+        client = self._get_oauth_client()
+        endpoint = self._endpoint(request_url)
+        governor.acquire_blocking(
+            RESOURCE_TYPE_TWITTER, endpoint, self.access_token
+        )
 
-        try:
-            data = json.loads(data)
-        except json.JSONDecodeError:
-            raise WrongServerResponse()
+        upstream_in_flight.inc(RESOURCE_TYPE_TWITTER)
+        started_at = time.monotonic()
+        with span(
+            'http', source=RESOURCE_TYPE_TWITTER, endpoint=endpoint
+        ) as http_span:
+            try:
+                response, data = client.request(request_url)
+            except (httplib2.HttpLib2Error,
+                    OSError,
+                    requests.exceptions.HTTPError,
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.RequestException) as e:
+                observe_upstream(
+                    RESOURCE_TYPE_TWITTER, endpoint, 'error', started_at
+                )
+                log_error(RESOURCE_TYPE_TWITTER, endpoint, started_at, e)
+                raise SocialConnectionError()
+            finally:
+                upstream_in_flight.dec(RESOURCE_TYPE_TWITTER)
+            http_span.set(status=response.status, bytes=len(data))
+
+        observe_upstream(
+            RESOURCE_TYPE_TWITTER, endpoint, response.status, started_at,
+            len(data)
+        )
+        log_response(
+            RESOURCE_TYPE_TWITTER, endpoint, response.status, started_at, data
+        )
+        reset_in = governor.update_from_headers(
+            RESOURCE_TYPE_TWITTER, endpoint, self.access_token, response
+        )
 
         try:
-            return parse_obj_as(List[TwitterArticle], data)
-        except ValidationError:
-            raise WrongServerResponse()
+            return self._parse_response(response.status, data)
+        except RateLimitExceeded:
+            retry_after = reset_in or self.rate_limit_backoff
+            governor.block(
+                RESOURCE_TYPE_TWITTER, endpoint, self.access_token,
+                retry_after
+            )
+            raise RateLimitExceeded(retry_after=retry_after)
 
-    def get_friends(self, user_id: str, count: int = 10) -> List[User]:
-
-        client = self._get_oauth_client()
-        params = {
-            'user_id' if user_id.isnumeric() else 'screen_name': user_id,
-            'count': count
-        }
-        request_url = '{}?{}'.format(self.friends_api_url, urlencode(params))
+    # "Could not authenticate you", "Invalid or expired token" and "Bad
+    # authentication data"; other 401s are about the resource asked for
+    invalid_credentials_codes = (32, 89, 215)
 
+    @classmethod
+    def _auth_error(cls, data: bytes) -> AuthorizationError:
         try:
-            response, data = client.request(request_url)
-        except (requests.exceptions.HTTPError,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.Timeout,
-                requests.exceptions.RequestException) as e:
-            logger.warning("TwitterClient.get_friends(), e = {}".format(e))
-            raise SocialConnectionError()
-
-        logger.info("TwitterClient.get_friends(), data = {}".format(data))
-
-        if response.status == 404:
+            errors = _decode(data).get('errors', None) or []
+            codes = {x.get('code', None) for x in errors}
+        except (WrongServerResponse, AttributeError):
+            codes = set()
+        if codes & set(cls.invalid_credentials_codes):
+            return InvalidCredentials()
+        return AuthorizationError()
+
+    @classmethod
+    def _parse_response(cls, status: int, data: bytes) -> Any:
+
+        if status == 404:
             raise UserDoesNotExist()
-        elif response.status == 401:
-            raise AuthorizationError()
-        elif response.status != 200:
+        elif status in (401, 403):
+            raise cls._auth_error(data)
+        elif status == 429:
+            raise RateLimitExceeded()
+        elif status >= 500:
+            raise UpstreamServerError()
+        elif status != 200:
             raise UnknownError()
 
-        try:
-            data = json.loads(data)
-        except json.JSONDecodeError:
-            raise WrongServerResponse()
+        return _decode(data)
 
-        try:
-            return parse_obj_as(List[TwitterUser], data.get('users', []))
-        except ValidationError:
-            raise WrongServerResponse()
+    @staticmethod
+    def _parse_user(data: Any) -> User:
 
-    def get_followers(self, user_id: str, count: int = 10) -> List[User]:
+        if not data:
+            raise UserDoesNotExist()
 
-        client = self._get_oauth_client()
-        params = {
-            'user_id' if user_id.isnumeric() else 'screen_name': user_id,
-            'count': count
-        }
-        request_url = '{}?{}'.format(self.followers_api_url, urlencode(params))
+        return _parse_models(TwitterUser, data[:1])[0]
 
-        try:
-            response, data = client.request(request_url)
-        except (requests.exceptions.HTTPError,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.Timeout,
-                requests.exceptions.RequestException) as e:
-            logger.warning("TwitterClient.get_followers(), e = {}".format(e))
-            raise SocialConnectionError()
+    @staticmethod
+    def _parse_user_list(data: Any) -> List[User]:
+        return _parse_models(TwitterUser, data or [])
 
-        logger.info("TwitterClient.get_followers(), data = {}".format(data))
+    @staticmethod
+    def _parse_articles(data: Any) -> List[Article]:
+        return _parse_models(TwitterArticle, data)
 
-        if response.status == 404:
-            raise UserDoesNotExist()
-        elif response.status == 401:
-            raise AuthorizationError()
-        elif response.status != 200:
-            raise UnknownError()
+    @staticmethod
+    def _parse_users(data: Any) -> List[User]:
+        return _parse_models(TwitterUser, data.get('users', []))
+
+    @classmethod
+    def _parse_users_page(cls, data: Any) -> UsersPage:
+        next_cursor = data.get('next_cursor_str', None)
+        return UsersPage(
+            users=cls._parse_users(data),
+            next_cursor=None if next_cursor in (None, '0') else next_cursor,
+        )
 
-        try:
-            data = json.loads(data)
-        except json.JSONDecodeError:
-            raise WrongServerResponse()
+    def get_user(self, user_id: str) -> User:
+        data = self._request(self._build_url(self.user_api_url, user_id))
+        return self._parse_user(data)
+
+    def get_users(self, user_ids: List[str]) -> Dict[str, User]:
+        users = []
+        for chunk in self._chunks(user_ids):
+            try:
+                data = self._request(self._build_lookup_url(chunk))
+            except UserDoesNotExist:
+                continue
+            users.extend(self._parse_user_list(data))
+        return self._match_users(user_ids, users)
+
+    def get_articles(
+        self, user_id: str, count: int = 10, since_id: Optional[int] = None,
+        max_id: Optional[int] = None
+    ) -> List[Article]:
+        data = self._request(
+            self._build_articles_url(user_id, count, since_id, max_id)
+        )
+        return self._parse_articles(data)
 
-        try:
-            return parse_obj_as(List[TwitterUser], data.get('users', []))
-        except ValidationError:
-            raise WrongServerResponse()
+    def get_friends(self, user_id: str, count: int = 10) -> List[User]:
+        data = self._request(
+            self._build_url(self.friends_api_url, user_id, count=count)
+        )
+        return self._parse_users(data)
+
+    def get_followers(self, user_id: str, count: int = 10) -> List[User]:
+        data = self._request(
+            self._build_url(self.followers_api_url, user_id, count=count)
+        )
+        return self._parse_users(data)
+
+    def get_friends_page(
+        self, user_id: str, cursor: Optional[str] = None,
+        count: Optional[int] = None
+    ) -> UsersPage:
+        data = self._request(self._build_page_url(
+            self.friends_api_url, user_id, cursor, count,
+            self.friends_page_size
+        ))
+        return self._parse_users_page(data)
+
+    def get_followers_page(
+        self, user_id: str, cursor: Optional[str] = None,
+        count: Optional[int] = None
+    ) -> UsersPage:
+        data = self._request(self._build_page_url(
+            self.followers_api_url, user_id, cursor, count,
+            self.followers_page_size
+        ))
+        return self._parse_users_page(data)
 
 
 class VKClient(Client):
 
-    api_base_URL = 'https://api.vk.com/method/'
+    api_base_URL = settings.VK_API_BASE_URL
+    # VK limits are per second, error 6 clears up almost immediately
+    rate_limit_backoff = 1
 
     user_api_url = urljoin(api_base_URL, 'users.get')
     wall_api_url = urljoin(api_base_URL, 'wall.get')
     friends_api_url = urljoin(api_base_URL, 'friends.get')
     followers_api_url = urljoin(api_base_URL, 'users.getFollowers')
+    execute_api_url = urljoin(api_base_URL, 'execute')
+
+    user_fields = 'followers_count,common_count,photo,screen_name'
+
+    users_batch_size = 1000
+    friends_page_size = 5000
+    followers_page_size = 1000
+    max_wall_count = 100
+    delta_page_size = 5
+    supports_bundle = True
 
     def __init__(self):
         self.access_token = getattr(settings, 'VK_ACCESS_TOKEN', None)
@@ -252,179 +431,426 @@ class VKClient(Client):
         else:
             self.proxies = None
 
-    def get_user(self, user_id: str) -> User:
-        params = {
+        self._http_session: Optional[requests.Session] = None
+        # the thread pool client calls in from many threads at once
+        self._http_session_lock = threading.Lock()
+
+    def _get_http_session(self) -> requests.Session:
+
+        session = self._http_session
+        if session is not None:
+            return session
+        with self._http_session_lock:
+            if self._http_session is None:
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_maxsize=settings.HTTP_POOL_MAX_KEEPALIVE_CONNECTIONS
+                )
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._http_session = session
+            return self._http_session
+
+    def close(self) -> None:
+        with self._http_session_lock:
+            if self._http_session is not None:
+                self._http_session.close()
+                self._http_session = None
+
+    def _user_params(self, user_id: str) -> dict:
+        return {
             'user_ids': user_id,
             'v': '5.89',
             'access_token': self.access_token,
-            'fields': 'followers_count,common_count,photo,screen_name'
+            'fields': self.user_fields,
         }
 
-        try:
-            response = requests.get(
-                self.user_api_url, params, proxies=self.proxies
-            )
-        except (requests.exceptions.HTTPError,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.Timeout,
-                requests.exceptions.RequestException) as e:
-            logger.warning("VKClient.get_user(), e = {}".format(e))
-            raise SocialConnectionError()
-
-        logger.info("VKClient.get_user(), data = {}".format(response.text))
-
-        try:
-            data = response.json()
-        except json.JSONDecodeError:
-            raise WrongServerResponse()
-
-        error = data.get('error', None)
-        if error:
-            if error.get('error_code', None) in [113, 100, 15, 18, 30]:
-                raise UserDoesNotExist()
-            elif error.get('error_code', None) in [5, 16]:
-                raise AuthorizationError()
-            else:
-                raise UnknownError()
-
-        data = data.get('response', [])
-        if len(data) == 0 or data[0].get('deactivated', None) == "deleted":
-            raise UserDoesNotExist()
-
-        try:
-            return parse_obj_as(VKUser, data[0])
-        except ValidationError:
-            raise WrongServerResponse()
-
-    def get_articles(self, user_id: str, count: int = 10) -> List[Article]:
-
+    def _articles_params(
+        self, user_id: str, count: int, offset: int = 0
+    ) -> dict:
         params = {
             'owner_id': user_id,
             'v': '5.89',
             'access_token': self.access_token,
             'count': count,
         }
+        if offset:
+            params['offset'] = offset
+        return params
+
+    def _wall_pages(
+        self, count: int, since_id: Optional[int]
+    ) -> Iterator[Tuple[int, int]]:
+
+        # wall.get has no since_id: posts come newest first, so a delta
+        # starts with a small page and grows it until a known post shows up;
+        # every page is a rate limited call, so there are only so many
+        offset = 0
+        page = min(count, self.max_wall_count)
+        if since_id is not None:
+            page = min(page, self.delta_page_size)
+        for _ in range(settings.VK_WALL_MAX_PAGES):
+            yield offset, page
+            offset += page
+            page = min(page * 2, self.max_wall_count)
 
-        try:
-            response = requests.get(
-                self.wall_api_url, params, proxies=self.proxies
-            )
-        except (requests.exceptions.HTTPError,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.Timeout,
-                requests.exceptions.RequestException) as e:
-            logger.info("VKClient.get_articles(), e = {}".format(e))
-            raise SocialConnectionError()
-
-        logger.info("VKClient.get_articles(), data = {}".format(response.text))
-
-        try:
-            data = response.json()
-        except json.JSONDecodeError:
-            raise SocialConnectionError()
+    @staticmethod
+    def _wall_page(
+        data: Any, offset: int, page: int, since_id: Optional[int],
+        max_id: Optional[int]
+    ) -> Tuple[list, bool]:
+
+        # posts of the page inside (since_id, max_id] and whether the
+        # pages after it cannot add any
+        data = data or {}
+        items = data.get('items', [])
+        kept = []
+        for item in items:
+            if since_id is not None and item['id'] <= since_id:
+                # a pinned post comes first whatever its age
+                if item.get('is_pinned', 0):
+                    continue
+                return kept, True
+            if max_id is None or item['id'] <= max_id:
+                kept.append(item)
+        done = len(items) < page or offset + page >= data.get('count', 0)
+        return kept, done
 
-        error = data.get('error', None)
-        if error:
-            if error.get('error_code', None) in [113, 100, 15, 18, 30]:
-                raise UserDoesNotExist()
-            elif error.get('error_code', None) in [5, 16]:
-                raise AuthorizationError()
-            else:
-                raise UnknownError()
-
-        articles = data.get('response', {}).get('items', [])
-        try:
-            return parse_obj_as(List[VKArticle], articles)
-        except ValidationError:
-            raise WrongServerResponse(VKUser)
+    @staticmethod
+    def _parse_wall(items: list, count: int) -> List[Article]:
+        items = sorted(items, key=lambda x: x['id'], reverse=True)
+        return _parse_models(VKArticle, items[:count])
 
-    def get_friends(self, user_id: str, count: int = 10) -> List[User]:
-        params = {
+    def _users_params(self, user_id: str, count: int) -> dict:
+        return {
             'user_id': user_id,
             'v': '5.21',
             'access_token': self.access_token,
             'count': count,
             'name_case': 'ins',
-            'fields': 'followers_count,common_count,photo,screen_name',
+            'fields': self.user_fields,
         }
 
-        try:
-            response = requests.get(
-                self.friends_api_url, params, proxies=self.proxies
-            )
-        except (requests.exceptions.HTTPError,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.Timeout,
-                requests.exceptions.RequestException) as e:
-            logger.info("VKClient.get_friends(), e = {}".format(e))
-            raise SocialConnectionError()
+    def _users_page_params(
+        self, user_id: str, cursor: Optional[str], count: Optional[int],
+        max_count: int
+    ) -> dict:
+        if cursor and not cursor.isdigit():
+            raise WrongCursor()
+        return {
+            **self._users_params(user_id, min(count or max_count, max_count)),
+            'offset': int(cursor or 0),
+        }
 
-        logger.info("VKClient.get_friends(), data = {}".format(response.text))
+    def _bundle_calls(
+        self, user_id: str, include: List[str], count: int
+    ) -> Dict[str, Tuple[str, dict, Callable[[Any], Any]]]:
+
+        calls = {
+            BUNDLE_USER: (
+                self.user_api_url, self._user_params(user_id),
+                self._parse_user,
+            ),
+            BUNDLE_ARTICLES: (
+                self.wall_api_url, self._articles_params(user_id, count),
+                self._parse_articles,
+            ),
+            BUNDLE_FRIENDS: (
+                self.friends_api_url, self._users_params(user_id, count),
+                self._parse_users,
+            ),
+            BUNDLE_FOLLOWERS: (
+                self.followers_api_url, self._users_params(user_id, count),
+                self._parse_users,
+            ),
+        }
+        return {
+            section: call for section, call in calls.items()
+            if section == BUNDLE_USER or section in include
+        }
 
-        try:
-            data = response.json()
-        except json.JSONDecodeError:
-            raise WrongServerResponse()
+    def _timeline_calls(
+        self, user_ids: List[str], count: int
+    ) -> Dict[str, Tuple[str, dict, Callable[[Any], Any]]]:
+        # section names end up as keys inside execute's code
+        return {
+            'w{}'.format(i): (
+                self.wall_api_url, self._articles_params(user_id, count),
+                self._parse_articles,
+            )
+            for i, user_id in enumerate(user_ids)
+        }
 
-        error = data.get('error', None)
-        if error:
-            if error.get('error_code', None) in [113, 100, 15, 18, 30]:
-                raise UserDoesNotExist()
-            elif error.get('error_code', None) in [5, 16]:
-                raise AuthorizationError()
-            else:
-                raise UnknownError()
-
-        data = data.get('response', {}).get('items', [])
-        try:
-            return parse_obj_as(List[VKUser], data)
-        except ValidationError:
-            raise WrongServerResponse(VKUser)
+    def _parse_timelines(
+        self, user_ids: List[str],
+        calls: Dict[str, Tuple[str, dict, Callable[[Any], Any]]],
+        data: dict,
+    ) -> Dict[str, Any]:
+        results = self._parse_bundle(calls, data)
+        return {
+            user_id: results['w{}'.format(i)]
+            for i, user_id in enumerate(user_ids)
+        }
 
-    def get_followers(self, user_id: str, count: int = 10) -> List[User]:
-        params = {
-            'user_id': user_id,
-            'v': '5.21',
+    def _method(self, api_url: str) -> str:
+        return api_url[len(self.api_base_URL):]
+
+    def _execute_params(
+        self, calls: Dict[str, Tuple[str, dict, Callable[[Any], Any]]]
+    ) -> dict:
+
+        # every call runs server-side, `execute` itself carries the token
+        # and the API version
+        code = 'return {{{}}};'.format(','.join(
+            '{}:API.{}({})'.format(
+                json.dumps(section), self._method(api_url), json.dumps({
+                    key: value for key, value in params.items()
+                    if key not in ('v', 'access_token')
+                })
+            )
+            for section, (api_url, params, _) in calls.items()
+        ))
+        return {
+            'code': code,
+            'v': '5.89',
             'access_token': self.access_token,
-            'count': count,
-            'name_case': 'ins',
-            'fields': 'followers_count,common_count,photo,screen_name',
         }
 
-        try:
-            response = requests.get(
-                self.followers_api_url, params, proxies=self.proxies
+    def _parse_bundle(
+        self, calls: Dict[str, Tuple[str, dict, Callable[[Any], Any]]],
+        data: dict,
+    ) -> Dict[str, Any]:
+
+        # a failed call yields `false` and leaves its error in
+        # execute_errors, in the order the calls ran; the other calls are
+        # unaffected
+        response = data.get('response', None) or {}
+        errors: Dict[str, List[dict]] = {}
+        for error in data.get('execute_errors', []):
+            errors.setdefault(error.get('method', None), []).append(error)
+
+        bundle = {}
+        for section, (api_url, _, parse) in calls.items():
+            value = response.get(section, False)
+            if value is False:
+                method_errors = errors.get(self._method(api_url), [])
+                bundle[section] = self._error(
+                    method_errors.pop(0) if method_errors else {}
+                )
+                continue
+            try:
+                bundle[section] = parse(value)
+            except SocialException as e:
+                bundle[section] = e
+        return bundle
+
+    def _request(
+        self, api_url: str, params: dict,
+        parse: Optional[Callable[[bytes], Any]] = None,
+    ) -> Any:
+
+        endpoint = self._method(api_url)
+        governor.acquire_blocking(
+            RESOURCE_TYPE_VK, endpoint, self.access_token
+        )
+        upstream_in_flight.inc(RESOURCE_TYPE_VK)
+        started_at = time.monotonic()
+        with span(
+            'http', source=RESOURCE_TYPE_VK, endpoint=endpoint
+        ) as http_span:
+            try:
+                response = self._get_http_session().get(
+                    api_url, params=params, proxies=self.proxies,
+                    timeout=(settings.HTTP_CONNECT_TIMEOUT,
+                             settings.HTTP_READ_TIMEOUT)
+                )
+            except (requests.exceptions.HTTPError,
+                    requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.RequestException) as e:
+                observe_upstream(
+                    RESOURCE_TYPE_VK, endpoint, 'error', started_at
+                )
+                log_error(RESOURCE_TYPE_VK, endpoint, started_at, e)
+                raise SocialConnectionError()
+            finally:
+                upstream_in_flight.dec(RESOURCE_TYPE_VK)
+            http_span.set(
+                status=response.status_code, bytes=len(response.content)
             )
-        except (requests.exceptions.HTTPError,
-                requests.exceptions.ConnectionError,
-                requests.exceptions.Timeout,
-                requests.exceptions.RequestException) as e:
-            logger.info("VKClient.get_followers(), e = {}".format(e))
-            raise SocialConnectionError()
-
-        logger.info(
-            "VKClient.get_followers(), data = {}".format(response.text)
+
+        observe_upstream(
+            RESOURCE_TYPE_VK, endpoint, response.status_code, started_at,
+            len(response.content)
+        )
+        log_response(
+            RESOURCE_TYPE_VK, endpoint, response.status_code, started_at,
+            response.content
         )
 
         try:
-            data = response.json()
-        except json.JSONDecodeError:
-            raise WrongServerResponse()
+            return (parse or self._parse_response)(response.content)
+        except RateLimitExceeded:
+            governor.block(
+                RESOURCE_TYPE_VK, endpoint, self.access_token,
+                self.rate_limit_backoff
+            )
+            raise RateLimitExceeded(retry_after=self.rate_limit_backoff)
+
+    @staticmethod
+    def _error(error: dict) -> SocialException:
+
+        if error.get('error_code', None) in [113, 100, 15, 18, 30]:
+            return UserDoesNotExist()
+        elif error.get('error_code', None) == 5:
+            return InvalidCredentials()
+        elif error.get('error_code', None) == 16:
+            return AuthorizationError()
+        elif error.get('error_code', None) in [6, 9, 29]:
+            return RateLimitExceeded()
+        elif error.get('error_code', None) in [1, 10]:
+            return UpstreamServerError()
+        else:
+            return UnknownError()
 
+    @classmethod
+    def _parse_body(cls, body: bytes) -> dict:
+
+        data = _decode(body)
         error = data.get('error', None)
         if error:
-            if error.get('error_code', None) in [113, 100, 15, 18, 30]:
-                raise UserDoesNotExist()
-            elif error.get('error_code', None) in [5, 16]:
-                raise AuthorizationError()
-            else:
-                raise UnknownError()
-
-        data = data.get('response', {}).get('items', [])
-        try:
-            return parse_obj_as(List[VKUser], data)
-        except ValidationError:
-            raise WrongServerResponse(VKUser)
+            raise cls._error(error)
+
+        return data
+
+    @classmethod
+    def _parse_response(cls, body: bytes) -> Any:
+        return cls._parse_body(body).get('response', None)
+
+    @staticmethod
+    def _parse_user(data: Any) -> User:
+
+        data = data or []
+        if len(data) == 0 or data[0].get('deactivated', None) == "deleted":
+            raise UserDoesNotExist()
+
+        return _parse_models(VKUser, data[:1])[0]
+
+    @staticmethod
+    def _parse_user_list(data: Any) -> List[User]:
+        users = [
+            x for x in (data or []) if x.get('deactivated', None) != "deleted"
+        ]
+        return _parse_models(VKUser, users)
+
+    @staticmethod
+    def _parse_articles(data: Any) -> List[Article]:
+        return _parse_models(VKArticle, (data or {}).get('items', []))
+
+    @staticmethod
+    def _parse_users(data: Any) -> List[User]:
+        return _parse_models(VKUser, (data or {}).get('items', []))
+
+    @classmethod
+    def _parse_users_page(cls, data: Any, offset: int) -> UsersPage:
+        users = cls._parse_users(data)
+        next_offset = offset + len(users)
+        has_more = users and next_offset < (data or {}).get('count', 0)
+        return UsersPage(
+            users=users,
+            next_cursor=str(next_offset) if has_more else None,
+        )
+
+    def get_user(self, user_id: str) -> User:
+        data = self._request(self.user_api_url, self._user_params(user_id))
+        return self._parse_user(data)
+
+    def get_users(self, user_ids: List[str]) -> Dict[str, User]:
+        users = []
+        for chunk in self._chunks(user_ids):
+            try:
+                data = self._request(
+                    self.user_api_url, self._user_params(','.join(chunk))
+                )
+            except UserDoesNotExist:
+                continue
+            users.extend(self._parse_user_list(data))
+        return self._match_users(user_ids, users)
+
+    def get_articles(
+        self, user_id: str, count: int = 10, since_id: Optional[int] = None,
+        max_id: Optional[int] = None
+    ) -> List[Article]:
+
+        if since_id is None and max_id is None:
+            data = self._request(
+                self.wall_api_url, self._articles_params(user_id, count)
+            )
+            return self._parse_articles(data)
+
+        items = []
+        for offset, page in self._wall_pages(count, since_id):
+            data = self._request(
+                self.wall_api_url,
+                self._articles_params(user_id, page, offset)
+            )
+            kept, done = self._wall_page(data, offset, page, since_id, max_id)
+            items.extend(kept)
+            if done or len(items) >= count:
+                break
+        return self._parse_wall(items, count)
+
+    def get_friends(self, user_id: str, count: int = 10) -> List[User]:
+        data = self._request(
+            self.friends_api_url, self._users_params(user_id, count)
+        )
+        return self._parse_users(data)
+
+    def get_followers(self, user_id: str, count: int = 10) -> List[User]:
+        data = self._request(
+            self.followers_api_url, self._users_params(user_id, count)
+        )
+        return self._parse_users(data)
+
+    def get_friends_page(
+        self, user_id: str, cursor: Optional[str] = None,
+        count: Optional[int] = None
+    ) -> UsersPage:
+        params = self._users_page_params(
+            user_id, cursor, count, self.friends_page_size
+        )
+        data = self._request(self.friends_api_url, params)
+        return self._parse_users_page(data, params['offset'])
+
+    def get_followers_page(
+        self, user_id: str, cursor: Optional[str] = None,
+        count: Optional[int] = None
+    ) -> UsersPage:
+        params = self._users_page_params(
+            user_id, cursor, count, self.followers_page_size
+        )
+        data = self._request(self.followers_api_url, params)
+        return self._parse_users_page(data, params['offset'])
+
+    def get_bundle(
+        self, user_id: str, include: List[str], count: int = 10
+    ) -> Dict[str, Any]:
+        calls = self._bundle_calls(user_id, include, count)
+        data = self._request(
+            self.execute_api_url, self._execute_params(calls),
+            parse=self._parse_body,
+        )
+        return self._parse_bundle(calls, data)
+
+    def get_timelines(
+        self, user_ids: List[str], count: int = 10
+    ) -> Dict[str, Any]:
+        calls = self._timeline_calls(user_ids, count)
+        data = self._request(
+            self.execute_api_url, self._execute_params(calls),
+            parse=self._parse_body,
+        )
+        return self._parse_timelines(user_ids, calls, data)
 
 
 class ClientFactory():
@@ -0,0 +1,34 @@
+import json
+from typing import Any, Union
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    # shallow on purpose: nested models come back through here, which is
+    # far cheaper than a recursive .dict()
+    if isinstance(obj, BaseModel):
+        return dict(obj)
+    raise TypeError(
+        'Object of type {} is not JSON serializable'.format(type(obj))
+    )
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    # orjson's JSONDecodeError subclasses json's, callers catch the latter
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(
+        obj, default=_default, ensure_ascii=False, separators=(',', ':')
+    ).encode('utf-8')
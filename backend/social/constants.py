@@ -1,3 +1,20 @@
 RESOURCE_TYPE_VK = 'vkontakte'
 RESOURCE_TYPE_TWITTER = 'twitter'
 RESOURCE_TYPES = [RESOURCE_TYPE_VK, RESOURCE_TYPE_TWITTER]
+
+FANOUT_POLICY_SEQUENTIAL = 'sequential'
+FANOUT_POLICY_FIRST = 'first'
+FANOUT_POLICY_PRIORITY = 'priority'
+FANOUT_POLICY_MERGE = 'merge'
+
+# wall.get returns at most 100 posts per call, user_timeline 200
+FEED_MAX_COUNT = 100
+
+# API calls a single VK `execute` may carry
+EXECUTE_MAX_CALLS = 25
+
+BUNDLE_USER = 'user'
+BUNDLE_ARTICLES = 'articles'
+BUNDLE_FRIENDS = 'friends'
+BUNDLE_FOLLOWERS = 'followers'
+BUNDLE_SECTIONS = [BUNDLE_ARTICLES, BUNDLE_FRIENDS, BUNDLE_FOLLOWERS]
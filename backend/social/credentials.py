@@ -0,0 +1,140 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+from core import settings
+
+from .constants import RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK
+from .exceptions import AuthorizationError, InvalidCredentials
+from .ratelimit import governor
+
+
+class Credential:
+
+    def __init__(self, token: str, secrets: Tuple[str, ...] = ()):
+        # `token` is what the upstream counts its rate limits against
+        self.token = token
+        self.secrets = secrets
+        self.id = governor.credential_id(token)
+
+        self.in_flight = 0
+        self.requests = 0
+        self.auth_failures = 0
+        self.quarantined_until = 0.0
+
+    def is_quarantined(self) -> bool:
+        return self.quarantined_until > time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'auth_failures': self.auth_failures,
+            'quarantined_for': round(
+                max(0.0, self.quarantined_until - time.monotonic()), 2
+            ),
+        }
+
+
+class CredentialPool:
+
+    def __init__(
+        self,
+        resource_type: str,
+        credentials: List[Credential],
+        quarantine_seconds: float,
+    ):
+        self.resource_type = resource_type
+        self.credentials = credentials
+        self.quarantine_seconds = quarantine_seconds
+
+    def __len__(self) -> int:
+        return len(self.credentials)
+
+    def available(self) -> List[Credential]:
+        return [x for x in self.credentials if not x.is_quarantined()]
+
+    def acquire(self, endpoint: str) -> Credential:
+
+        credentials = self.available()
+        if not credentials and self.credentials:
+            # every token is quarantined, e.g. the only one of the default
+            # setup: the one quarantined longest ago gets another try, no
+            # call would get through for the whole quarantine otherwise
+            return min(self.credentials, key=lambda x: x.quarantined_until)
+        if not credentials:
+            raise AuthorizationError()
+
+        # an un-throttled credential first, then the least loaded one
+        return min(credentials, key=lambda x: (
+            governor.wait_time(self.resource_type, endpoint, x.token),
+            x.in_flight,
+            x.requests,
+        ))
+
+    def quarantine(self, credential: Credential) -> None:
+        credential.auth_failures += 1
+        credential.quarantined_until = (
+            time.monotonic() + self.quarantine_seconds
+        )
+
+    @contextmanager
+    def use(self, endpoint: str) -> Iterator[Credential]:
+
+        credential = self.acquire(endpoint)
+        credential.in_flight += 1
+        credential.requests += 1
+        try:
+            yield credential
+        except InvalidCredentials:
+            # a protected timeline answers 401 too, only a rejected token
+            # takes the credential out of the rotation
+            self.quarantine(credential)
+            raise
+        finally:
+            credential.in_flight -= 1
+
+    def reset(self) -> None:
+        for credential in self.credentials:
+            credential.in_flight = 0
+            credential.quarantined_until = 0.0
+
+    def stats(self) -> dict:
+        return {x.id: x.stats() for x in self.credentials}
+
+
+def _create_pool(resource_type: str) -> CredentialPool:
+
+    if resource_type == RESOURCE_TYPE_VK:
+        credentials = [Credential(x) for x in settings.VK_ACCESS_TOKENS]
+    elif resource_type == RESOURCE_TYPE_TWITTER:
+        credentials = [
+            Credential(x[2], secrets=x) for x in settings.TWITTER_CREDENTIALS
+        ]
+    else:
+        credentials = []
+
+    return CredentialPool(
+        resource_type, credentials, settings.CREDENTIAL_QUARANTINE_SECONDS
+    )
+
+
+_pools: Dict[str, CredentialPool] = {}
+
+
+def get_credential_pool(resource_type: str) -> CredentialPool:
+    pool = _pools.get(resource_type)
+    if pool is None:
+        pool = _pools[resource_type] = _create_pool(resource_type)
+    return pool
+
+
+def reset_credential_pools() -> None:
+    for pool in _pools.values():
+        pool.reset()
+
+
+def get_credential_stats() -> dict:
+    return {
+        resource_type: pool.stats() for resource_type, pool in _pools.items()
+    }
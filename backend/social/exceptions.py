@@ -18,9 +18,44 @@ class AuthorizationError(SocialException):
     pass
 
 
+class InvalidCredentials(AuthorizationError):
+    # the token itself was rejected, not access to one resource
+    pass
+
+
 class UnknownError(SocialException):
     pass
 
 
+class UpstreamServerError(UnknownError):
+    pass
+
+
 class SocialConnectionError(SocialException):
     pass
+
+
+class WrongFanOutPolicy(SocialException):
+    pass
+
+
+class WrongCursor(SocialException):
+    pass
+
+
+class RateLimitExceeded(SocialException):
+
+    def __init__(self, retry_after: float = None):
+        super().__init__()
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(SocialException):
+    pass
+
+
+class SourceUnavailable(SocialException):
+
+    def __init__(self, retry_after: float = None):
+        super().__init__()
+        self.retry_after = retry_after
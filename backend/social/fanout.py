@@ -0,0 +1,122 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type
+
+from core import settings
+
+from .constants import (FANOUT_POLICY_FIRST, FANOUT_POLICY_MERGE,
+                        FANOUT_POLICY_PRIORITY, FANOUT_POLICY_SEQUENTIAL)
+from .exceptions import UserDoesNotExist, WrongFanOutPolicy
+
+Call = Callable[[], Awaitable[Any]]
+
+
+async def fan_out(
+    calls: Dict[str, Call],
+    ignore: Tuple[Type[Exception], ...],
+    merge: Optional[Callable[[List[Any]], Any]] = None,
+    policy: Optional[str] = None,
+    deadline: Optional[float] = None,
+) -> Any:
+
+    if policy is None:
+        policy = getattr(settings, 'SOURCE_FANOUT_POLICY',
+                         FANOUT_POLICY_PRIORITY)
+    if deadline is None:
+        deadline = getattr(settings, 'SOURCE_FANOUT_DEADLINE', 1.0)
+
+    if policy == FANOUT_POLICY_SEQUENTIAL:
+        return await _sequential(calls, ignore)
+
+    tasks = {
+        resource_type: asyncio.ensure_future(call())
+        for resource_type, call in calls.items()
+    }
+    try:
+        if policy == FANOUT_POLICY_FIRST:
+            return await _first(tasks, ignore, prefer=False, deadline=0)
+        elif policy == FANOUT_POLICY_PRIORITY:
+            return await _first(tasks, ignore, prefer=True, deadline=deadline)
+        elif policy == FANOUT_POLICY_MERGE:
+            return await _merge(tasks, ignore, merge)
+        else:
+            raise WrongFanOutPolicy()
+    finally:
+        for task in tasks.values():
+            if not task.done():
+                task.cancel()
+
+
+async def _sequential(
+    calls: Dict[str, Call], ignore: Tuple[Type[Exception], ...]
+) -> Any:
+
+    for call in calls.values():
+        try:
+            return await call()
+        except ignore:
+            continue
+    else:
+        raise UserDoesNotExist()
+
+
+async def _first(
+    tasks: Dict[str, asyncio.Future],
+    ignore: Tuple[Type[Exception], ...],
+    prefer: bool,
+    deadline: float,
+) -> Any:
+
+    loop = asyncio.get_running_loop()
+    expires_at = loop.time() + deadline
+    pending = set(tasks.values())
+
+    while True:
+        # A failure outside of `ignore` aborts the lookup just like the
+        # sequential loop would, a success is taken once every source
+        # ranked above it has failed or the preference deadline is over.
+        waiting = False
+        for task in tasks.values():
+            if not task.done():
+                waiting = True
+                if prefer and loop.time() < expires_at:
+                    break
+                continue
+            error = task.exception()
+            if error is None:
+                return task.result()
+            if not isinstance(error, ignore):
+                raise error
+
+        if not waiting:
+            raise UserDoesNotExist()
+
+        timeout = None
+        if prefer and loop.time() < expires_at:
+            timeout = expires_at - loop.time()
+        pending = {task for task in pending if not task.done()}
+        await asyncio.wait(
+            pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+        )
+
+
+async def _merge(
+    tasks: Dict[str, asyncio.Future],
+    ignore: Tuple[Type[Exception], ...],
+    merge: Optional[Callable[[List[Any]], Any]],
+) -> Any:
+
+    await asyncio.wait(list(tasks.values()))
+
+    results = []
+    for task in tasks.values():
+        error = task.exception()
+        if error is None:
+            results.append(task.result())
+        elif not isinstance(error, ignore):
+            raise error
+
+    if not results:
+        raise UserDoesNotExist()
+    if merge is None:
+        return results[0]
+    return merge(results)
@@ -0,0 +1,107 @@
+import logging
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Optional, Union
+
+from core import settings
+from fastapi.logger import logger
+
+from .tracing import current_trace_id
+
+_listener: Optional[QueueListener] = None
+
+
+class _Truncated:
+
+    # formatted only if the record is actually emitted
+    def __init__(self, body: Union[str, bytes], limit: int):
+        self.body = body
+        self.limit = limit
+
+    def __str__(self) -> str:
+        body = self.body[:self.limit]
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', 'replace')
+        if len(self.body) > self.limit:
+            body += '... ({} bytes)'.format(len(self.body))
+        return body
+
+
+def log_response(
+    source: str, endpoint: str, status: int, started_at: float,
+    body: Union[str, bytes],
+) -> None:
+
+    latency = time.monotonic() - started_at
+    logger.info(
+        "%s %s status=%s latency=%.3f bytes=%d",
+        source, endpoint, status, latency, len(body),
+        extra={
+            'source': source, 'endpoint': endpoint, 'status': status,
+            'latency': latency, 'bytes': len(body),
+        },
+    )
+
+    if (settings.LOG_UPSTREAM_BODIES
+            and logger.isEnabledFor(logging.DEBUG)
+            and random.random() < settings.LOG_BODY_SAMPLE_RATE):
+        logger.debug(
+            "%s %s body = %s", source, endpoint,
+            _Truncated(body, settings.LOG_BODY_MAX_BYTES),
+        )
+
+
+def log_error(
+    source: str, endpoint: str, started_at: float, error: Exception
+) -> None:
+    latency = time.monotonic() - started_at
+    logger.warning(
+        "%s %s error=%r latency=%.3f", source, endpoint, error, latency,
+        extra={
+            'source': source, 'endpoint': endpoint, 'latency': latency,
+        },
+    )
+
+
+class TraceIdFilter(logging.Filter):
+
+    # runs on the request's thread, where the trace is still current
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id() or '-'
+        return True
+
+
+def start_logging() -> None:
+
+    global _listener
+    if _listener is not None:
+        return
+
+    # request threads only enqueue records, a listener thread writes them
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(settings.LOG_FORMAT))
+    queue = SimpleQueue()
+    _listener = QueueListener(queue, handler, respect_handler_level=True)
+
+    queue_handler = QueueHandler(queue)
+    queue_handler.addFilter(TraceIdFilter())
+    logger.addHandler(queue_handler)
+    logger.setLevel(settings.LOG_LEVEL)
+    logger.propagate = False
+    _listener.start()
+
+
+def stop_logging() -> None:
+
+    global _listener
+    if _listener is None:
+        return
+
+    _listener.stop()
+    _listener = None
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+    logger.propagate = True
@@ -0,0 +1,327 @@
+import asyncio
+import bisect
+import copy
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from core import settings
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000)
+
+_lock = threading.Lock()
+
+
+class Metric:
+
+    kind = ''
+
+    def __init__(
+        self, name: str, description: str, labels: Sequence[str] = ()
+    ):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], Any] = {}
+
+    def snapshot(self) -> dict:
+        with _lock:
+            values = [
+                [list(key), copy.deepcopy(value)]
+                for key, value in self.values.items()
+            ]
+        return {
+            'kind': self.kind,
+            'description': self.description,
+            'labels': list(self.labels),
+            'values': values,
+        }
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(
+        self, name: str, description: str, labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        # per-bucket counts plus the sum, made cumulative only on render
+        index = bisect.bisect_left(self.buckets, value)
+        with _lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = [[0] * (len(self.buckets) + 1), 0.0]
+                self.values[labels] = state
+            state[0][index] += 1
+            state[1] += value
+
+    def snapshot(self) -> dict:
+        return {**super().snapshot(), 'buckets': list(self.buckets)}
+
+
+def _merge(snapshots: List[dict]) -> Dict[str, dict]:
+
+    merged: Dict[str, dict] = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, 'values': {}})
+            values = target['values']
+            for key, value in metric['values']:
+                key = tuple(key)
+                if metric['kind'] != 'histogram':
+                    values[key] = values.get(key, 0.0) + value
+                elif key not in values:
+                    values[key] = [list(value[0]), value[1]]
+                else:
+                    counts, total = values[key]
+                    values[key] = [
+                        [x + y for x, y in zip(counts, value[0])],
+                        total + value[1],
+                    ]
+    return merged
+
+
+def _escape(value: str) -> str:
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _series(name: str, labels: Sequence[str], key: Sequence[str],
+            value: float, extra: str = '') -> str:
+    pairs = ['{}="{}"'.format(x, _escape(y)) for x, y in zip(labels, key)]
+    if extra:
+        pairs.append(extra)
+    if pairs:
+        return '{}{{{}}} {}'.format(name, ','.join(pairs), value)
+    return '{} {}'.format(name, value)
+
+
+def render(snapshots: List[dict]) -> str:
+
+    lines = []
+    for name, metric in sorted(_merge(snapshots).items()):
+        lines.append('# HELP {} {}'.format(name, metric['description']))
+        lines.append('# TYPE {} {}'.format(name, metric['kind']))
+        labels = metric['labels']
+        for key, value in sorted(metric['values'].items()):
+            if metric['kind'] != 'histogram':
+                lines.append(_series(name, labels, key, value))
+                continue
+            counts, total = value
+            cumulative = 0
+            bounds = [repr(float(x)) for x in metric['buckets']] + ['+Inf']
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                lines.append(_series(
+                    name + '_bucket', labels, key, cumulative,
+                    'le="{}"'.format(bound),
+                ))
+            lines.append(_series(name + '_sum', labels, key, total))
+            lines.append(_series(name + '_count', labels, key, cumulative))
+    return '\n'.join(lines) + '\n'
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> dict:
+        return {
+            name: metric.snapshot() for name, metric in self.metrics.items()
+        }
+
+    def reset(self) -> None:
+        with _lock:
+            for metric in self.metrics.values():
+                metric.values.clear()
+
+
+registry = Registry()
+
+
+def _snapshot(merged: Dict[str, dict]) -> dict:
+    # back from _merge's form to the one snapshots are written in
+    return {
+        name: {
+            **metric,
+            'values': [[list(key), value]
+                       for key, value in metric['values'].items()],
+        }
+        for name, metric in merged.items()
+    }
+
+
+class MultiProcessCollector:
+
+    # counters of workers that shut down, their own files are removed
+    totals = 'totals.json'
+
+    # uvicorn workers do not share memory: each one writes its snapshot
+    # to a shared directory and a scrape of any worker sums them all up
+    def __init__(self, directory: str, interval: float):
+        self.directory = directory
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.directory, '{}.json'.format(pid))
+
+    def write(self) -> None:
+        self._write(self._path(os.getpid()), registry.snapshot())
+
+    @staticmethod
+    def _write(path: str, snapshot: dict) -> None:
+        with open(path + '.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(path + '.tmp', path)
+
+    def retire(self) -> None:
+
+        # folds this worker's counters into the totals and removes its
+        # file, so restarts and recycled workers don't pile files up
+        path = os.path.join(self.directory, self.totals)
+        own = {
+            name: metric for name, metric in registry.snapshot().items()
+            if metric['kind'] != 'gauge'
+        }
+        with open(path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(path) as f:
+                    totals = json.load(f)
+            except (OSError, ValueError):
+                totals = {}
+            self._write(path, _snapshot(_merge([totals, own])))
+        try:
+            os.remove(self._path(os.getpid()))
+        except OSError:
+            pass
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.write()
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.retire()
+
+    def snapshots(self) -> List[dict]:
+
+        own = self._path(os.getpid())
+        snapshots = [registry.snapshot()]
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+                stale = os.path.getmtime(path) < (
+                    time.time() - 3 * self.interval
+                )
+            except (OSError, ValueError):
+                continue
+            # counters of finished workers still count, their gauges not
+            if stale:
+                snapshot = {
+                    name: metric for name, metric in snapshot.items()
+                    if metric['kind'] != 'gauge'
+                }
+            snapshots.append(snapshot)
+        return snapshots
+
+
+collector: Optional[MultiProcessCollector] = None
+if settings.METRICS_DIR:
+    collector = MultiProcessCollector(
+        settings.METRICS_DIR, settings.METRICS_FLUSH_INTERVAL
+    )
+
+
+def collect() -> str:
+    if collector is not None:
+        return render(collector.snapshots())
+    return render([registry.snapshot()])
+
+
+http_requests = registry.register(Histogram(
+    'http_request_duration_seconds', 'API request latency.',
+    ('route', 'method', 'status'),
+))
+http_response_size = registry.register(Histogram(
+    'http_response_size_bytes', 'API response body size.',
+    ('route',), SIZE_BUCKETS,
+))
+http_in_flight = registry.register(Gauge(
+    'http_requests_in_flight', 'API requests being served.',
+))
+upstream_requests = registry.register(Histogram(
+    'upstream_request_duration_seconds', 'Upstream API call latency.',
+    ('source', 'method', 'status'),
+))
+upstream_response_size = registry.register(Histogram(
+    'upstream_response_size_bytes', 'Upstream API response body size.',
+    ('source', 'method'), SIZE_BUCKETS,
+))
+upstream_in_flight = registry.register(Gauge(
+    'upstream_requests_in_flight', 'Upstream API calls in progress.',
+    ('source',),
+))
+social_errors = registry.register(Counter(
+    'social_errors_total', 'Errors raised for upstream operations.',
+    ('source', 'operation', 'error'),
+))
+
+
+def observe_upstream(
+    source: str, method: str, status: Any, started_at: float, size: int = 0
+) -> None:
+    upstream_requests.observe(
+        time.monotonic() - started_at, source, method, str(status)
+    )
+    upstream_response_size.observe(size, source, method)
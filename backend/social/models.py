@@ -1,4 +1,16 @@
-from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Any, List, Optional
+
+from pydantic import BaseModel, Field, validator
+
+TWITTER_TIME_FORMAT = '%a %b %d %H:%M:%S %z %Y'
+
+
+def _twitter_time(value: Any) -> int:
+    # "Wed Aug 27 13:08:45 +0000 2008" to a unix timestamp
+    if isinstance(value, str):
+        return int(datetime.strptime(value, TWITTER_TIME_FORMAT).timestamp())
+    return value or 0
 
 
 class User(BaseModel):
@@ -13,15 +25,44 @@ class User(BaseModel):
 
 class VKUser(User):
     name: str = Field(alias='first_name')
-    friends_count: str = Field(alias='followers_count', default=0)
-    followers_count: str = Field(alias='common_count', default=0)
+    friends_count: int = Field(alias='followers_count', default=0)
+    followers_count: int = Field(alias='common_count', default=0)
     image_url: str = Field(alias='photo')
     description: str = ''
 
+    @classmethod
+    def from_trusted(cls, data: Any) -> 'VKUser':
+        return cls.construct(
+            id=data['id'],
+            screen_name=data['screen_name'],
+            name=data['first_name'],
+            friends_count=data.get('followers_count', 0),
+            followers_count=data.get('common_count', 0),
+            image_url=data['photo'],
+            description='',
+        )
+
 
 class TwitterUser(User):
     image_url: str = Field(alias='profile_image_url')
 
+    @classmethod
+    def from_trusted(cls, data: Any) -> 'TwitterUser':
+        return cls.construct(
+            id=data['id'],
+            screen_name=data['screen_name'],
+            name=data['name'],
+            followers_count=data['followers_count'],
+            friends_count=data['friends_count'],
+            image_url=data['profile_image_url'],
+            description=data['description'] or '',
+        )
+
+
+class UsersPage(BaseModel):
+    users: List[User]
+    next_cursor: Optional[str] = None
+
 
 class Article(BaseModel):
     id: int
@@ -30,6 +71,8 @@ class Article(BaseModel):
     comments_count: int
     reposts_count: int
     retweet_count: int
+    # unix time, 0 when the source did not say
+    created_at: int = 0
 
 
 class TwitterArticle(Article):
@@ -37,15 +80,44 @@ class TwitterArticle(Article):
     comments_count: int = 0
     reposts_count: int = 0
 
+    _created_at = validator('created_at', pre=True, allow_reuse=True)(
+        _twitter_time
+    )
+
+    @classmethod
+    def from_trusted(cls, data: Any) -> 'TwitterArticle':
+        return cls.construct(
+            id=data['id'],
+            text=data['text'],
+            likes_count=data['favorite_count'],
+            comments_count=0,
+            reposts_count=0,
+            retweet_count=data['retweet_count'],
+            created_at=_twitter_time(data.get('created_at')),
+        )
+
 
 class VKArticle(Article):
     likes_count: int = Field(alias='likes.count', default=0)
     comments_count: int = Field(alias='comments.count', default=0)
     reposts_count: int = Field(alias='reposts.count', default=0)
     retweet_count: int = 0
+    created_at: int = Field(alias='date', default=0)
 
     def __init__(self, **data) -> None:
         super().__init__(**data)
         self.likes_count =  data.get('likes', {}).get('count', 0)
         self.comments_count =  data.get('comments', {}).get('count', 0)
         self.reposts_count = data.get('reposts', {}).get('count', 0)
+
+    @classmethod
+    def from_trusted(cls, data: Any) -> 'VKArticle':
+        return cls.construct(
+            id=data['id'],
+            text=data['text'],
+            likes_count=data.get('likes', {}).get('count', 0),
+            comments_count=data.get('comments', {}).get('count', 0),
+            reposts_count=data.get('reposts', {}).get('count', 0),
+            retweet_count=0,
+            created_at=data.get('date', 0),
+        )
@@ -0,0 +1,39 @@
+import asyncio
+from typing import AsyncIterator, TypeVar
+
+T = TypeVar('T')
+
+_done = object()
+
+
+async def prefetch(items: AsyncIterator[T], size: int) -> AsyncIterator[T]:
+
+    # the producer runs at most `size` items ahead of the consumer and
+    # blocks on the full queue otherwise, so memory stays bounded
+    queue = asyncio.Queue(maxsize=max(size, 1))
+
+    async def produce():
+        try:
+            async for item in items:
+                await queue.put((item, None))
+        except Exception as e:
+            await queue.put((_done, e))
+        else:
+            await queue.put((_done, None))
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is _done:
+                return
+            yield item
+    finally:
+        producer.cancel()
+        await asyncio.wait([producer])
+        # closed here rather than whenever the garbage collector gets to it
+        close = getattr(items, 'aclose', None)
+        if close is not None:
+            await close()
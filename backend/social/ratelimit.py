@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Mapping, Optional, Tuple
+
+from core import settings
+
+from .constants import RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK
+from .exceptions import RateLimitExceeded
+from .resilience import remaining
+
+ANY_ENDPOINT = '*'
+
+# (requests, period in seconds) per access token
+DEFAULT_LIMITS = {
+    RESOURCE_TYPE_VK: {
+        ANY_ENDPOINT: (settings.VK_RATE_LIMIT_PER_SECOND, 1),
+    },
+    RESOURCE_TYPE_TWITTER: {
+        'users/lookup.json': (900, 900),
+        'statuses/user_timeline.json': (900, 900),
+        'friends/list.json': (15, 900),
+        'followers/list.json': (15, 900),
+        ANY_ENDPOINT: (15, 900),
+    },
+}
+
+_background: ContextVar[bool] = ContextVar('background', default=False)
+
+
+def set_background(background: bool) -> None:
+    _background.set(background)
+
+
+class TokenBucket:
+
+    def __init__(self, capacity: float, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+        self.throttled = 0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def wait_time(self, reserve: float = 0.0) -> float:
+
+        now = time.monotonic()
+        self._refill(now)
+
+        # tokens may go negative: every queued caller owns a slot in line
+        return max(
+            0.0, self.blocked_until - now,
+            (1 + reserve - self.tokens) / self.rate
+        )
+
+    def reserve(self, max_wait: float, reserve: float = 0.0) -> float:
+
+        wait = self.wait_time(reserve)
+        if wait > max_wait:
+            self.throttled += 1
+            raise RateLimitExceeded(retry_after=wait)
+
+        self.tokens -= 1
+        return wait
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(
+            self.blocked_until, time.monotonic() + seconds
+        )
+
+    def update(self, remaining: int, reset_in: float) -> None:
+
+        now = time.monotonic()
+        self._refill(now)
+        if remaining > 0:
+            self.tokens = min(self.tokens, remaining)
+        else:
+            # the window is spent, a full one is available once it resets
+            self.tokens = self.capacity
+            self.blocked_until = max(self.blocked_until, now + reset_in)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            'tokens': round(self.tokens, 2),
+            'capacity': self.capacity,
+            'blocked_for': round(max(0.0, self.blocked_until - now), 2),
+            'throttled': self.throttled,
+        }
+
+
+class RateLimitGovernor:
+
+    def __init__(
+        self,
+        limits: Mapping[str, Mapping[str, Tuple[float, float]]],
+        max_wait: float,
+        background_reserve: float = 0.0,
+    ):
+        self.limits = limits
+        self.max_wait = max_wait
+        # share of every bucket that background calls must leave untouched
+        self.background_reserve = background_reserve
+        self._buckets: Dict[Tuple[str, str, str], TokenBucket] = {}
+        # the sync clients take tokens from threadpool threads
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def credential_id(credential: str) -> str:
+        return hashlib.sha1((credential or '').encode()).hexdigest()[:8]
+
+    def _bucket(
+        self, resource_type: str, endpoint: str, credential: str
+    ) -> TokenBucket:
+
+        limits = self.limits[resource_type]
+        if endpoint not in limits:
+            endpoint = ANY_ENDPOINT
+
+        key = (resource_type, endpoint, self.credential_id(credential))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(*limits[endpoint])
+            self._buckets[key] = bucket
+        return bucket
+
+    def _reserve(
+        self, resource_type: str, endpoint: str, credential: str,
+        max_wait: Optional[float],
+    ) -> float:
+
+        if max_wait is None:
+            max_wait = self.max_wait
+        left = remaining()
+        if left is not None:
+            max_wait = min(max_wait, left)
+        with self._lock:
+            bucket = self._bucket(resource_type, endpoint, credential)
+            if _background.get():
+                # background work never queues up behind live requests
+                return bucket.reserve(
+                    0.0, bucket.capacity * self.background_reserve
+                )
+            return bucket.reserve(max_wait)
+
+    async def acquire(
+        self, resource_type: str, endpoint: str, credential: str,
+        max_wait: Optional[float] = None,
+    ) -> None:
+
+        wait = self._reserve(resource_type, endpoint, credential, max_wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_blocking(
+        self, resource_type: str, endpoint: str, credential: str,
+        max_wait: Optional[float] = None,
+    ) -> None:
+
+        # for the sync clients, which run in the threadpool
+        wait = self._reserve(resource_type, endpoint, credential, max_wait)
+        if wait > 0:
+            time.sleep(wait)
+
+    def wait_time(
+        self, resource_type: str, endpoint: str, credential: str
+    ) -> float:
+        with self._lock:
+            bucket = self._bucket(resource_type, endpoint, credential)
+            return bucket.wait_time()
+
+    def block(
+        self, resource_type: str, endpoint: str, credential: str,
+        seconds: float,
+    ) -> None:
+        with self._lock:
+            self._bucket(resource_type, endpoint, credential).block(seconds)
+
+    def update_from_headers(
+        self, resource_type: str, endpoint: str, credential: str,
+        headers: Mapping[str, str],
+    ) -> Optional[float]:
+
+        try:
+            remaining = int(headers['x-rate-limit-remaining'])
+            reset_in = max(0.0, int(headers['x-rate-limit-reset'])
+                           - time.time())
+        except (KeyError, ValueError):
+            return None
+
+        with self._lock:
+            self._bucket(resource_type, endpoint, credential).update(
+                remaining, reset_in
+            )
+        return reset_in
+
+    def reset(self) -> None:
+        with self._lock:
+            self._buckets.clear()
+
+    def stats(self) -> dict:
+        return {
+            ':'.join(key): bucket.stats()
+            for key, bucket in self._buckets.items()
+        }
+
+
+governor = RateLimitGovernor(
+    limits=DEFAULT_LIMITS,
+    max_wait=settings.RATE_LIMIT_MAX_WAIT,
+    background_reserve=settings.RATE_LIMIT_BACKGROUND_RESERVE,
+)
@@ -0,0 +1,132 @@
+import asyncio
+from abc import abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from core import settings
+from fastapi.logger import logger
+
+from .cache import ResponseCache
+from .exceptions import RateLimitExceeded
+from .ratelimit import set_background
+from .resilience import set_deadline
+from .tracing import tracer
+
+
+class BackgroundRefresher:
+
+    # the loop shared by the refreshers, subclasses pick what is due
+    trace_name = 'refresh'
+
+    def __init__(
+        self,
+        refresh: Callable[[tuple], Awaitable[Any]],
+        interval: float,
+        enabled: bool,
+    ):
+        self.refresh = refresh
+        self.interval = interval
+        self.enabled = enabled
+        self._task: Optional[asyncio.Task] = None
+
+        self.rounds = 0
+        self.refreshed = 0
+        self.skipped = 0
+        self.errors = 0
+
+    @abstractmethod
+    async def _due(self) -> List[List[tuple]]:
+        # keys to refresh this round, one list per source
+        pass
+
+    def _round_done(self) -> None:
+        pass
+
+    async def _refresh_keys(self, keys: List[tuple]) -> None:
+
+        # in order, one at a time: a throttled call means the source has
+        # no budget left to spare until the next round
+        for i, key in enumerate(keys):
+            set_deadline(settings.REQUEST_DEADLINE)
+            with tracer.start_trace(self.trace_name):
+                try:
+                    await self.refresh(key)
+                    self.refreshed += 1
+                except RateLimitExceeded:
+                    self.skipped += len(keys) - i
+                    return
+                except Exception as e:
+                    self.errors += 1
+                    logger.warning("{}._refresh_keys(), e = {}".format(
+                        type(self).__name__, repr(e)
+                    ))
+
+    async def run_once(self) -> None:
+        self.rounds += 1
+        await asyncio.gather(*[
+            self._refresh_keys(keys) for keys in await self._due()
+        ])
+        self._round_done()
+
+    async def _run(self) -> None:
+        set_background(True)
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self._task is not None,
+            'rounds': self.rounds,
+            'refreshed': self.refreshed,
+            'skipped': self.skipped,
+            'errors': self.errors,
+        }
+
+
+class Refresher(BackgroundRefresher):
+
+    trace_name = 'cache.refresh'
+
+    def __init__(
+        self,
+        cache: ResponseCache,
+        refresh: Callable[[tuple], Awaitable[Any]],
+        top_n: int,
+        interval: float,
+        ahead: float,
+    ):
+        super().__init__(refresh, interval, enabled=top_n > 0)
+        self.cache = cache
+        self.top_n = top_n
+        # how close to expiry a hot entry has to be to get re-fetched
+        self.ahead = ahead
+
+    async def _due(self) -> List[List[tuple]]:
+
+        # hottest first
+        due: Dict[str, List[tuple]] = {}
+        for key in self.cache.hot_keys.top(self.top_n):
+            remaining = self.cache.local.ttl(key)
+            if (remaining is None or remaining > self.ahead
+                    or self.cache.is_refreshing(key)):
+                continue
+            due.setdefault(key[0], []).append(key)
+        return list(due.values())
+
+    def _round_done(self) -> None:
+        self.cache.hot_keys.decay()
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            'tracked_keys': len(self.cache.hot_keys),
+        }
@@ -0,0 +1,180 @@
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional
+
+from core import settings
+
+from .exceptions import (DeadlineExceeded, RateLimitExceeded,
+                         SocialConnectionError, UpstreamServerError)
+
+_deadline: ContextVar[Optional[float]] = ContextVar('deadline', default=None)
+
+RETRYABLE_ERRORS = (
+    SocialConnectionError, UpstreamServerError, RateLimitExceeded
+)
+
+
+def set_deadline(seconds: Optional[float]) -> None:
+    _deadline.set(None if seconds is None else time.monotonic() + seconds)
+
+
+def remaining() -> Optional[float]:
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class LatencyTracker:
+
+    def __init__(self, size: int):
+        self.size = size
+        self._samples: Dict[Hashable, Deque[float]] = {}
+
+    def record(self, key: Hashable, latency: float) -> None:
+        samples = self._samples.get(key)
+        if samples is None:
+            samples = self._samples[key] = deque(maxlen=self.size)
+        samples.append(latency)
+
+    def percentile(self, key: Hashable, q: float) -> Optional[float]:
+        samples = self._samples.get(key)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)
+        return ordered[max(index, 0)]
+
+
+class Resilience:
+
+    def __init__(
+        self,
+        max_attempts: int,
+        backoff_base: float,
+        backoff_max: float,
+        hedge_enabled: bool,
+        hedge_min_delay: float,
+        hedge_percentile: float = 0.95,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_enabled = hedge_enabled
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_percentile = hedge_percentile
+        self.latencies = LatencyTracker(size=200)
+
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.deadlines_exceeded = 0
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        # "full jitter": uniformly random up to the exponential ceiling
+        delay = random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        )
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    async def call(
+        self, key: Hashable, fetch: Callable[[], Awaitable[Any]]
+    ) -> Any:
+
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt(key, fetch)
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    raise
+
+                delay = self._backoff(attempt - 1, e)
+                left = remaining()
+                if delay > (self.backoff_max if left is None else left):
+                    raise
+
+                self.retries += 1
+                await asyncio.sleep(delay)
+
+    async def _attempt(
+        self, key: Hashable, fetch: Callable[[], Awaitable[Any]]
+    ) -> Any:
+
+        left = remaining()
+        if left is not None and left <= 0:
+            self.deadlines_exceeded += 1
+            raise DeadlineExceeded()
+
+        started_at = time.monotonic()
+        call = self._hedged(key, fetch) if self.hedge_enabled else fetch()
+        try:
+            result = await asyncio.wait_for(call, left)
+        except asyncio.TimeoutError:
+            self.deadlines_exceeded += 1
+            raise DeadlineExceeded()
+
+        self.latencies.record(key, time.monotonic() - started_at)
+        return result
+
+    async def _hedged(
+        self, key: Hashable, fetch: Callable[[], Awaitable[Any]]
+    ) -> Any:
+
+        delay = self.latencies.percentile(key, self.hedge_percentile)
+        if delay is None:
+            return await fetch()
+
+        first = asyncio.ensure_future(fetch())
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(
+                pending, timeout=max(delay, self.hedge_min_delay)
+            )
+            if done:
+                return first.result()
+
+            self.hedges += 1
+            second = asyncio.ensure_future(fetch())
+            pending.add(second)
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            'retries': self.retries,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'deadlines_exceeded': self.deadlines_exceeded,
+        }
+
+
+resilience = Resilience(
+    max_attempts=settings.RETRY_MAX_ATTEMPTS,
+    backoff_base=settings.RETRY_BACKOFF_BASE,
+    backoff_max=settings.RETRY_BACKOFF_MAX,
+    hedge_enabled=settings.HEDGE_ENABLED,
+    hedge_min_delay=settings.HEDGE_MIN_DELAY,
+)
@@ -0,0 +1,139 @@
+import json
+import os
+import re
+import tempfile
+import time
+from typing import List, Tuple
+
+from core import settings
+from fastapi.logger import logger
+
+from .cache import LRUCache
+from .constants import RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK
+
+TWITTER_SCREEN_NAME = re.compile(r'^[A-Za-z0-9_]{1,15}$')
+VK_PREFIXED_ID = re.compile(r'^(id|club|public)\d+$')
+# VK profile ids still fit in 32 bits, snowflake Twitter ids do not
+VK_MAX_ID = 2 ** 32
+SOURCES = (RESOURCE_TYPE_VK, RESOURCE_TYPE_TWITTER)
+
+
+def guess_sources(user_id: str) -> List[str]:
+
+    # plausible sources for an ID by its format, most likely first
+    if user_id.isdigit():
+        if int(user_id) >= VK_MAX_ID:
+            return [RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK]
+        return [RESOURCE_TYPE_VK, RESOURCE_TYPE_TWITTER]
+    if not TWITTER_SCREEN_NAME.match(user_id):
+        # dots, dashes or more than 15 characters: not a Twitter name
+        return [RESOURCE_TYPE_VK]
+    return [RESOURCE_TYPE_VK, RESOURCE_TYPE_TWITTER]
+
+
+class SourceIndex:
+
+    def __init__(self, maxsize: int, ttl: float, path: str = ''):
+        # user_id -> sources it was found on, in the order they were found
+        self.entries = LRUCache(maxsize)
+        self.ttl = ttl
+        self.path = path
+
+        self.resolved = 0
+        self.guessed = 0
+
+    def rank(
+        self, user_id: str, sources: List[str]
+    ) -> Tuple[List[str], List[str]]:
+
+        # sources to ask first and the ones left for when they all fail,
+        # `sources` are the plausible ones still available
+        found, known = self.entries.get(user_id)
+        known = [x for x in known if x in sources] if found else []
+        if not known:
+            self.guessed += 1
+            return sources, []
+
+        self.resolved += 1
+        return known, [x for x in sources if x not in known]
+
+    def add(self, user_id: str, resource_type: str) -> None:
+
+        found, known = self.entries.get(user_id)
+        if found and resource_type in known:
+            return
+        known = (known if found else ()) + (resource_type,)
+        self.entries.set(user_id, known, self.ttl)
+
+    def discard(self, user_id: str, resource_type: str) -> None:
+
+        found, known = self.entries.get(user_id)
+        if not found or resource_type not in known:
+            return
+        known = tuple(x for x in known if x != resource_type)
+        self.entries.set(user_id, known, self.ttl)
+
+    def load(self) -> None:
+
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("SourceIndex.load(), e = {}".format(repr(e)))
+            return
+        if not isinstance(entries, list):
+            entries = []
+        # expiry times are absolute, the time the service was down counts
+        now = time.time()
+        for entry in entries:
+            try:
+                user_id, known, expires_at = entry
+                known = tuple(x for x in known if x in SOURCES)
+                ttl = float(expires_at) - now
+            except (TypeError, ValueError):
+                continue
+            if isinstance(user_id, str) and known:
+                self.entries.set(user_id, known, ttl)
+
+    def save(self) -> None:
+
+        if not self.path:
+            return
+        now = time.time()
+        entries = [
+            [user_id, known, now + ttl]
+            for user_id, known, ttl in self.entries.items()
+        ]
+        # written aside and moved over, a crash never leaves half a file;
+        # a file of its own per writer, workers save at the same time
+        directory = os.path.dirname(self.path) or '.'
+        path = None
+        try:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            fd, path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entries, f)
+            os.replace(path, self.path)
+        except OSError as e:
+            logger.warning("SourceIndex.save(), e = {}".format(repr(e)))
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            **self.entries.stats(),
+            'resolved': self.resolved,
+            'guessed': self.guessed,
+        }
+
+
+source_index = SourceIndex(
+    maxsize=settings.SOURCE_INDEX_MAX_SIZE,
+    ttl=settings.SOURCE_INDEX_TTL,
+    path=settings.SOURCE_INDEX_PATH,
+)
@@ -0,0 +1,39 @@
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from core import settings
+
+_async_sessions: Dict[str, httpx.AsyncClient] = {}
+
+
+def get_async_session(
+    base_url: str, proxy_url: Optional[str] = None
+) -> httpx.AsyncClient:
+
+    host = urlsplit(base_url).netloc
+    session = _async_sessions.get(host)
+    if session is None:
+        limits = httpx.Limits(
+            max_connections=settings.HTTP_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=(
+                settings.HTTP_POOL_MAX_KEEPALIVE_CONNECTIONS
+            ),
+            keepalive_expiry=settings.HTTP_POOL_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(
+            settings.HTTP_READ_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT
+        )
+        session = httpx.AsyncClient(
+            limits=limits, timeout=timeout, proxies=proxy_url
+        )
+        _async_sessions[host] = session
+
+    return session
+
+
+async def close_async_sessions() -> None:
+    sessions = list(_async_sessions.values())
+    _async_sessions.clear()
+    for session in sessions:
+        await session.aclose()
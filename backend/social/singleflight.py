@@ -0,0 +1,64 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}
+
+        self.calls = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    def _done(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # every waiter may have been cancelled, don't warn about the error
+        if not task.cancelled():
+            task.exception()
+
+    async def do(
+        self, key: Hashable, fetch: Callable[[], Awaitable[Any]]
+    ) -> Any:
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            task.add_done_callback(lambda task: self._done(key, task))
+            self._in_flight[key] = task
+            self.calls += 1
+        else:
+            self.coalesced += 1
+
+        # a cancelled waiter (e.g. a fan-out loser) must not cancel the
+        # upstream call the other waiters are sharing, the last one does
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    self._cancel(key, task)
+
+    def _cancel(self, key: Hashable, task: asyncio.Future) -> None:
+        # callers from now on start a call of their own rather than join
+        # one that is being cancelled
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        task.cancel()
+        self.cancelled += 1
+
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'cancelled': self.cancelled,
+            'in_flight': len(self._in_flight),
+        }
+
+
+single_flight = SingleFlight()
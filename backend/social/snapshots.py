@@ -0,0 +1,294 @@
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from typing import (Any, Awaitable, Callable, Dict, List, Optional,
+                    Tuple)
+
+from core import settings
+from starlette.concurrency import run_in_threadpool
+
+from . import codec
+from .models import Article, User
+from .refresher import BackgroundRefresher
+
+_max_age: ContextVar[Optional[float]] = ContextVar('max_age', default=None)
+
+# operations kept in the store, with what their results are made of
+USER_OPERATIONS = ('get_user',)
+ARTICLE_OPERATIONS = ('get_articles',)
+EDGE_OPERATIONS = ('get_friends', 'get_followers')
+OPERATIONS = USER_OPERATIONS + ARTICLE_OPERATIONS + EDGE_OPERATIONS
+
+
+def set_max_age(seconds: Optional[float]) -> None:
+    # snapshots up to this old answer the request without the upstream
+    _max_age.set(seconds)
+
+
+def get_max_age() -> Optional[float]:
+    return _max_age.get()
+
+
+class SnapshotStore:
+
+    purge_every = 1000
+
+    def __init__(self, path: str, retain: float):
+        # snapshots nobody asked for in this long are dropped
+        self.retain = retain
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._connection = sqlite3.connect(
+            path, timeout=5, check_same_thread=False, isolation_level=None
+        )
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.executescript(
+                'CREATE TABLE IF NOT EXISTS snapshots ('
+                'source TEXT, operation TEXT, user_id TEXT, count INTEGER, '
+                'fetched_at REAL, requested_at REAL, '
+                'PRIMARY KEY (source, operation, user_id));'
+                'CREATE INDEX IF NOT EXISTS snapshots_fetched_at '
+                'ON snapshots (fetched_at);'
+                'CREATE TABLE IF NOT EXISTS users ('
+                'source TEXT, user_id TEXT, data BLOB, '
+                'PRIMARY KEY (source, user_id));'
+                'CREATE TABLE IF NOT EXISTS members ('
+                'source TEXT, id TEXT, data BLOB, '
+                'PRIMARY KEY (source, id));'
+                'CREATE TABLE IF NOT EXISTS articles ('
+                'source TEXT, user_id TEXT, position INTEGER, id INTEGER, '
+                'created_at INTEGER, data BLOB, '
+                'PRIMARY KEY (source, user_id, position));'
+                'CREATE TABLE IF NOT EXISTS edges ('
+                'source TEXT, operation TEXT, user_id TEXT, '
+                'position INTEGER, member_id TEXT, '
+                'PRIMARY KEY (source, operation, user_id, position));'
+            )
+
+    def put(
+        self, resource_type: str, operation: str, user_id: str,
+        count: Optional[int], value: Any, requested: bool = True,
+    ) -> None:
+
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute('BEGIN')
+            self._put(resource_type, operation, user_id, value)
+            # background refreshes keep the time of the last real request,
+            # so snapshots nobody reads any more still age out
+            self._connection.execute(
+                'INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (source, operation, user_id) DO UPDATE SET '
+                'count = excluded.count, fetched_at = excluded.fetched_at, '
+                'requested_at = CASE WHEN ? THEN excluded.requested_at '
+                'ELSE requested_at END',
+                (resource_type, operation, user_id, count, now, now,
+                 requested)
+            )
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._purge(now - self.retain)
+
+    def _put(
+        self, resource_type: str, operation: str, user_id: str, value: Any
+    ) -> None:
+
+        execute = self._connection.execute
+        executemany = self._connection.executemany
+        if operation in USER_OPERATIONS:
+            execute(
+                'INSERT OR REPLACE INTO users VALUES (?, ?, ?)',
+                (resource_type, user_id, codec.dumps(value))
+            )
+        elif operation in ARTICLE_OPERATIONS:
+            execute(
+                'DELETE FROM articles WHERE source = ? AND user_id = ?',
+                (resource_type, user_id)
+            )
+            executemany(
+                'INSERT INTO articles VALUES (?, ?, ?, ?, ?, ?)',
+                [(resource_type, user_id, i, x.id, x.created_at,
+                  codec.dumps(x)) for i, x in enumerate(value)]
+            )
+        else:
+            # list members are partial records, VK even inflects their
+            # names, so they are shared between lists but kept apart from
+            # the profiles of get_user
+            execute(
+                'DELETE FROM edges WHERE source = ? AND operation = ? '
+                'AND user_id = ?',
+                (resource_type, operation, user_id)
+            )
+            executemany(
+                'INSERT INTO edges VALUES (?, ?, ?, ?, ?)',
+                [(resource_type, operation, user_id, i, str(x.id))
+                 for i, x in enumerate(value)]
+            )
+            executemany(
+                'INSERT OR REPLACE INTO members VALUES (?, ?, ?)',
+                [(resource_type, str(x.id), codec.dumps(x)) for x in value]
+            )
+
+    def get(
+        self, resource_type: str, operation: str, user_id: str,
+        count: Optional[int], max_age: float,
+    ) -> Tuple[bool, Any, float]:
+
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT count, fetched_at FROM snapshots '
+                'WHERE source = ? AND operation = ? AND user_id = ?',
+                (resource_type, operation, user_id)
+            ).fetchone()
+            age = time.time() - row[1] if row is not None else 0
+            # a shorter list than asked for cannot answer the request
+            if (row is None or age > max_age
+                    or (count is not None and row[0] < count)):
+                return False, None, 0
+            value = self._get(resource_type, operation, user_id, count)
+        return True, value, age
+
+    def _get(
+        self, resource_type: str, operation: str, user_id: str,
+        count: Optional[int],
+    ) -> Any:
+
+        execute = self._connection.execute
+        if operation in USER_OPERATIONS:
+            row = execute(
+                'SELECT data FROM users WHERE source = ? AND user_id = ?',
+                (resource_type, user_id)
+            ).fetchone()
+            return User.construct(**codec.loads(row[0]))
+        elif operation in ARTICLE_OPERATIONS:
+            rows = execute(
+                'SELECT data FROM articles WHERE source = ? AND user_id = ? '
+                'ORDER BY position LIMIT ?',
+                (resource_type, user_id, count)
+            ).fetchall()
+            return [Article.construct(**codec.loads(x[0])) for x in rows]
+        rows = execute(
+            'SELECT m.data FROM edges e JOIN members m '
+            'ON m.source = e.source AND m.id = e.member_id '
+            'WHERE e.source = ? AND e.operation = ? AND e.user_id = ? '
+            'ORDER BY e.position LIMIT ?',
+            (resource_type, operation, user_id, count)
+        ).fetchall()
+        return [User.construct(**codec.loads(x[0])) for x in rows]
+
+    def mutual(
+        self, resource_type: str, user_id: str, other_id: str,
+        operation: str = 'get_friends',
+    ) -> Optional[List[User]]:
+
+        # None unless both lists are in the store
+        with self._lock:
+            known = self._connection.execute(
+                'SELECT COUNT(*) FROM snapshots WHERE source = ? '
+                'AND operation = ? AND user_id IN (?, ?)',
+                (resource_type, operation, user_id, other_id)
+            ).fetchone()[0]
+            if known < (1 if user_id == other_id else 2):
+                return None
+            rows = self._connection.execute(
+                'SELECT m.data FROM edges a JOIN edges b '
+                'ON b.source = a.source AND b.operation = a.operation '
+                'AND b.member_id = a.member_id '
+                'JOIN members m '
+                'ON m.source = a.source AND m.id = a.member_id '
+                'WHERE a.source = ? AND a.operation = ? AND a.user_id = ? '
+                'AND b.user_id = ? ORDER BY a.position',
+                (resource_type, operation, user_id, other_id)
+            ).fetchall()
+        return [User.construct(**codec.loads(x[0])) for x in rows]
+
+    def stale(self, older_than: float, limit: int) -> List[tuple]:
+
+        # response cache keys of the oldest snapshots still being read
+        now = time.time()
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT source, operation, user_id, count FROM snapshots '
+                'WHERE fetched_at <= ? AND requested_at > ? '
+                'ORDER BY fetched_at LIMIT ?',
+                (now - older_than, now - self.retain, limit)
+            ).fetchall()
+        return [tuple(x) for x in rows]
+
+    def _purge(self, before: float) -> None:
+        execute = self._connection.execute
+        execute('DELETE FROM snapshots WHERE requested_at <= ?', (before,))
+        execute(
+            'DELETE FROM articles WHERE NOT EXISTS (SELECT 1 FROM snapshots '
+            "s WHERE s.source = articles.source AND s.operation = "
+            "'get_articles' AND s.user_id = articles.user_id)"
+        )
+        execute(
+            'DELETE FROM edges WHERE NOT EXISTS (SELECT 1 FROM snapshots s '
+            'WHERE s.source = edges.source AND s.operation = edges.operation '
+            'AND s.user_id = edges.user_id)'
+        )
+        execute(
+            "DELETE FROM users WHERE NOT EXISTS (SELECT 1 FROM snapshots s "
+            "WHERE s.source = users.source AND s.operation = 'get_user' "
+            "AND s.user_id = users.user_id)"
+        )
+        execute(
+            'DELETE FROM members WHERE NOT EXISTS (SELECT 1 FROM edges e '
+            'WHERE e.source = members.source AND e.member_id = members.id)'
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT operation, COUNT(*) FROM snapshots GROUP BY operation'
+            ).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class SnapshotRefresher(BackgroundRefresher):
+
+    trace_name = 'snapshot.refresh'
+
+    def __init__(
+        self,
+        store: SnapshotStore,
+        refresh: Callable[[tuple], Awaitable[Any]],
+        batch: int,
+        interval: float,
+        older_than: float,
+    ):
+        super().__init__(refresh, interval, enabled=batch > 0)
+        self.store = store
+        self.batch = batch
+        self.older_than = older_than
+
+    async def _due(self) -> List[List[tuple]]:
+
+        # oldest first, split by source: a throttled source must not end
+        # the round for the other one
+        due: Dict[str, List[tuple]] = {}
+        keys = await run_in_threadpool(
+            self.store.stale, self.older_than, self.batch
+        )
+        for key in keys:
+            due.setdefault(key[0], []).append(key)
+        return list(due.values())
+
+    def stats(self) -> dict:
+        return {**super().stats(), 'snapshots': self.store.stats()}
+
+
+def create_snapshot_store() -> Optional[SnapshotStore]:
+    if not settings.SNAPSHOT_PATH:
+        return None
+    return SnapshotStore(settings.SNAPSHOT_PATH, settings.SNAPSHOT_RETAIN)
+
+
+snapshots = create_snapshot_store()
@@ -0,0 +1,239 @@
+import json
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from core import settings
+from fastapi.logger import logger
+
+
+class Span:
+
+    __slots__ = (
+        'name', 'trace_id', 'span_id', 'parent_id', 'start_time',
+        'end_time', 'attributes', 'events',
+    )
+
+    def __init__(
+        self, name: str, trace_id: str, parent_id: Optional[str],
+        attributes: Dict[str, Any],
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = '{:016x}'.format(random.getrandbits(64))
+        self.parent_id = parent_id
+        self.start_time = time.time_ns()
+        self.end_time: Optional[int] = None
+        self.attributes = attributes
+        self.events: List[tuple] = []
+
+    def rename(self, name: str) -> None:
+        self.name = name
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def event(self, name: str) -> None:
+        self.events.append((name, time.time_ns()))
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start_time': self.start_time,
+            'duration': (self.end_time - self.start_time) / 1e9,
+            'attributes': self.attributes,
+            'events': {
+                name: (at - self.start_time) / 1e9 for name, at in self.events
+            },
+        }
+
+
+class _NoopSpan:
+
+    # handed out for traces that are not sampled, so callers never check
+    def rename(self, name: str) -> None:
+        pass
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def event(self, name: str) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+
+    def __init__(self, trace_id: str, parent_id: Optional[str],
+                 sampled: bool):
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.spans: List[Span] = []
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar('trace', default=None)
+_span: ContextVar[Optional[Span]] = ContextVar('span', default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+class InMemoryExporter:
+
+    def __init__(self, size: int = 100):
+        self.traces: Deque[List[dict]] = deque(maxlen=size)
+
+    def export(self, trace: Trace) -> None:
+        self.traces.append([x.to_dict() for x in trace.spans])
+
+    def clear(self) -> None:
+        self.traces.clear()
+
+
+class FileExporter:
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace) -> None:
+        lines = ''.join(
+            json.dumps(x.to_dict(), default=str) + '\n' for x in trace.spans
+        )
+        with self._lock, open(self.path, 'a') as f:
+            f.write(lines)
+
+
+class OpenTelemetryExporter:
+
+    # replays finished spans into the globally configured OpenTelemetry
+    # tracer provider, the SDK and its exporters are set up by the deployer
+    def __init__(self):
+        from opentelemetry import trace
+
+        self._otel = trace
+        self._tracer = trace.get_tracer(__name__)
+
+    def export(self, trace: Trace) -> None:
+
+        otel = self._otel
+        contexts = {}
+        if trace.parent_id:
+            remote = otel.NonRecordingSpan(otel.SpanContext(
+                trace_id=int(trace.trace_id, 16),
+                span_id=int(trace.parent_id, 16),
+                is_remote=True,
+                trace_flags=otel.TraceFlags(otel.TraceFlags.SAMPLED),
+            ))
+            contexts[trace.parent_id] = otel.set_span_in_context(remote)
+
+        for span in sorted(trace.spans, key=lambda x: x.start_time):
+            otel_span = self._tracer.start_span(
+                span.name,
+                context=contexts.get(span.parent_id),
+                start_time=span.start_time,
+                attributes={
+                    'trace_id': span.trace_id,
+                    **{k: str(v) for k, v in span.attributes.items()},
+                },
+            )
+            for name, at in span.events:
+                otel_span.add_event(name, timestamp=at)
+            otel_span.end(end_time=span.end_time)
+            contexts[span.span_id] = otel.set_span_in_context(otel_span)
+
+
+class Tracer:
+
+    def __init__(self, sample_rate: float, exporter: Any = None):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+
+    @contextmanager
+    def start_trace(
+        self, name: str, trace_id: Optional[str] = None,
+        parent_id: Optional[str] = None, sampled: Optional[bool] = None,
+    ) -> Iterator[Any]:
+
+        # every request gets a trace ID for its log lines, only sampled
+        # ones record spans
+        if sampled is None:
+            sampled = random.random() < self.sample_rate
+        trace = Trace(
+            trace_id or '{:032x}'.format(random.getrandbits(128)),
+            parent_id,
+            sampled and self.exporter is not None,
+        )
+
+        token = _trace.set(trace)
+        try:
+            with self.span(name) as root:
+                yield root
+        finally:
+            _trace.reset(token)
+            if trace.sampled:
+                try:
+                    self.exporter.export(trace)
+                except Exception as e:
+                    logger.warning("Tracer.export(), e = {}".format(repr(e)))
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Any]:
+
+        trace = _trace.get()
+        if trace is None or not trace.sampled:
+            yield NOOP_SPAN
+            return
+
+        parent = _span.get()
+        span = Span(
+            name, trace.trace_id,
+            parent.span_id if parent is not None else trace.parent_id,
+            attributes,
+        )
+        token = _span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.attributes['error'] = type(e).__name__
+            raise
+        finally:
+            span.end_time = time.time_ns()
+            _span.reset(token)
+            trace.spans.append(span)
+
+
+def _create_exporter(name: str) -> Any:
+
+    if name == 'memory':
+        return InMemoryExporter()
+    elif name == 'file':
+        return FileExporter(settings.TRACE_FILE_PATH)
+    elif name == 'otel':
+        try:
+            return OpenTelemetryExporter()
+        except ImportError:
+            logger.warning("opentelemetry is not installed, tracing is off")
+    return None
+
+
+tracer = Tracer(
+    sample_rate=settings.TRACE_SAMPLE_RATE,
+    exporter=_create_exporter(settings.TRACE_EXPORTER),
+)
+
+
+def span(name: str, **attributes):
+    return tracer.span(name, **attributes)
@@ -0,0 +1,90 @@
+import asyncio
+
+import httpx
+import pytest
+from social import base as social_api
+from social.cache import negative_cache, response_cache
+from social.constants import RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK
+from social.credentials import reset_credential_pools
+from social.exceptions import UnknownError, UserDoesNotExist
+from social.models import UsersPage
+from social.ratelimit import governor
+from social.resolution import source_index
+
+
+def make_session(handler) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+class FakeClient:
+
+    def __init__(self, resource_type, users, calls):
+        self.resource_type = resource_type
+        self.users = users
+        self.calls = calls
+
+    async def get_user(self, user_id):
+        self.calls.append((self.resource_type, 'get_user', user_id))
+        await asyncio.sleep(0)
+        if user_id not in self.users:
+            raise UserDoesNotExist()
+        return self.users[user_id]
+
+    async def get_users(self, user_ids):
+        self.calls.append((self.resource_type, 'get_users', user_ids))
+        await asyncio.sleep(0)
+        return {x: self.users[x] for x in user_ids if x in self.users}
+
+    async def get_articles(self, user_id, count=10):
+        self.calls.append((self.resource_type, 'get_articles', user_id))
+        if user_id not in self.users:
+            raise UserDoesNotExist()
+        return ['article'] * count
+
+    async def get_friends(self, user_id, count=10):
+        self.calls.append((self.resource_type, 'get_friends', user_id))
+        raise UnknownError()
+
+    async def get_friends_page(self, user_id, cursor=None, count=None):
+        self.calls.append((self.resource_type, 'get_friends_page', cursor))
+        if user_id not in self.users:
+            raise UserDoesNotExist()
+        offset = int(cursor or 0)
+        next_cursor = str(offset + 2) if offset + 2 < 5 else None
+        return UsersPage(users=[], next_cursor=next_cursor)
+
+
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    governor.reset()
+    reset_credential_pools()
+    yield
+    governor.reset()
+    reset_credential_pools()
+
+
+@pytest.fixture
+def users():
+    # what each fake source has, tests may change it
+    return {
+        RESOURCE_TYPE_VK: {'1': 'vk-1', 'durov': 'vk-durov'},
+        RESOURCE_TYPE_TWITTER: {'twitterapi': 'twitter-1'},
+    }
+
+
+@pytest.fixture
+def calls(monkeypatch, users):
+    calls = []
+    monkeypatch.setattr(
+        social_api.AsyncClientFactory, 'create_client',
+        lambda resource_type: FakeClient(
+            resource_type, users[resource_type], calls
+        )
+    )
+    response_cache.clear()
+    negative_cache.clear()
+    source_index.clear()
+    yield calls
+    response_cache.clear()
+    negative_cache.clear()
+    source_index.clear()
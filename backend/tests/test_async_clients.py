@@ -0,0 +1,243 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+from core import settings
+from social import clients
+from social.async_clients import (AsyncTwitterClient, AsyncVKClient,
+                                  ClientRegistry)
+from social.clients import TwitterClient, VKClient
+from social.constants import RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK
+from social.exceptions import AuthorizationError, UserDoesNotExist
+from tests.conftest import make_session
+
+VK_USER = {
+    'id': 1,
+    'first_name': 'Pavel',
+    'screen_name': 'durov',
+    'photo': 'https://vk.com/images/camera_50.png',
+    'followers_count': 10,
+    'common_count': 0,
+}
+
+TWITTER_USER = {
+    'id': 6253282,
+    'screen_name': 'twitterapi',
+    'name': 'Twitter API',
+    'followers_count': 10,
+    'friends_count': 20,
+    'profile_image_url': 'http://pbs.twimg.com/profile_images/1.png',
+    'description': '',
+}
+
+
+def test_vk_get_user():
+
+    def handler(request):
+        assert request.url.params['user_ids'] == '1'
+        return httpx.Response(200, json={'response': [VK_USER]})
+
+    client = AsyncVKClient(session=make_session(handler))
+    user = asyncio.run(client.get_user('1'))
+    assert user.id == 1
+    assert user.screen_name == 'durov'
+
+
+def test_vk_error_codes():
+
+    def handler(request):
+        code = 113 if request.url.params['user_ids'] == 'missing' else 5
+        return httpx.Response(200, json={'error': {'error_code': code}})
+
+    client = AsyncVKClient(session=make_session(handler))
+    with pytest.raises(UserDoesNotExist):
+        asyncio.run(client.get_user('missing'))
+    with pytest.raises(AuthorizationError):
+        asyncio.run(client.get_user('1'))
+
+
+def test_twitter_get_user_is_signed():
+
+    def handler(request):
+        assert 'oauth_signature' in request.url.params
+        assert request.url.params['screen_name'] == 'twitterapi'
+        return httpx.Response(200, content=json.dumps([TWITTER_USER]))
+
+    client = AsyncTwitterClient(session=make_session(handler))
+    user = asyncio.run(client.get_user('twitterapi'))
+    assert user.id == TWITTER_USER['id']
+
+
+def test_twitter_not_found():
+
+    def handler(request):
+        return httpx.Response(404, content=b'{}')
+
+    client = AsyncTwitterClient(session=make_session(handler))
+    with pytest.raises(UserDoesNotExist):
+        asyncio.run(client.get_friends('-1'))
+
+
+def test_vk_get_users_is_chunked(monkeypatch):
+    monkeypatch.setattr(AsyncVKClient, 'users_batch_size', 2)
+    requests = []
+
+    def handler(request):
+        user_ids = request.url.params['user_ids'].split(',')
+        requests.append(user_ids)
+        users = [
+            {**VK_USER, 'id': int(x), 'screen_name': 'id' + x}
+            for x in user_ids if x != '3'
+        ]
+        return httpx.Response(200, json={'response': users})
+
+    client = AsyncVKClient(session=make_session(handler))
+    users = asyncio.run(client.get_users(['1', '2', '3', '1', '4']))
+
+    assert sorted(requests) == [['1', '2'], ['3', '4']]
+    assert sorted(users) == ['1', '2', '4']
+    assert users['4'].id == 4
+
+
+def test_twitter_get_users_mixes_ids_and_screen_names():
+
+    def handler(request):
+        assert request.url.params['user_id'] == '42'
+        assert request.url.params['screen_name'] == 'TwitterAPI,missing'
+        return httpx.Response(200, content=json.dumps([TWITTER_USER]))
+
+    client = AsyncTwitterClient(session=make_session(handler))
+    users = asyncio.run(client.get_users(['42', 'TwitterAPI', 'missing']))
+    assert list(users) == ['TwitterAPI']
+
+
+def test_vk_friends_pages_by_offset():
+
+    def handler(request):
+        offset = int(request.url.params['offset'])
+        assert request.url.params['count'] == '2'
+        items = [{**VK_USER, 'id': offset + i} for i in range(2)]
+        return httpx.Response(
+            200, json={'response': {'count': 3, 'items': items[:3 - offset]}}
+        )
+
+    client = AsyncVKClient(session=make_session(handler))
+    page = asyncio.run(client.get_friends_page('1', count=2))
+    assert [x.id for x in page.users] == [0, 1]
+    assert page.next_cursor == '2'
+
+    page = asyncio.run(client.get_friends_page('1', page.next_cursor, 2))
+    assert [x.id for x in page.users] == [2]
+    assert page.next_cursor is None
+
+
+def test_vk_bundle_is_one_execute_call():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        code = request.url.params['code']
+        assert 'API.users.get(' in code and 'API.wall.get(' in code
+        assert 'API.friends.get(' not in code
+        return httpx.Response(200, json={
+            'response': {'user': [VK_USER], 'articles': False},
+            'execute_errors': [{'method': 'wall.get', 'error_code': 30}],
+        })
+
+    client = AsyncVKClient(session=make_session(handler))
+    bundle = asyncio.run(client.get_bundle('1', ['articles'], 5))
+    assert len(requests) == 1
+    assert requests[0].url.path.endswith('/execute')
+    assert bundle['user'].id == 1
+    assert isinstance(bundle['articles'], UserDoesNotExist)
+
+
+def test_twitter_followers_pages_by_cursor():
+
+    def handler(request):
+        assert request.url.params['cursor'] == '-1'
+        assert request.url.params['count'] == '200'
+        return httpx.Response(200, content=json.dumps({
+            'users': [TWITTER_USER], 'next_cursor_str': '1234',
+        }))
+
+    client = AsyncTwitterClient(session=make_session(handler))
+    page = asyncio.run(client.get_followers_page('twitterapi', count=500))
+    assert page.next_cursor == '1234'
+
+
+def test_registry_reuses_clients():
+    registry = ClientRegistry()
+    registry.start()
+    vk_client = registry.get(RESOURCE_TYPE_VK)
+    assert registry.get(RESOURCE_TYPE_VK) is vk_client
+    assert registry.get(RESOURCE_TYPE_TWITTER) is not vk_client
+
+    asyncio.run(registry.close())
+    assert registry.get(RESOURCE_TYPE_VK) is not vk_client
+
+
+def test_sync_twitter_client_reuses_oauth_client():
+    client = TwitterClient()
+    oauth_client = client._get_oauth_client()
+    assert client._get_oauth_client() is oauth_client
+
+    client.close()
+    assert client._get_oauth_client() is not oauth_client
+
+
+def test_vk_articles_delta_skips_an_old_pinned_post():
+
+    def post(post_id, **extra):
+        return {'id': post_id, 'text': '', **extra}
+
+    def handler(request):
+        return httpx.Response(200, json={'response': {'count': 4, 'items': [
+            post(5, is_pinned=1), post(12), post(11), post(10),
+        ]}})
+
+    client = AsyncVKClient(session=make_session(handler))
+    articles = asyncio.run(client.get_articles('1', count=10, since_id=10))
+    assert [x.id for x in articles] == [12, 11]
+
+
+def test_vk_articles_window_stops_at_the_page_limit(monkeypatch):
+    monkeypatch.setattr(settings, 'VK_WALL_MAX_PAGES', 3)
+    offsets = []
+
+    def handler(request):
+        # a wall of 100000 posts, none of them older than max_id
+        offset = int(request.url.params.get('offset', 0))
+        size = int(request.url.params['count'])
+        offsets.append(offset)
+        return httpx.Response(200, json={'response': {
+            'count': 100000,
+            'items': [{'id': 10 ** 6 - offset - i, 'text': ''}
+                      for i in range(size)],
+        }})
+
+    client = AsyncVKClient(session=make_session(handler))
+    articles = asyncio.run(client.get_articles('1', count=10, max_id=10))
+    assert articles == []
+    assert offsets == [0, 10, 30]
+
+
+def test_vk_http_session_is_created_once(monkeypatch):
+
+    class SlowSession(clients.requests.Session):
+
+        def __init__(self):
+            time.sleep(0.01)
+            super().__init__()
+
+    monkeypatch.setattr(clients.requests, 'Session', SlowSession)
+    client = VKClient()
+    with ThreadPoolExecutor(8) as pool:
+        sessions = list(pool.map(
+            lambda _: client._get_http_session(), range(8)
+        ))
+    assert len({id(x) for x in sessions}) == 1
+    client.close()
@@ -0,0 +1,414 @@
+import asyncio
+import json
+
+import pytest
+from main import app
+from social import base as social_api
+from core import settings
+from social.cache import negative_cache, response_cache, timelines
+from social.constants import RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK
+from social.exceptions import (DeadlineExceeded, RateLimitExceeded,
+                               SourceUnavailable, UnknownError,
+                               UserDoesNotExist, WrongCursor)
+from social.models import Article
+from social.resolution import source_index
+from social.singleflight import single_flight
+from starlette.testclient import TestClient
+from tests.conftest import FakeClient
+
+
+class FakeBundleClient(FakeClient):
+
+    supports_bundle = True
+
+    async def get_bundle(self, user_id, include, count=10):
+        self.calls.append((self.resource_type, 'get_bundle', tuple(include)))
+        bundle = {'user': self.users[user_id]}
+        for section in include:
+            bundle[section] = [section] * count
+        return bundle
+
+
+def test_get_user_is_cached(calls):
+    for _ in range(3):
+        user = asyncio.run(social_api.get_user('1', RESOURCE_TYPE_VK))
+        assert user == 'vk-1'
+    assert len(calls) == 1
+
+
+def test_missing_user_is_negatively_cached(calls):
+    for _ in range(3):
+        with pytest.raises(UserDoesNotExist):
+            asyncio.run(social_api.get_user('missing'))
+    assert sorted(calls) == [
+        (RESOURCE_TYPE_TWITTER, 'get_user', 'missing'),
+        (RESOURCE_TYPE_VK, 'get_user', 'missing'),
+    ]
+
+
+def test_fallback_skips_sources_known_to_be_missing(calls):
+    assert asyncio.run(social_api.get_user('twitterapi')) == 'twitter-1'
+    response_cache.clear()
+    calls.clear()
+
+    assert asyncio.run(social_api.get_user('twitterapi')) == 'twitter-1'
+    assert calls == [(RESOURCE_TYPE_TWITTER, 'get_user', 'twitterapi')]
+
+
+def test_concurrent_lookups_are_coalesced(calls):
+
+    async def lookup():
+        return await asyncio.gather(*[
+            social_api.get_user('1', RESOURCE_TYPE_VK) for _ in range(10)
+        ])
+
+    coalesced = single_flight.coalesced
+    assert asyncio.run(lookup()) == ['vk-1'] * 10
+    assert len(calls) == 1
+    assert single_flight.coalesced - coalesced == 9
+
+
+def test_coalesced_callers_share_errors(calls):
+
+    async def lookup():
+        return await asyncio.gather(*[
+            social_api.get_user('-', RESOURCE_TYPE_VK) for _ in range(5)
+        ], return_exceptions=True)
+
+    results = asyncio.run(lookup())
+    assert all(isinstance(x, UserDoesNotExist) for x in results)
+    assert len(calls) == 1
+
+
+def test_get_users_merges_sources_and_caches(calls):
+    users = asyncio.run(social_api.get_users(['1', 'twitterapi', '-', '1']))
+    assert users == {'1': 'vk-1', 'twitterapi': 'twitter-1', '-': None}
+
+    calls.clear()
+    assert asyncio.run(social_api.get_user('1', RESOURCE_TYPE_VK)) == 'vk-1'
+    users = asyncio.run(social_api.get_users(['twitterapi', '-']))
+    assert users == {'twitterapi': 'twitter-1', '-': None}
+    assert calls == []
+
+
+def collect(pages):
+
+    async def consume():
+        return [page.next_cursor async for page in pages]
+
+    return asyncio.run(consume())
+
+
+def test_iter_friends_walks_all_pages_and_resumes(calls):
+    cursors = collect(social_api.iter_friends('twitterapi'))
+    assert cursors == ['twitter:2', 'twitter:4', None]
+
+    calls.clear()
+    cursors = collect(
+        social_api.iter_friends('twitterapi', cursor='twitter:4')
+    )
+    assert cursors == [None]
+    assert calls == [(RESOURCE_TYPE_TWITTER, 'get_friends_page', '4')]
+
+
+def test_stream_ends_a_cut_short_list_with_a_status_line(
+    monkeypatch, users, calls
+):
+
+    class FailingClient(FakeClient):
+
+        async def get_friends_page(self, user_id, cursor=None, count=None):
+            if cursor == '4':
+                raise UnknownError()
+            return await super().get_friends_page(user_id, cursor, count)
+
+    monkeypatch.setattr(
+        social_api.AsyncClientFactory, 'create_client',
+        lambda resource_type: FailingClient(
+            resource_type, users[resource_type], calls
+        )
+    )
+    response = TestClient(app).get(
+        '/api/v1/user/twitterapi/friend/stream',
+        params={'source': RESOURCE_TYPE_TWITTER},
+    )
+    lines = [json.loads(x) for x in response.text.splitlines()]
+    assert [x['next_cursor'] for x in lines[:2]] == [
+        'twitter:2', 'twitter:4'
+    ]
+    assert lines[2] == {'status': 500, 'next_cursor': 'twitter:4'}
+
+
+def test_iter_friends_rejects_foreign_cursor(calls):
+    with pytest.raises(WrongCursor):
+        collect(social_api.iter_friends('1', cursor='myspace:4'))
+    with pytest.raises(WrongCursor):
+        collect(social_api.iter_friends(
+            'twitterapi', RESOURCE_TYPE_VK, cursor='twitter:4'
+        ))
+    assert collect(social_api.iter_friends(
+        'twitterapi', RESOURCE_TYPE_TWITTER, cursor='twitter:4'
+    )) == [None]
+
+
+def test_bundle_calls_sections_concurrently(calls):
+    bundle = asyncio.run(
+        social_api.get_bundle('twitterapi', ['articles', 'friends'], 2)
+    )
+    assert bundle['user'] == 'twitter-1'
+    assert bundle['articles'] == ['article', 'article']
+    assert isinstance(bundle['friends'], UnknownError)
+
+
+def test_bundle_fetches_only_uncached_sections(calls, monkeypatch):
+    users = {'1': 'vk-1'}
+    monkeypatch.setattr(
+        social_api.AsyncClientFactory, 'create_client',
+        lambda resource_type: FakeBundleClient(resource_type, users, calls)
+    )
+
+    asyncio.run(social_api.get_articles('1', 3, RESOURCE_TYPE_VK))
+    calls.clear()
+
+    bundle = asyncio.run(social_api.get_bundle(
+        '1', ['articles', 'followers'], 3, RESOURCE_TYPE_VK
+    ))
+    assert bundle == {
+        'user': 'vk-1',
+        'articles': ['article'] * 3,
+        'followers': ['followers'] * 3,
+    }
+    assert calls == [(RESOURCE_TYPE_VK, 'get_bundle', ('followers',))]
+
+    calls.clear()
+    assert asyncio.run(
+        social_api.get_followers('1', 3, RESOURCE_TYPE_VK)
+    ) == ['followers'] * 3
+    assert calls == []
+
+
+class Post:
+
+    def __init__(self, post_id):
+        self.id = post_id
+
+    def __eq__(self, other):
+        return self.id == other.id
+
+
+class FakeTimelineClient:
+
+    def __init__(self, calls):
+        self.calls = calls
+        self.newest = 20
+
+    async def get_articles(self, user_id, count=10, since_id=None,
+                           max_id=None):
+        self.calls.append((count, since_id))
+        oldest = max(since_id or 0, self.newest - count)
+        return [Post(x) for x in range(self.newest, oldest, -1)]
+
+
+def test_incremental_articles_fetch_only_new_posts(monkeypatch):
+    calls = []
+    client = FakeTimelineClient(calls)
+    monkeypatch.setattr(settings, 'ARTICLES_INCREMENTAL', True)
+    monkeypatch.setattr(
+        social_api.AsyncClientFactory, 'create_client', lambda _: client
+    )
+    timelines.clear()
+    response_cache.clear()
+
+    def poll(count=5):
+        response_cache.clear()
+        articles = asyncio.run(
+            social_api.get_articles('1', count, RESOURCE_TYPE_VK)
+        )
+        return [x.id for x in articles]
+
+    assert poll() == [20, 19, 18, 17, 16]
+    client.newest = 22
+    assert poll() == [22, 21, 20, 19, 18]
+    assert poll(3) == [22, 21, 20]
+    # more new posts than the window: the delta replaces the timeline
+    client.newest = 40
+    assert poll() == [40, 39, 38, 37, 36]
+    assert calls == [(5, None), (5, 20), (5, 22), (5, 22)]
+    timelines.clear()
+
+
+class FeedClient:
+
+    def __init__(self, resource_type, timelines, calls):
+        self.resource_type = resource_type
+        self.timelines = timelines
+        self.calls = calls
+
+    async def get_articles(self, user_id, count=10):
+        self.calls.append((self.resource_type, user_id))
+        if user_id == 'slow':
+            await asyncio.sleep(1)
+        if user_id not in self.timelines:
+            raise UserDoesNotExist()
+        return [
+            Article(
+                id=x, text='', likes_count=0, comments_count=0,
+                reposts_count=0, retweet_count=0, created_at=x,
+            )
+            for x in self.timelines[user_id][:count]
+        ]
+
+
+@pytest.fixture
+def feed_clients(monkeypatch):
+    calls = []
+    timelines = {
+        RESOURCE_TYPE_VK: {'1': [9, 5, 1], '2': [8, 2], 'slow': [10]},
+        RESOURCE_TYPE_TWITTER: {'twitterapi': [7, 6, 3]},
+    }
+    monkeypatch.setattr(settings, 'FEED_ACCOUNT_TIMEOUT', 0.05)
+    monkeypatch.setattr(
+        social_api.AsyncClientFactory, 'create_client',
+        lambda resource_type: FeedClient(
+            resource_type, timelines[resource_type], calls
+        )
+    )
+    response_cache.clear()
+    negative_cache.clear()
+    source_index.clear()
+    yield calls
+    response_cache.clear()
+    negative_cache.clear()
+    source_index.clear()
+
+
+def test_feed_merges_timelines_and_isolates_failures(feed_clients):
+    accounts = [
+        (RESOURCE_TYPE_VK, '1'), (RESOURCE_TYPE_VK, '2'),
+        (RESOURCE_TYPE_TWITTER, 'twitterapi'), (RESOURCE_TYPE_VK, '-'),
+        (RESOURCE_TYPE_VK, 'slow'), (RESOURCE_TYPE_VK, '1'),
+    ]
+    results = asyncio.run(social_api.get_timelines(accounts, 10))
+
+    assert isinstance(results[(RESOURCE_TYPE_VK, '-')], UserDoesNotExist)
+    assert isinstance(results[(RESOURCE_TYPE_VK, 'slow')], DeadlineExceeded)
+    assert len(feed_clients) == 5
+
+    feed = [
+        (user_id, article.created_at)
+        for _, user_id, article in social_api.merge_feed(results)
+    ]
+    assert feed == [
+        ('1', 9), ('2', 8), ('twitterapi', 7), ('twitterapi', 6),
+        ('1', 5), ('twitterapi', 3), ('2', 2), ('1', 1),
+    ]
+
+
+def test_feed_endpoint_streams_articles_then_failures(feed_clients):
+    response = TestClient(app).post('/api/v1/feed', json={
+        'accounts': [
+            {'source': RESOURCE_TYPE_VK, 'user_id': '1'},
+            {'source': RESOURCE_TYPE_TWITTER, 'user_id': 'twitterapi'},
+            {'source': RESOURCE_TYPE_TWITTER, 'user_id': '-'},
+        ],
+        'count': 2,
+        'limit': 3,
+    })
+    assert response.status_code == 200
+    lines = [json.loads(x) for x in response.text.splitlines()]
+    assert [(x['user_id'], x['article']['id']) for x in lines[:3]] == [
+        ('1', 9), ('twitterapi', 7), ('twitterapi', 6),
+    ]
+    assert lines[3] == {
+        'source': RESOURCE_TYPE_TWITTER, 'user_id': '-', 'status': 404,
+    }
+
+
+@pytest.mark.parametrize('body', [
+    {'limit': -1}, {'count': 0}, {'count': 1000},
+])
+def test_feed_rejects_out_of_range_counts(feed_clients, body):
+    response = TestClient(app).post('/api/v1/feed', json={
+        'accounts': [{'source': RESOURCE_TYPE_VK, 'user_id': '1'}], **body,
+    })
+    assert response.status_code == 422
+
+
+class FeedBatchClient(FeedClient):
+
+    supports_bundle = True
+
+    async def get_timelines(self, user_ids, count=10):
+        self.calls.append((self.resource_type, tuple(user_ids)))
+        results = {}
+        for user_id in user_ids:
+            try:
+                results[user_id] = await FeedClient.get_articles(
+                    self, user_id, count
+                )
+            except UserDoesNotExist as e:
+                results[user_id] = e
+        return results
+
+
+def test_feed_batches_walls_into_execute_chunks(monkeypatch, feed_clients):
+    timelines = {str(x): [x] for x in range(60)}
+    clients = {
+        RESOURCE_TYPE_VK: FeedBatchClient(RESOURCE_TYPE_VK, timelines, []),
+    }
+    monkeypatch.setattr(
+        social_api.AsyncClientFactory, 'create_client',
+        lambda resource_type: clients[resource_type]
+    )
+    calls = clients[RESOURCE_TYPE_VK].calls
+    accounts = [(RESOURCE_TYPE_VK, str(x)) for x in range(60)]
+
+    results = asyncio.run(social_api.get_timelines(
+        accounts + [(RESOURCE_TYPE_VK, 'missing')], 10
+    ))
+    assert [len(x[1]) for x in calls if isinstance(x[1], tuple)] == [
+        25, 25, 11,
+    ]
+    assert isinstance(results[(RESOURCE_TYPE_VK, 'missing')],
+                      UserDoesNotExist)
+    assert results[(RESOURCE_TYPE_VK, '7')][0].id == 7
+
+    # cached walls and known missing accounts are not asked for again
+    calls.clear()
+    asyncio.run(social_api.get_timelines(
+        accounts + [(RESOURCE_TYPE_VK, 'missing'), (RESOURCE_TYPE_VK, '0')],
+        10
+    ))
+    assert calls == []
+
+
+def test_get_users_survives_a_failed_source(monkeypatch, calls):
+    original = social_api._call_batch
+
+    async def call_batch(resource_type, user_ids):
+        if resource_type == RESOURCE_TYPE_TWITTER:
+            raise RateLimitExceeded()
+        return await original(resource_type, user_ids)
+
+    monkeypatch.setattr(social_api, '_call_batch', call_batch)
+    users = asyncio.run(social_api.get_users(['1', 'twitterapi']))
+    assert users['1'] == 'vk-1'
+    assert isinstance(users['twitterapi'], RateLimitExceeded)
+
+    response = TestClient(app).post(
+        '/api/v1/users:batch', json={'user_ids': ['twitterapi']}
+    )
+    assert response.json()['users'][0]['status'] == 429
+
+    class FailingClient(FakeClient):
+
+        async def get_users(self, user_ids):
+            raise SourceUnavailable()
+
+    # every source failed
+    monkeypatch.setattr(
+        social_api.AsyncClientFactory, 'create_client',
+        lambda resource_type: FailingClient(resource_type, {}, calls)
+    )
+    with pytest.raises(SourceUnavailable):
+        asyncio.run(social_api.get_users(['2']))
@@ -0,0 +1,62 @@
+import asyncio
+
+from social.batching import UserBatcher
+from social.exceptions import UnknownError, UserDoesNotExist
+
+
+class FakeClient:
+
+    def __init__(self, batches, error=None):
+        self.batches = batches
+        self.error = error
+
+    async def get_users(self, user_ids):
+        self.batches.append(user_ids)
+        if self.error:
+            raise self.error
+        return {x: 'user-' + x for x in user_ids if x != 'missing'}
+
+
+def run_lookups(batcher, user_ids):
+
+    async def lookups():
+        return await asyncio.gather(*[
+            batcher.get_user('vkontakte', user_id) for user_id in user_ids
+        ], return_exceptions=True)
+
+    return asyncio.run(lookups())
+
+
+def test_lookups_within_window_share_one_call():
+    batches = []
+    batcher = UserBatcher(0.01, 100, lambda x: FakeClient(batches))
+
+    results = run_lookups(batcher, ['1', '2', '1', 'missing'])
+
+    assert batches == [['1', '2', 'missing']]
+    assert results[:3] == ['user-1', 'user-2', 'user-1']
+    assert isinstance(results[3], UserDoesNotExist)
+    assert batcher.stats()['batches'] == 1
+    assert batcher.stats()['average_batch_size'] == 3
+
+
+def test_max_size_flushes_early():
+    batches = []
+    batcher = UserBatcher(10, 2, lambda x: FakeClient(batches))
+
+    results = run_lookups(batcher, ['1', '2', '3', '4'])
+
+    assert batches == [['1', '2'], ['3', '4']]
+    assert results == ['user-1', 'user-2', 'user-3', 'user-4']
+    assert batcher.stats()['batch_sizes'] == {'<=2': 2}
+
+
+def test_batch_errors_reach_every_waiter():
+    batches = []
+    batcher = UserBatcher(
+        0.01, 100, lambda x: FakeClient(batches, UnknownError())
+    )
+
+    results = run_lookups(batcher, ['1', '2'])
+    assert batches == [['1', '2']]
+    assert all(isinstance(x, UnknownError) for x in results)
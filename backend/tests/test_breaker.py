@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+from main import app
+from social import base as social_api
+from social.breaker import (STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN,
+                            BreakerRegistry, CircuitBreaker, breakers)
+from social.constants import RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK
+from social.exceptions import (SocialConnectionError, SourceUnavailable,
+                               UserDoesNotExist)
+from starlette.testclient import TestClient
+
+
+def make_breaker(**kwargs):
+    params = {
+        'window': 4,
+        'min_calls': 4,
+        'failure_rate': 0.5,
+        'slow_call_seconds': 1,
+        'open_seconds': 60,
+        'half_open_calls': 1,
+        **kwargs,
+    }
+    return CircuitBreaker(**params)
+
+
+def test_opens_on_failure_rate():
+    breaker = make_breaker()
+    for failed in (False, True, False):
+        breaker.record(failed, 0)
+    assert breaker.state == STATE_CLOSED
+
+    breaker.record(True, 0)
+    assert breaker.state == STATE_OPEN
+    assert not breaker.allow()
+
+
+def test_slow_calls_count_as_failures():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record(False, 2)
+    assert breaker.state == STATE_OPEN
+
+
+def test_half_open_probe_closes_or_reopens():
+    breaker = make_breaker(open_seconds=0)
+    for _ in range(4):
+        breaker.record(True, 0)
+
+    assert breaker.allow()
+    assert breaker.state == STATE_HALF_OPEN
+    assert not breaker.allow()
+    breaker.record(True, 0)
+    assert breaker.state == STATE_OPEN
+
+    assert breaker.allow()
+    breaker.record(False, 0)
+    assert breaker.state == STATE_CLOSED
+
+
+def test_missing_users_do_not_trip_the_breaker():
+    registry = BreakerRegistry(
+        window=2, min_calls=2, failure_rate=0.75, slow_call_seconds=1,
+        open_seconds=60, half_open_calls=1,
+    )
+
+    async def fetch(error):
+        raise error
+
+    for error in (UserDoesNotExist(), UserDoesNotExist()):
+        with pytest.raises(UserDoesNotExist):
+            asyncio.run(registry.call('vkontakte', 'get_user',
+                                      lambda: fetch(error)))
+    assert not registry.is_open('vkontakte', 'get_user')
+
+    for error in (SocialConnectionError(), SocialConnectionError()):
+        with pytest.raises(SocialConnectionError):
+            asyncio.run(registry.call('vkontakte', 'get_user',
+                                      lambda: fetch(error)))
+    with pytest.raises(SourceUnavailable):
+        asyncio.run(registry.call('vkontakte', 'get_user',
+                                  lambda: fetch(None)))
+
+
+@pytest.fixture
+def vk_is_down(monkeypatch):
+    calls = []
+
+    class FakeClient:
+
+        def __init__(self, resource_type):
+            self.resource_type = resource_type
+
+        async def get_user(self, user_id):
+            calls.append(self.resource_type)
+            return 'user'
+
+    monkeypatch.setattr(
+        social_api.AsyncClientFactory, 'create_client', FakeClient
+    )
+    breakers.reset()
+    breaker = breakers.get(RESOURCE_TYPE_VK, 'get_user')
+    for _ in range(breaker.window):
+        breaker.record(True, 0)
+    yield calls
+    breakers.reset()
+
+
+def test_fan_out_skips_open_source(vk_is_down):
+    assert asyncio.run(social_api.get_user('breaker1')) == 'user'
+    assert vk_is_down == [RESOURCE_TYPE_TWITTER]
+
+
+def test_explicit_source_fails_fast_with_503(vk_is_down):
+    client = TestClient(app)
+    response = client.get(
+        '/api/v1/user/breaker-2', params={'source': RESOURCE_TYPE_VK}
+    )
+    assert response.status_code == 503
+    assert int(response.headers['Retry-After']) > 0
+    assert vk_is_down == []
+
+    health = client.get('/api/v1/health').json()
+    assert health['status'] == 'degraded'
+    assert health['breakers']['vkontakte:get_user']['state'] == 'open'
+
+
+def test_combined_bundle_call_shares_the_profile_breaker(
+    vk_is_down, monkeypatch
+):
+
+    class BundleClient:
+
+        supports_bundle = True
+
+        def __init__(self, resource_type):
+            self.resource_type = resource_type
+
+        async def get_bundle(self, user_id, include, count=10):
+            vk_is_down.append('get_bundle')
+            return {'user': 'user'}
+
+    monkeypatch.setattr(
+        social_api.AsyncClientFactory, 'create_client', BundleClient
+    )
+    with pytest.raises(SourceUnavailable):
+        asyncio.run(social_api.get_bundle(
+            'breaker-3', [], resource_type=RESOURCE_TYPE_VK
+        ))
+    assert vk_is_down == []
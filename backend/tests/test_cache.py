@@ -0,0 +1,267 @@
+import asyncio
+
+import pytest
+from social import base as social_api
+from social.cache import (HotKeys, LRUCache, NegativeCache, ResponseCache,
+                          SQLiteCacheBackend)
+from social.constants import RESOURCE_TYPE_VK
+from social.exceptions import RateLimitExceeded, UserDoesNotExist
+from social.models import User
+from social.refresher import Refresher
+
+
+def make_fetch(calls, result):
+
+    async def fetch():
+        calls.append(1)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return fetch
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1, ttl=60)
+    cache.set('b', 2, ttl=60)
+    assert cache.get('a') == (True, 1)
+    cache.set('c', 3, ttl=60)
+
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_lru_expires_entries():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1, ttl=0.01)
+    asyncio.run(asyncio.sleep(0.02))
+    assert cache.get('a') == (False, None)
+    assert len(cache) == 0
+
+
+def test_response_cache_hits_and_ttls():
+    cache = ResponseCache(maxsize=10, ttls={'get_user': 60})
+    calls = []
+    key = ('vkontakte', 'get_user', '1', None)
+
+    for _ in range(3):
+        result = asyncio.run(
+            cache.get_or_fetch(key, 'get_user', make_fetch(calls, 'user'))
+        )
+        assert result == 'user'
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 2
+
+    key = ('vkontakte', 'get_articles', '1', 10)
+    for _ in range(2):
+        asyncio.run(
+            cache.get_or_fetch(key, 'get_articles', make_fetch(calls, []))
+        )
+    assert len(calls) == 3
+
+
+def test_response_cache_does_not_store_errors():
+    cache = ResponseCache(maxsize=10, ttls={'get_user': 60})
+    calls = []
+    key = ('vkontakte', 'get_user', '-', None)
+
+    for _ in range(2):
+        with pytest.raises(UserDoesNotExist):
+            asyncio.run(cache.get_or_fetch(
+                key, 'get_user', make_fetch(calls, UserDoesNotExist())
+            ))
+    assert len(calls) == 2
+
+
+def test_shared_tier_is_reused_by_other_workers(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    key = ('twitter', 'get_user', 'twitterapi', None)
+    calls = []
+
+    worker = ResponseCache(10, {'get_user': 60}, SQLiteCacheBackend(path))
+    asyncio.run(worker.get_or_fetch(
+        key, 'get_user', make_fetch(calls, {'id': 1})
+    ))
+
+    other = ResponseCache(10, {'get_user': 60}, SQLiteCacheBackend(path))
+    result = asyncio.run(other.get_or_fetch(
+        key, 'get_user', make_fetch(calls, {'id': 2})
+    ))
+
+    assert result == {'id': 1}
+    assert len(calls) == 1
+    assert other.stats()['shared_hits'] == 1
+
+
+def test_shared_tier_stores_json_and_rebuilds_models(tmp_path):
+    path = str(tmp_path / 'data' / 'cache.sqlite3')
+    key = ('vk', 'get_friends', '1', 1)
+    friend = User(
+        id=2, screen_name='id2', name='User', followers_count=0,
+        friends_count=0, image_url='', description='',
+    )
+
+    worker = ResponseCache(
+        10, {'get_friends': 60}, SQLiteCacheBackend(path),
+        models={'get_friends': User},
+    )
+    asyncio.run(worker.set(key, 'get_friends', [friend]))
+    raw = worker.shared._connection.execute(
+        'SELECT value FROM response_cache'
+    ).fetchone()[0]
+    assert raw.startswith(b'[{"id":2')
+
+    other = ResponseCache(
+        10, {'get_friends': 60}, SQLiteCacheBackend(path),
+        models={'get_friends': User},
+    )
+    found, value = asyncio.run(other.get(key, 'get_friends'))
+    assert found and value == [friend]
+
+
+def test_lru_keeps_expired_entries_for_the_grace_window():
+    cache = LRUCache(maxsize=2, grace=60)
+    cache.set('a', 1, ttl=0.01)
+    asyncio.run(asyncio.sleep(0.02))
+
+    assert cache.get('a') == (False, None)
+    found, value, remaining = cache.get_with_ttl('a')
+    assert (found, value) == (True, 1)
+    assert remaining < 0
+    assert cache.stats()['stale_hits'] == 1
+
+
+def test_response_cache_serves_stale_and_refreshes_once():
+    cache = ResponseCache(maxsize=10, ttls={'get_user': 60}, grace=60)
+    key = ('vkontakte', 'get_user', '1', None)
+    cache.local.set(key, 'old', ttl=0.01)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'new'
+
+    async def run():
+        await asyncio.sleep(0.02)
+        stale = await asyncio.gather(*[
+            cache.get_or_fetch(key, 'get_user', fetch) for _ in range(5)
+        ])
+        await asyncio.sleep(0.05)
+        return stale, await cache.get_or_fetch(key, 'get_user', fetch)
+
+    stale, fresh = asyncio.run(run())
+    assert stale == ['old'] * 5
+    assert fresh == 'new'
+    assert len(calls) == 1
+    assert cache.stats()['revalidations'] == 1
+
+
+def test_response_cache_keeps_stale_value_when_refresh_fails():
+    cache = ResponseCache(maxsize=10, ttls={'get_user': 60}, grace=60)
+    key = ('vkontakte', 'get_user', '1', None)
+    cache.local.set(key, 'old', ttl=0.01)
+    calls = []
+
+    async def run():
+        await asyncio.sleep(0.02)
+        fetch = make_fetch(calls, UserDoesNotExist())
+        first = await cache.get_or_fetch(key, 'get_user', fetch)
+        await asyncio.sleep(0.01)
+        return first, await cache.get_or_fetch(key, 'get_user', fetch)
+
+    assert asyncio.run(run()) == ('old', 'old')
+    assert cache.stats()['refresh_errors'] == 2
+
+
+def test_hot_keys_rank_and_decay():
+    hot_keys = HotKeys(maxsize=2)
+    for key, count in (('a', 3), ('b', 5), ('c', 1)):
+        for _ in range(count):
+            hot_keys.add(key)
+    assert hot_keys.top(2) == ['b', 'a']
+
+    hot_keys.decay()
+    assert hot_keys.counts == {'b': 2.5, 'a': 1.5, 'c': 0.5}
+    hot_keys.decay()
+    assert 'c' not in hot_keys.counts
+
+
+def test_refresher_renews_hot_entries_before_they_expire():
+    cache = ResponseCache(maxsize=10, ttls={'get_user': 60}, hot_keys=10)
+    hot = ('vkontakte', 'get_user', 'hot', None)
+    cold = ('vkontakte', 'get_user', 'cold', None)
+    fresh = ('twitter', 'get_user', 'fresh', None)
+    for key, ttl in ((hot, 1), (cold, 1), (fresh, 60)):
+        cache.local.set(key, 'old', ttl)
+    for _ in range(3):
+        asyncio.run(cache.get_or_fetch(hot, 'get_user', None))
+        asyncio.run(cache.get_or_fetch(fresh, 'get_user', None))
+    refreshed = []
+
+    async def refresh(key):
+        refreshed.append(key)
+        await cache.set(key, 'get_user', 'new')
+
+    refresher = Refresher(cache, refresh, top_n=2, interval=1, ahead=5)
+    asyncio.run(refresher.run_once())
+
+    assert refreshed == [hot]
+    assert cache.local.get(hot) == (True, 'new')
+    assert cache.local.get(cold) == (True, 'old')
+
+
+def test_refresher_stops_a_source_once_it_is_throttled():
+    cache = ResponseCache(maxsize=10, ttls={'get_user': 60}, hot_keys=10)
+    keys = [('vkontakte', 'get_user', str(i), None) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.local.set(key, 'old', 1)
+        for _ in range(3 - i):
+            cache.hot_keys.add(key)
+    refreshed = []
+
+    async def refresh(key):
+        if refreshed:
+            raise RateLimitExceeded()
+        refreshed.append(key)
+
+    refresher = Refresher(cache, refresh, top_n=3, interval=1, ahead=5)
+    asyncio.run(refresher.run_once())
+
+    assert refreshed == [keys[0]]
+    assert refresher.stats()['skipped'] == 2
+
+
+def test_requests_do_not_join_background_refreshes(calls):
+    key = social_api._key(RESOURCE_TYPE_VK, 'get_user', '1', ())
+
+    async def lookup():
+        return await asyncio.gather(
+            social_api._refresh(key),
+            social_api.get_user('1', RESOURCE_TYPE_VK),
+        )
+
+    assert asyncio.run(lookup()) == [None, 'vk-1']
+    assert len(calls) == 2
+
+
+def test_negative_cache_scopes_by_operation():
+    cache = NegativeCache(maxsize=10, ttl=60)
+    cache.add('vkontakte', '1', 'get_articles')
+    assert cache.is_missing('vkontakte', '1', 'get_articles')
+    assert not cache.is_missing('vkontakte', '1', 'get_user')
+
+    cache.add('vkontakte', '1', 'get_user')
+    assert cache.is_missing('vkontakte', '1', 'get_friends')
+    assert not cache.is_missing('twitter', '1', 'get_user')
+
+
+def test_negative_cache_is_bounded():
+    cache = NegativeCache(maxsize=100, ttl=60)
+    for user_id in range(1000):
+        cache.add('vkontakte', str(user_id), 'get_user')
+    assert cache.stats()['size'] == 100
+    assert cache.is_missing('vkontakte', '999', 'get_user')
+    assert not cache.is_missing('vkontakte', '0', 'get_user')
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+from core import settings
+from social import codec
+from social.clients import TwitterClient, VKClient
+from social.exceptions import WrongServerResponse
+from social.models import UsersPage
+
+VK_USERS = {'count': 2, 'items': [
+    {
+        'id': 1,
+        'first_name': 'Pavel',
+        'screen_name': 'durov',
+        'photo': 'https://vk.com/images/camera_50.png',
+        'followers_count': 10,
+        'common_count': 2,
+    },
+    {
+        'id': 2,
+        'first_name': 'Nikolai',
+        'screen_name': 'nikolai',
+        'photo': 'https://vk.com/images/camera_50.png',
+    },
+]}
+
+VK_ARTICLES = {'items': [{
+    'id': 1,
+    'text': 'hello',
+    'likes': {'count': 3},
+    'comments': {'count': 2},
+    'reposts': {'count': 1},
+    'date': 1219842525,
+}]}
+
+TWITTER_USERS = {'users': [{
+    'id': 6253282,
+    'screen_name': 'twitterapi',
+    'name': 'Twitter API',
+    'followers_count': 10,
+    'friends_count': 20,
+    'profile_image_url': 'http://pbs.twimg.com/profile_images/1.png',
+    'description': None,
+}]}
+
+TWITTER_ARTICLES = [{
+    'id': 1, 'text': 'hello', 'favorite_count': 3, 'retweet_count': 4,
+    'created_at': 'Wed Aug 27 13:08:45 +0000 2008',
+}]
+
+
+def parse_all():
+    return [
+        VKClient._parse_users(VK_USERS),
+        VKClient._parse_articles(VK_ARTICLES),
+        TwitterClient._parse_users({**TWITTER_USERS, 'users': [
+            {**TWITTER_USERS['users'][0], 'description': ''}
+        ]}),
+        TwitterClient._parse_articles(TWITTER_ARTICLES),
+    ]
+
+
+def test_trusted_payloads_match_validated_ones(monkeypatch):
+    validated = parse_all()
+    monkeypatch.setattr(settings, 'TRUST_UPSTREAM_PAYLOADS', True)
+    trusted = parse_all()
+
+    assert [[x.dict() for x in items] for items in trusted] == \
+        [[x.dict() for x in items] for items in validated]
+    assert TwitterClient._parse_users(TWITTER_USERS)[0].description == ''
+    assert trusted[1][0].created_at == trusted[3][0].created_at == 1219842525
+
+
+def test_trusted_payloads_still_reject_a_wrong_shape(monkeypatch):
+    monkeypatch.setattr(settings, 'TRUST_UPSTREAM_PAYLOADS', True)
+    with pytest.raises(WrongServerResponse):
+        VKClient._parse_users({'items': [{'id': 1}]})
+
+
+def test_dumps_serializes_nested_models():
+    page = UsersPage(users=VKClient._parse_users(VK_USERS), next_cursor='2')
+    assert json.loads(codec.dumps(page)) == json.loads(page.json())
+    assert codec.loads(codec.dumps([page])) == [json.loads(page.json())]
@@ -0,0 +1,98 @@
+import pytest
+from api import conditional
+from api.conditional import matches, representations
+from main import app
+from social import base as social_api
+from social.models import User
+from starlette.testclient import TestClient
+
+USER = User(
+    id=1, screen_name='durov', name='Pavel', followers_count=10,
+    friends_count=20, image_url='https://vk.com/images/camera_50.png',
+    description='',
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_representations():
+    representations.clear()
+    yield
+    representations.clear()
+
+
+@pytest.fixture
+def dumps_calls(monkeypatch):
+    calls = []
+    dumps = conditional.codec.dumps
+
+    def counting_dumps(content):
+        calls.append(content)
+        return dumps(content)
+
+    monkeypatch.setattr(conditional.codec, 'dumps', counting_dumps)
+    return calls
+
+
+def test_if_none_match_is_answered_with_304(monkeypatch, dumps_calls):
+
+    async def get_user(user_id, resource_type=None):
+        return USER
+
+    monkeypatch.setattr(social_api, 'get_user', get_user)
+    client = TestClient(app)
+
+    response = client.get('/api/v1/user/1')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert etag.startswith('"') and not etag.startswith('W/')
+    assert response.headers['Cache-Control'].startswith('max-age=')
+    assert 'Last-Modified' in response.headers
+
+    response = client.get('/api/v1/user/1', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['ETag'] == etag
+
+    # the cached result is the same object: hashed and serialized once
+    assert len(dumps_calls) == 1
+
+
+def test_changed_content_gets_a_new_etag(monkeypatch, dumps_calls):
+    users = [USER, USER.copy(update={'followers_count': 11})]
+
+    async def get_user(user_id, resource_type=None):
+        return users[0]
+
+    monkeypatch.setattr(social_api, 'get_user', get_user)
+    client = TestClient(app)
+
+    etag = client.get('/api/v1/user/1').headers['ETag']
+    users.pop(0)
+    response = client.get('/api/v1/user/1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.json()['followers_count'] == 11
+
+
+def test_equal_content_keeps_etag_and_last_modified(monkeypatch):
+
+    async def get_articles(user_id, count, resource_type=None, *args):
+        # a fresh but equal list on every call, e.g. after a refresh
+        return [{'id': 1, 'text': 'hello'}]
+
+    monkeypatch.setattr(social_api, 'get_articles', get_articles)
+    client = TestClient(app)
+
+    first = client.get('/api/v1/user/1/article')
+    second = client.get('/api/v1/user/1/article')
+    assert first.headers['ETag'] == second.headers['ETag']
+    assert first.headers['Last-Modified'] == second.headers['Last-Modified']
+
+
+def test_if_none_match_comparison():
+    assert matches('"a"', '"a"')
+    assert matches('W/"a"', '"a"')
+    assert matches('"b", "a"', '"a"')
+    assert matches('*', '"a"')
+    assert not matches('"b"', '"a"')
+    assert not matches(None, '"a"')
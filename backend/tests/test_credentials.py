@@ -0,0 +1,129 @@
+import asyncio
+
+import httpx
+import pytest
+from social.async_clients import AsyncTwitterClient, AsyncVKClient
+from social.constants import RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK
+from social.credentials import Credential, CredentialPool
+from social.exceptions import AuthorizationError, InvalidCredentials
+from social.ratelimit import governor
+
+VK_USER = {
+    'id': 1,
+    'first_name': 'Pavel',
+    'screen_name': 'durov',
+    'photo': 'https://vk.com/images/camera_50.png',
+}
+
+
+def make_pool(*tokens) -> CredentialPool:
+    return CredentialPool(
+        RESOURCE_TYPE_VK, [Credential(x) for x in tokens], 60
+    )
+
+
+def test_least_loaded_credential_is_picked():
+    pool = make_pool('a', 'b', 'c')
+    with pool.use('users.get') as first:
+        with pool.use('users.get') as second:
+            third = pool.acquire('users.get')
+    assert len({first.token, second.token, third.token}) == 3
+
+
+def test_throttled_credential_is_avoided():
+    pool = make_pool('a', 'b')
+    governor.block(RESOURCE_TYPE_VK, 'users.get', 'a', 10)
+    assert pool.acquire('users.get').token == 'b'
+
+
+def test_rejected_credential_is_quarantined():
+    pool = make_pool('a', 'b')
+    with pytest.raises(InvalidCredentials):
+        with pool.use('users.get') as first:
+            raise InvalidCredentials()
+    assert first.auth_failures == 1
+    assert pool.available() == [x for x in pool.credentials if x is not first]
+    assert pool.acquire('users.get') is not first
+    with pytest.raises(AuthorizationError):
+        make_pool().acquire('users.get')
+
+
+def test_quarantined_single_credential_still_gets_through():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.params['access_token'])
+        if len(calls) == 1:
+            return httpx.Response(200, json={'error': {'error_code': 5}})
+        return httpx.Response(200, json={'response': [VK_USER]})
+
+    pool = make_pool('only')
+    client = AsyncVKClient(
+        session=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        credentials=pool,
+    )
+    with pytest.raises(InvalidCredentials):
+        asyncio.run(client.get_user('1'))
+    assert pool.available() == []
+
+    # the default setup has nothing to rotate to, calls go on with it
+    assert asyncio.run(client.get_user('1')).id == 1
+    assert calls == ['only', 'only']
+
+
+def test_vk_client_fails_over_to_a_valid_token():
+    tokens = []
+
+    def handler(request):
+        tokens.append(request.url.params['access_token'])
+        if request.url.params['access_token'] == 'revoked':
+            return httpx.Response(200, json={'error': {'error_code': 5}})
+        return httpx.Response(200, json={'response': [VK_USER]})
+
+    pool = make_pool('revoked', 'valid')
+    client = AsyncVKClient(
+        session=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        credentials=pool,
+    )
+    for _ in range(3):
+        assert asyncio.run(client.get_user('1')).id == 1
+    assert tokens == ['revoked', 'valid', 'valid', 'valid']
+    assert pool.credentials[0].auth_failures == 1
+
+
+def test_resource_level_401_keeps_the_pool():
+    tokens = []
+
+    def handler(request):
+        tokens.append(request.url.params['oauth_token'])
+        if request.url.params['screen_name'] == 'protected':
+            return httpx.Response(401, json={'error': 'Not authorized.'})
+        if request.url.params['oauth_token'] == 'expired':
+            return httpx.Response(401, json={
+                'errors': [{'code': 89, 'message': 'Invalid token'}]
+            })
+        return httpx.Response(200, json=[{
+            'id': 1, 'screen_name': 'twitterapi', 'name': 'Twitter API',
+            'followers_count': 0, 'friends_count': 0,
+            'profile_image_url': '', 'description': '',
+        }])
+
+    pool = CredentialPool(RESOURCE_TYPE_TWITTER, [
+        Credential(x, secrets=('key', 'secret', x, 'token_secret'))
+        for x in ('a', 'b', 'expired')
+    ], 60)
+    client = AsyncTwitterClient(
+        session=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        credentials=pool,
+    )
+
+    with pytest.raises(AuthorizationError) as e:
+        asyncio.run(client.get_user('protected'))
+    assert not isinstance(e.value, InvalidCredentials)
+    assert len(tokens) == 1
+    assert len(pool.available()) == 3
+
+    # only the token the upstream rejected is rotated out
+    pool.credentials[0].in_flight = pool.credentials[1].in_flight = 1
+    assert asyncio.run(client.get_user('twitterapi')).id == 1
+    assert [x.token for x in pool.available()] == ['a', 'b']
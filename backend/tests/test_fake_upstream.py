@@ -0,0 +1,135 @@
+import asyncio
+
+import httpx
+import pytest
+from benchmarks.fake_upstream import Config, create_app
+from benchmarks.load import compare, percentile
+from social.async_clients import AsyncTwitterClient, AsyncVKClient
+from social.exceptions import UserDoesNotExist
+
+
+def make_session(**config) -> httpx.AsyncClient:
+    app = create_app(Config(latency_ms=0, seed=0, **config))
+    return httpx.AsyncClient(app=app)
+
+
+def test_vk_client_parses_fake_payloads():
+
+    client = AsyncVKClient(session=make_session(friends_count=15))
+
+    async def run():
+        user = await client.get_user('1')
+        friends = await client.get_friends('1', count=10)
+        page = await client.get_friends_page('1', cursor='10', count=10)
+        articles = await client.get_articles('1', count=3)
+        return user, friends, page, articles
+
+    user, friends, page, articles = asyncio.run(run())
+    assert user.id == 1
+    assert len(friends) == 10
+    assert len(page.users) == 5 and page.next_cursor is None
+    assert len(articles) == 3
+
+    with pytest.raises(UserDoesNotExist):
+        asyncio.run(client.get_user('missing'))
+
+
+def test_vk_bundle_runs_through_execute():
+
+    client = AsyncVKClient(session=make_session())
+    bundle = asyncio.run(
+        client.get_bundle('1', ['articles', 'friends'], 5)
+    )
+    assert bundle['user'].id == 1
+    assert len(bundle['articles']) == 5
+    assert len(bundle['friends']) == 5
+
+
+def test_twitter_client_parses_fake_payloads():
+
+    client = AsyncTwitterClient(session=make_session(friends_count=15))
+
+    async def run():
+        user = await client.get_user('twitterapi')
+        page = await client.get_followers_page('twitterapi', count=10)
+        return user, page
+
+    user, page = asyncio.run(run())
+    assert user.screen_name == 'twitterapi'
+    assert len(page.users) == 10 and page.next_cursor == '10'
+
+    with pytest.raises(UserDoesNotExist):
+        asyncio.run(client.get_user('missing'))
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 95) == 0.0
+
+
+def test_compare_flags_regressions():
+
+    def report(throughput, p95_ms):
+        return {'results': [{
+            'scenario': 'user', 'concurrency': 10,
+            'throughput': throughput, 'p95_ms': p95_ms,
+        }]}
+
+    assert compare(report(100, 50), report(95, 54), 0.1) == []
+    regressions = compare(report(100, 50), report(80, 60), 0.1)
+    assert len(regressions) == 2
+
+
+def test_vk_articles_delta_is_emulated_with_growing_pages():
+    session = make_session(posts_count=100)
+    client = AsyncVKClient(session=session)
+    offsets = []
+
+    async def get(*args, **kwargs):
+        offsets.append(kwargs['params'].get('offset', 0))
+        return await AsyncVKClient._get(client, *args, **kwargs)
+
+    client._get = get
+
+    async def run():
+        delta = await client.get_articles('1', count=50, since_id=93)
+        older = await client.get_articles('1', count=3, max_id=50)
+        return delta, older
+
+    delta, older = asyncio.run(run())
+    assert [x.id for x in delta] == [100, 99, 98, 97, 96, 95, 94]
+    # pages of 5 and 10 posts, not the whole window of 50
+    assert offsets[:2] == [0, 5]
+    assert [x.id for x in older] == [50, 49, 48]
+
+
+def test_twitter_articles_pass_since_id_and_max_id():
+    client = AsyncTwitterClient(session=make_session(posts_count=100))
+
+    async def run():
+        delta = await client.get_articles('twitterapi', 10, since_id=97)
+        older = await client.get_articles('twitterapi', 2, max_id=50)
+        return delta, older
+
+    delta, older = asyncio.run(run())
+    assert [x.id for x in delta] == [100, 99, 98]
+    assert [x.id for x in older] == [50, 49]
+
+
+def test_vk_timelines_share_one_execute_call():
+    client = AsyncVKClient(session=make_session(posts_count=20))
+    methods = []
+
+    async def get(*args, **kwargs):
+        methods.append(args[1])
+        return await AsyncVKClient._get(client, *args, **kwargs)
+
+    client._get = get
+    timelines = asyncio.run(
+        client.get_timelines(['1', 'missing1', '2'], count=3)
+    )
+    assert methods == ['execute']
+    assert [x.id for x in timelines['2']] == [20, 19, 18]
+    assert isinstance(timelines['missing1'], UserDoesNotExist)
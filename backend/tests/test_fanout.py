@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+from social.constants import (FANOUT_POLICY_FIRST, FANOUT_POLICY_MERGE,
+                              FANOUT_POLICY_PRIORITY,
+                              FANOUT_POLICY_SEQUENTIAL)
+from social.exceptions import (AuthorizationError, SocialException,
+                               UserDoesNotExist)
+from social.fanout import fan_out
+from social.singleflight import SingleFlight
+
+
+def make_call(result, delay=0.0, log=None):
+
+    async def call():
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if log is not None:
+                log.append('cancelled')
+            raise
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return call
+
+
+def run(calls, policy, ignore=(SocialException,), **kwargs):
+    return asyncio.run(fan_out(calls, ignore, policy=policy, **kwargs))
+
+
+def test_first_returns_fastest_and_cancels_others():
+    log = []
+    calls = {
+        'vk': make_call('vk', delay=1, log=log),
+        'twitter': make_call('twitter'),
+    }
+    assert run(calls, FANOUT_POLICY_FIRST) == 'twitter'
+    assert log == ['cancelled']
+
+
+def test_losers_upstream_call_is_cancelled_through_single_flight():
+    log = []
+    flight = SingleFlight()
+    calls = {
+        'vk': lambda: flight.do('vk', make_call('vk', delay=1, log=log)),
+        'twitter': lambda: flight.do('twitter', make_call('twitter')),
+    }
+
+    async def lookup():
+        result = await fan_out(
+            calls, (SocialException,), policy=FANOUT_POLICY_FIRST
+        )
+        # before asyncio.run would cancel whatever is left on shutdown
+        await asyncio.sleep(0.01)
+        return result, list(log)
+
+    assert asyncio.run(lookup()) == ('twitter', ['cancelled'])
+
+
+def test_shared_upstream_call_outlives_a_cancelled_waiter():
+    log = []
+    flight = SingleFlight()
+    fetch = make_call('vk', delay=0.01, log=log)
+
+    async def lookup():
+        loser = asyncio.ensure_future(flight.do('vk', fetch))
+        winner = asyncio.ensure_future(flight.do('vk', fetch))
+        await asyncio.sleep(0)
+        loser.cancel()
+        return await winner
+
+    assert asyncio.run(lookup()) == 'vk'
+    assert log == []
+
+
+def test_first_skips_ignored_failures():
+    calls = {
+        'vk': make_call(UserDoesNotExist()),
+        'twitter': make_call('twitter', delay=0.01),
+    }
+    assert run(calls, FANOUT_POLICY_FIRST) == 'twitter'
+
+
+def test_first_propagates_not_ignored_failures():
+    calls = {
+        'vk': make_call(AuthorizationError()),
+        'twitter': make_call('twitter', delay=0.1),
+    }
+    with pytest.raises(AuthorizationError):
+        run(calls, FANOUT_POLICY_FIRST, ignore=(UserDoesNotExist,))
+
+
+def test_priority_waits_for_preferred_source():
+    calls = {
+        'vk': make_call('vk', delay=0.05),
+        'twitter': make_call('twitter'),
+    }
+    assert run(calls, FANOUT_POLICY_PRIORITY, deadline=1) == 'vk'
+
+
+def test_priority_falls_back_after_deadline():
+    calls = {
+        'vk': make_call('vk', delay=1),
+        'twitter': make_call('twitter'),
+    }
+    assert run(calls, FANOUT_POLICY_PRIORITY, deadline=0.05) == 'twitter'
+
+
+def test_merge_combines_all_results():
+    calls = {
+        'vk': make_call([1, 2], delay=0.02),
+        'twitter': make_call(UserDoesNotExist()),
+        'other': make_call([3]),
+    }
+    result = run(
+        calls, FANOUT_POLICY_MERGE, merge=lambda x: sum(x, [])
+    )
+    assert result == [1, 2, 3]
+
+
+def test_all_sources_missing():
+    calls = {
+        'vk': make_call(UserDoesNotExist()),
+        'twitter': make_call(UserDoesNotExist()),
+    }
+    for policy in (FANOUT_POLICY_SEQUENTIAL, FANOUT_POLICY_FIRST,
+                   FANOUT_POLICY_PRIORITY, FANOUT_POLICY_MERGE):
+        with pytest.raises(UserDoesNotExist):
+            run(calls, policy)
@@ -0,0 +1,48 @@
+import logging
+
+from core import settings
+from social import logs
+
+
+def test_response_is_logged_without_the_body(caplog):
+    caplog.set_level(logging.DEBUG, logger='fastapi')
+    logs.log_response('vkontakte', 'users.get', 200, 0.0, b'x' * 100)
+
+    [record] = caplog.records
+    assert record.levelno == logging.INFO
+    assert record.endpoint == 'users.get'
+    assert record.bytes == 100
+    assert 'x' * 10 not in record.getMessage()
+
+
+def test_body_is_sampled_and_truncated(caplog, monkeypatch):
+    monkeypatch.setattr(settings, 'LOG_UPSTREAM_BODIES', True)
+    monkeypatch.setattr(settings, 'LOG_BODY_MAX_BYTES', 10)
+    caplog.set_level(logging.DEBUG, logger='fastapi')
+    logs.log_response('vkontakte', 'users.get', 200, 0.0, b'x' * 100)
+
+    [_, record] = caplog.records
+    assert record.levelno == logging.DEBUG
+    assert record.getMessage().endswith('x' * 10 + '... (100 bytes)')
+
+    caplog.clear()
+    monkeypatch.setattr(settings, 'LOG_BODY_SAMPLE_RATE', 0.0)
+    logs.log_response('vkontakte', 'users.get', 200, 0.0, b'x' * 100)
+    assert len(caplog.records) == 1
+
+
+def test_body_is_not_formatted_above_debug(monkeypatch):
+    formatted = []
+
+    class Body(bytes):
+        def __getitem__(self, key):
+            formatted.append(key)
+            return super().__getitem__(key)
+
+    monkeypatch.setattr(settings, 'LOG_UPSTREAM_BODIES', True)
+    logging.getLogger('fastapi').setLevel(logging.INFO)
+    try:
+        logs.log_response('twitter', 'users/show.json', 200, 0.0, Body(b'x'))
+    finally:
+        logging.getLogger('fastapi').setLevel(logging.NOTSET)
+    assert formatted == []
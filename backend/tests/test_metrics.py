@@ -0,0 +1,100 @@
+import os
+import time
+
+from social.metrics import (Counter, Gauge, Histogram, MultiProcessCollector,
+                            Registry, render)
+
+
+def make_registry():
+    registry = Registry()
+    latency = registry.register(Histogram(
+        'latency_seconds', 'Latency.', ('source',), buckets=(0.1, 1.0)
+    ))
+    errors = registry.register(Counter(
+        'errors_total', 'Errors.', ('source', 'error')
+    ))
+    in_flight = registry.register(Gauge('in_flight', 'In flight.'))
+    return registry, latency, errors, in_flight
+
+
+def test_render_exposition_format():
+    registry, latency, errors, in_flight = make_registry()
+    latency.observe(0.05, 'vkontakte')
+    latency.observe(0.5, 'vkontakte')
+    latency.observe(5, 'vkontakte')
+    errors.inc('twitter', 'Say "hi"')
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+
+    lines = render([registry.snapshot()]).splitlines()
+    assert '# TYPE latency_seconds histogram' in lines
+    assert 'latency_seconds_bucket{source="vkontakte",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{source="vkontakte",le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{source="vkontakte",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{source="vkontakte"} 3' in lines
+    assert 'errors_total{source="twitter",error="Say \\"hi\\""} 1.0' in lines
+    assert 'in_flight 1.0' in lines
+
+
+def test_snapshots_of_workers_are_summed():
+    first, latency, errors, _ = make_registry()
+    second, other_latency, other_errors, _ = make_registry()
+    latency.observe(0.05, 'vkontakte')
+    other_latency.observe(0.5, 'vkontakte')
+    errors.inc('vkontakte', 'UnknownError')
+    other_errors.inc('vkontakte', 'UnknownError')
+
+    lines = render([first.snapshot(), second.snapshot()]).splitlines()
+    assert 'latency_seconds_bucket{source="vkontakte",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{source="vkontakte",le="1.0"} 2' in lines
+    assert 'errors_total{source="vkontakte",error="UnknownError"} 2.0' in lines
+
+
+def test_collector_drops_gauges_of_stale_workers(tmp_path, monkeypatch):
+    registry, _, errors, in_flight = make_registry()
+    monkeypatch.setattr('social.metrics.registry', registry)
+    errors.inc('vkontakte', 'UnknownError')
+    in_flight.inc()
+
+    collector = MultiProcessCollector(str(tmp_path), interval=1)
+    collector.write()
+    path = str(tmp_path / '{}.json'.format(os.getpid()))
+    os.rename(path, str(tmp_path / '1.json'))
+    registry.reset()
+
+    lines = render(collector.snapshots()).splitlines()
+    assert 'errors_total{source="vkontakte",error="UnknownError"} 1.0' in lines
+    assert 'in_flight 1.0' in lines
+
+    stale = time.time() - 10
+    os.utime(str(tmp_path / '1.json'), (stale, stale))
+    lines = render(collector.snapshots()).splitlines()
+    assert 'errors_total{source="vkontakte",error="UnknownError"} 1.0' in lines
+    assert 'in_flight 1.0' not in lines
+
+
+def test_collector_folds_a_stopped_worker_into_the_totals(
+    tmp_path, monkeypatch
+):
+    registry, latency, errors, in_flight = make_registry()
+    monkeypatch.setattr('social.metrics.registry', registry)
+    collector = MultiProcessCollector(str(tmp_path), interval=1)
+
+    # two generations of the same worker, each shutting down cleanly
+    for _ in range(2):
+        registry.reset()
+        errors.inc('vkontakte', 'UnknownError')
+        latency.observe(0.5, 'vkontakte')
+        in_flight.inc()
+        collector.write()
+        collector.stop()
+
+    assert sorted(os.listdir(str(tmp_path))) == [
+        'totals.json', 'totals.json.lock'
+    ]
+    registry.reset()
+    lines = render(collector.snapshots()).splitlines()
+    assert 'errors_total{source="vkontakte",error="UnknownError"} 2.0' in lines
+    assert 'latency_seconds_count{source="vkontakte"} 2' in lines
+    assert 'in_flight 1.0' not in lines
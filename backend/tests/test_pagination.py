@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+from social.exceptions import UnknownError
+from social.pagination import prefetch
+
+
+async def numbers(produced, count, error=None):
+    for i in range(count):
+        produced.append(i)
+        yield i
+    if error:
+        raise error
+
+
+def test_prefetch_yields_everything_in_order():
+    produced = []
+
+    async def consume():
+        return [x async for x in prefetch(numbers(produced, 5), 2)]
+
+    assert asyncio.run(consume()) == [0, 1, 2, 3, 4]
+
+
+def test_prefetch_stays_bounded_ahead_of_consumer():
+    produced = []
+
+    async def consume():
+        pages = prefetch(numbers(produced, 100), 2)
+        first = await pages.__anext__()
+        await asyncio.sleep(0.01)
+        await pages.aclose()
+        return first
+
+    assert asyncio.run(consume()) == 0
+    # one item handed out, two queued, one waiting on the full queue
+    assert len(produced) <= 4
+
+
+def test_prefetch_closes_the_wrapped_generator():
+    log = []
+
+    async def pages():
+        try:
+            for i in range(100):
+                yield i
+        finally:
+            log.append('closed')
+
+    async def consume():
+        items = prefetch(pages(), 2)
+        first = await items.__anext__()
+        await items.aclose()
+        return first, list(log)
+
+    assert asyncio.run(consume()) == (0, ['closed'])
+
+
+def test_prefetch_reraises_producer_errors():
+    produced = []
+
+    async def consume():
+        return [x async for x in prefetch(
+            numbers(produced, 2, UnknownError()), 2
+        )]
+
+    with pytest.raises(UnknownError):
+        asyncio.run(consume())
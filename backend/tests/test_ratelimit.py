@@ -0,0 +1,147 @@
+import asyncio
+import time
+
+import httplib2
+import httpx
+import pytest
+from main import app
+from social import base as social_api
+from social.async_clients import AsyncTwitterClient, AsyncVKClient
+from social.clients import TwitterClient, VKClient
+from social.constants import RESOURCE_TYPE_VK
+from social.exceptions import RateLimitExceeded
+from social.ratelimit import (RateLimitGovernor, TokenBucket, governor,
+                              set_background)
+from starlette.testclient import TestClient
+from tests.conftest import make_session
+
+
+def test_bucket_queues_requests_within_max_wait():
+    bucket = TokenBucket(capacity=2, period=0.1)
+    assert bucket.reserve(max_wait=1) == 0
+    assert bucket.reserve(max_wait=1) == 0
+    assert bucket.reserve(max_wait=1) == pytest.approx(0.05, abs=0.01)
+    assert bucket.reserve(max_wait=1) == pytest.approx(0.1, abs=0.01)
+
+
+def test_bucket_rejects_requests_beyond_max_wait():
+    bucket = TokenBucket(capacity=1, period=10)
+    bucket.reserve(max_wait=0)
+    with pytest.raises(RateLimitExceeded) as e:
+        bucket.reserve(max_wait=1)
+    assert e.value.retry_after == pytest.approx(10, abs=0.1)
+
+
+def test_background_calls_leave_the_reserve_to_requests():
+    limits = {'vkontakte': {'*': (4, 10)}}
+    limiter = RateLimitGovernor(limits, max_wait=5, background_reserve=0.5)
+
+    async def acquire(background):
+        set_background(background)
+        await limiter.acquire('vkontakte', 'users.get', 'token')
+
+    asyncio.run(acquire(True))
+    asyncio.run(acquire(True))
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(acquire(True))
+    asyncio.run(acquire(False))
+    asyncio.run(acquire(False))
+
+
+def test_governor_separates_endpoints_and_credentials():
+    limits = {'twitter': {'a': (1, 10), '*': (1, 10)}}
+    limiter = RateLimitGovernor(limits, max_wait=0)
+
+    async def acquire(endpoint, credential):
+        await limiter.acquire('twitter', endpoint, credential)
+
+    asyncio.run(acquire('a', 'token'))
+    asyncio.run(acquire('b', 'token'))
+    asyncio.run(acquire('a', 'other-token'))
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(acquire('a', 'token'))
+    # unknown endpoints share the source-wide bucket
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(acquire('c', 'token'))
+
+
+def test_twitter_headers_block_until_reset():
+
+    def handler(request):
+        return httpx.Response(429, content=b'{}', headers={
+            'x-rate-limit-remaining': '0',
+            'x-rate-limit-reset': str(int(time.time()) + 120),
+        })
+
+    client = AsyncTwitterClient(session=make_session(handler))
+    with pytest.raises(RateLimitExceeded) as e:
+        asyncio.run(client.get_friends('twitterapi'))
+    assert e.value.retry_after == pytest.approx(120, abs=2)
+
+    # the next call is refused locally instead of reaching Twitter
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(client.get_friends('twitterapi'))
+
+
+def test_vk_too_many_requests_is_distinct():
+
+    def handler(request):
+        return httpx.Response(200, json={'error': {'error_code': 6}})
+
+    client = AsyncVKClient(session=make_session(handler))
+    with pytest.raises(RateLimitExceeded) as e:
+        asyncio.run(client.get_user('1'))
+    assert e.value.retry_after == 1
+
+
+def test_sync_twitter_client_goes_through_the_governor(monkeypatch):
+    calls = []
+
+    class OAuthClient:
+
+        def request(self, url):
+            calls.append(url)
+            return httplib2.Response({
+                'status': '429',
+                'x-rate-limit-remaining': '0',
+                'x-rate-limit-reset': str(int(time.time()) + 120),
+            }), b'{}'
+
+    client = TwitterClient()
+    monkeypatch.setattr(client, '_get_oauth_client', OAuthClient)
+    with pytest.raises(RateLimitExceeded) as e:
+        client.get_friends('twitterapi')
+    assert e.value.retry_after == pytest.approx(120, abs=2)
+
+    # the sync fallback is refused locally just like the async clients
+    with pytest.raises(RateLimitExceeded):
+        client.get_friends('twitterapi')
+    assert len(calls) == 1
+
+
+def test_sync_vk_client_goes_through_the_governor(monkeypatch):
+
+    class Session:
+
+        def get(self, url, **kwargs):
+            return httpx.Response(200, json={'error': {'error_code': 6}})
+
+    client = VKClient()
+    monkeypatch.setattr(client, '_get_http_session', Session)
+    with pytest.raises(RateLimitExceeded) as e:
+        client.get_user('1')
+    assert e.value.retry_after == 1
+    assert governor.wait_time(
+        RESOURCE_TYPE_VK, 'users.get', client.access_token
+    ) > 0
+
+
+def test_endpoint_returns_429_with_retry_after(monkeypatch):
+
+    async def get_user(user_id, resource_type=None):
+        raise RateLimitExceeded(retry_after=2.5)
+
+    monkeypatch.setattr(social_api, 'get_user', get_user)
+    response = TestClient(app).get('/api/v1/user/1')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '3'
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+from main import app
+from social import base as social_api
+from social.exceptions import (DeadlineExceeded, UpstreamServerError,
+                               UserDoesNotExist)
+from social.resilience import Resilience, remaining, set_deadline
+from starlette.testclient import TestClient
+
+
+def make_resilience(**kwargs):
+    params = {
+        'max_attempts': 3,
+        'backoff_base': 0.001,
+        'backoff_max': 0.01,
+        'hedge_enabled': False,
+        'hedge_min_delay': 0.01,
+        **kwargs,
+    }
+    return Resilience(**params)
+
+
+def make_fetch(results, delays=None):
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        delay = (delays or {}).get(len(calls), 0)
+        result = results[min(len(calls), len(results)) - 1]
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return fetch, calls
+
+
+def test_retries_transient_errors():
+    resilience = make_resilience()
+    fetch, calls = make_fetch([UpstreamServerError(), 'ok'])
+
+    assert asyncio.run(resilience.call('key', fetch)) == 'ok'
+    assert len(calls) == 2
+    assert resilience.stats()['retries'] == 1
+
+
+def test_gives_up_after_max_attempts():
+    resilience = make_resilience()
+    fetch, calls = make_fetch([UpstreamServerError()])
+
+    with pytest.raises(UpstreamServerError):
+        asyncio.run(resilience.call('key', fetch))
+    assert len(calls) == 3
+
+
+def test_does_not_retry_permanent_errors():
+    resilience = make_resilience()
+    fetch, calls = make_fetch([UserDoesNotExist()])
+
+    with pytest.raises(UserDoesNotExist):
+        asyncio.run(resilience.call('key', fetch))
+    assert len(calls) == 1
+
+
+def test_deadline_cuts_slow_calls():
+    resilience = make_resilience()
+    fetch, _ = make_fetch(['ok'], delays={1: 1})
+
+    async def call():
+        set_deadline(0.05)
+        return await resilience.call('key', fetch)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(call())
+    assert resilience.stats()['deadlines_exceeded'] == 1
+
+
+def test_hedge_fires_after_slow_primary():
+    resilience = make_resilience(hedge_enabled=True)
+    resilience.latencies.record('key', 0.01)
+    fetch, calls = make_fetch(['slow', 'fast'], delays={1: 1})
+
+    assert asyncio.run(resilience.call('key', fetch)) == 'fast'
+    assert len(calls) == 2
+    assert resilience.stats()['hedges'] == 1
+    assert resilience.stats()['hedge_wins'] == 1
+
+
+def test_endpoint_propagates_deadline(monkeypatch):
+    seen = []
+
+    async def get_user(user_id, resource_type=None):
+        seen.append(remaining())
+        raise DeadlineExceeded()
+
+    monkeypatch.setattr(social_api, 'get_user', get_user)
+    response = TestClient(app).get(
+        '/api/v1/user/1', headers={'X-Request-Timeout': '2'}
+    )
+    assert response.status_code == 504
+    assert 0 < seen[0] <= 2
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import os
+
+from social import base as social_api
+from social.cache import negative_cache, response_cache
+from social.constants import RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK
+from social.resolution import SourceIndex, guess_sources, source_index
+
+
+def test_guess_sources_from_id_format():
+    assert guess_sources('1') == [RESOURCE_TYPE_VK, RESOURCE_TYPE_TWITTER]
+    assert guess_sources('783214') == [
+        RESOURCE_TYPE_VK, RESOURCE_TYPE_TWITTER
+    ]
+    assert guess_sources('1323412879012345678') == [
+        RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK
+    ]
+    assert guess_sources('pavel.durov') == [RESOURCE_TYPE_VK]
+    assert guess_sources('a_very_long_screen_name') == [RESOURCE_TYPE_VK]
+    assert guess_sources('twitterapi') == [
+        RESOURCE_TYPE_VK, RESOURCE_TYPE_TWITTER
+    ]
+
+
+def test_known_source_is_asked_alone(calls):
+    assert asyncio.run(social_api.get_user('twitterapi')) == 'twitter-1'
+    assert sorted(x[0] for x in calls) == [
+        RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK
+    ]
+
+    # the negative cache would skip VK too, the index has to outlive it
+    response_cache.clear()
+    negative_cache.clear()
+    calls.clear()
+    assert asyncio.run(social_api.get_user('twitterapi')) == 'twitter-1'
+    assert [x[0] for x in calls] == [RESOURCE_TYPE_TWITTER]
+
+
+def test_falls_back_when_the_known_source_lost_the_user(users, calls):
+    asyncio.run(social_api.get_user('durov'))
+    response_cache.clear()
+    negative_cache.clear()
+    calls.clear()
+
+    users[RESOURCE_TYPE_TWITTER]['durov'] = 'twitter-durov'
+    del users[RESOURCE_TYPE_VK]['durov']
+    assert asyncio.run(social_api.get_user('durov')) == 'twitter-durov'
+    assert [x[0] for x in calls] == [
+        RESOURCE_TYPE_VK, RESOURCE_TYPE_TWITTER
+    ]
+
+    found, known = source_index.entries.get('durov')
+    assert known == (RESOURCE_TYPE_TWITTER,)
+
+
+def test_index_is_bounded_and_persisted(tmp_path):
+    path = str(tmp_path / 'sources.json')
+    index = SourceIndex(maxsize=2, ttl=60, path=path)
+    index.add('1', RESOURCE_TYPE_VK)
+    index.add('1', RESOURCE_TYPE_TWITTER)
+    index.add('2', RESOURCE_TYPE_TWITTER)
+    index.add('3', RESOURCE_TYPE_VK)
+    assert len(index.entries) == 2
+    index.save()
+
+    restored = SourceIndex(maxsize=2, ttl=60, path=path)
+    restored.load()
+    assert restored.rank('2', [RESOURCE_TYPE_VK, RESOURCE_TYPE_TWITTER]) == (
+        [RESOURCE_TYPE_TWITTER], [RESOURCE_TYPE_VK]
+    )
+    assert restored.entries.get('1') == (False, None)
+    assert 0 < restored.entries.ttl('3') <= 60
+
+
+def test_index_load_skips_malformed_and_expired_entries(tmp_path):
+    path = str(tmp_path / 'sources.json')
+    with open(path, 'w') as f:
+        json.dump([
+            ['1', [RESOURCE_TYPE_VK], 1e12],
+            ['2', [RESOURCE_TYPE_VK], 1.0],
+            ['3', 'vk'],
+            [4, [RESOURCE_TYPE_VK], 1e12],
+            ['5', ['myspace'], 1e12],
+            None,
+        ], f)
+
+    index = SourceIndex(maxsize=10, ttl=60, path=path)
+    index.load()
+    assert index.entries.get('1') == (True, (RESOURCE_TYPE_VK,))
+    assert len(index.entries) == 1
+
+    index.save()
+    assert os.listdir(str(tmp_path)) == ['sources.json']
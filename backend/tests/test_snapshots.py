@@ -0,0 +1,204 @@
+import asyncio
+
+import pytest
+from main import app
+from social import base as social_api
+from social.cache import negative_cache, response_cache
+from social.constants import RESOURCE_TYPE_TWITTER, RESOURCE_TYPE_VK
+from social.exceptions import (RateLimitExceeded, SourceUnavailable,
+                               UserDoesNotExist)
+from social.models import Article, User
+from social.resolution import source_index
+from social.snapshots import SnapshotRefresher, SnapshotStore
+from starlette.testclient import TestClient
+
+
+def user(id):
+    return User(
+        id=id, screen_name='id{}'.format(id), name='User', followers_count=0,
+        friends_count=0, image_url='', description='',
+    )
+
+
+def article(id):
+    return Article(
+        id=id, text='', likes_count=0, comments_count=0, reposts_count=0,
+        retweet_count=0, created_at=id,
+    )
+
+
+def age(store, seconds):
+    store._connection.execute(
+        'UPDATE snapshots SET fetched_at = fetched_at - ?', (seconds,)
+    )
+
+
+class FakeClient:
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+
+    async def _call(self, operation, user_id, value):
+        self.upstream['calls'].append((operation, user_id))
+        if self.upstream['down']:
+            raise SourceUnavailable()
+        if user_id != '1':
+            raise UserDoesNotExist()
+        return value
+
+    async def get_user(self, user_id):
+        return await self._call('get_user', user_id, user(1))
+
+    async def get_friends(self, user_id, count=10):
+        friends = [user(x) for x in range(2, 2 + count)]
+        return await self._call('get_friends', user_id, friends)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'snapshots.sqlite3'), retain=3600)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def upstream(monkeypatch, store):
+    upstream = {'calls': [], 'down': False}
+    monkeypatch.setattr(social_api, 'snapshots', store)
+    monkeypatch.setattr(
+        social_api.AsyncClientFactory, 'create_client',
+        lambda resource_type: FakeClient(upstream)
+    )
+    response_cache.clear()
+    negative_cache.clear()
+    source_index.clear()
+    yield upstream
+    response_cache.clear()
+    negative_cache.clear()
+    source_index.clear()
+
+
+def test_store_keeps_normalized_records(store):
+    store.put(RESOURCE_TYPE_VK, 'get_user', 'durov', None, user(1))
+    store.put(RESOURCE_TYPE_VK, 'get_articles', 'durov', 5,
+              [article(3), article(2)])
+    store.put(RESOURCE_TYPE_VK, 'get_friends', 'durov', 3,
+              [user(2), user(3), user(4)])
+    store.put(RESOURCE_TYPE_VK, 'get_friends', '5', 3,
+              [user(4), user(6), user(2)])
+
+    found, value, _ = store.get(
+        RESOURCE_TYPE_VK, 'get_user', 'durov', None, 60
+    )
+    assert found and value.id == 1
+    found, value, _ = store.get(
+        RESOURCE_TYPE_VK, 'get_articles', 'durov', 1, 60
+    )
+    assert [x.id for x in value] == [3]
+    found, value, _ = store.get(
+        RESOURCE_TYPE_VK, 'get_friends', 'durov', 2, 60
+    )
+    assert [x.id for x in value] == [2, 3]
+
+    # more than was fetched, another source, or too old
+    assert not store.get(RESOURCE_TYPE_VK, 'get_friends', 'durov', 10, 60)[0]
+    assert not store.get(RESOURCE_TYPE_TWITTER, 'get_user', 'durov', None,
+                         60)[0]
+    age(store, 120)
+    assert not store.get(RESOURCE_TYPE_VK, 'get_user', 'durov', None, 60)[0]
+
+    # list members never replace a profile of the same user
+    store.put(RESOURCE_TYPE_VK, 'get_user', '2', None, user(2))
+    member = user(2).copy(update={'name': 'Pavlom', 'followers_count': 0})
+    store.put(RESOURCE_TYPE_VK, 'get_followers', '9', 1, [member])
+    found, value, _ = store.get(RESOURCE_TYPE_VK, 'get_user', '2', None, 60)
+    assert value.name == 'User'
+
+    mutual = store.mutual(RESOURCE_TYPE_VK, 'durov', '5')
+    assert [x.id for x in mutual] == [2, 4]
+    assert store.mutual(RESOURCE_TYPE_VK, 'durov', '7') is None
+
+
+def test_cold_cache_is_filled_from_snapshots(upstream):
+    assert asyncio.run(social_api.get_user('1', RESOURCE_TYPE_VK)).id == 1
+    response_cache.clear()
+
+    # a restart: the snapshot is younger than the cache ttl
+    assert asyncio.run(social_api.get_user('1', RESOURCE_TYPE_VK)).id == 1
+    assert upstream['calls'] == [('get_user', '1')]
+
+
+def test_outage_degrades_to_stale_snapshots(upstream, store):
+    asyncio.run(social_api.get_friends('1', 3, RESOURCE_TYPE_VK))
+    response_cache.clear()
+    age(store, 3600)
+    upstream['down'] = True
+
+    friends = asyncio.run(social_api.get_friends('1', 3, RESOURCE_TYPE_VK))
+    assert [x.id for x in friends] == [2, 3, 4]
+    assert len(upstream['calls']) == 2
+
+    with pytest.raises(SourceUnavailable):
+        asyncio.run(social_api.get_user('1', RESOURCE_TYPE_VK))
+
+
+def test_refresher_renews_old_snapshots(upstream, store):
+    asyncio.run(social_api.get_user('1', RESOURCE_TYPE_VK))
+    asyncio.run(social_api.get_friends('1', 3, RESOURCE_TYPE_VK))
+    age(store, 1000)
+    requested_at = store._connection.execute(
+        'SELECT requested_at FROM snapshots ORDER BY operation'
+    ).fetchall()
+
+    refresher = SnapshotRefresher(
+        store, social_api._refresh_snapshot, batch=10, interval=1,
+        older_than=600,
+    )
+    asyncio.run(refresher.run_once())
+    assert refresher.refreshed == 2
+    assert store.stale(600, 10) == []
+    # a refresh is no request, unread snapshots still age out
+    assert store._connection.execute(
+        'SELECT requested_at FROM snapshots ORDER BY operation'
+    ).fetchall() == requested_at
+
+
+def test_throttled_source_leaves_the_other_refreshing(store):
+    for resource_type in (RESOURCE_TYPE_VK, RESOURCE_TYPE_TWITTER):
+        for user_id in ('1', '2'):
+            store.put(resource_type, 'get_user', user_id, None, user(1))
+    age(store, 1000)
+    refreshed = []
+
+    async def refresh(key):
+        if key[0] == RESOURCE_TYPE_VK:
+            raise RateLimitExceeded()
+        refreshed.append(key)
+
+    refresher = SnapshotRefresher(
+        store, refresh, batch=10, interval=1, older_than=600,
+    )
+    asyncio.run(refresher.run_once())
+    assert [x[2] for x in refreshed] == ['1', '2']
+    assert refresher.skipped == 2
+
+
+def test_endpoints_read_snapshots_within_max_age(upstream, store):
+    client = TestClient(app)
+    params = {'source': RESOURCE_TYPE_VK, 'count': 3}
+    assert client.get('/api/v1/user/1/friend', params=params).json()
+    store.put(RESOURCE_TYPE_VK, 'get_friends', '7', 3,
+              [user(3), user(9)])
+    response_cache.clear()
+    age(store, 3600)
+
+    response = client.get(
+        '/api/v1/user/1/friend', params={**params, 'max_age': 7200}
+    )
+    assert [x['id'] for x in response.json()] == [2, 3, 4]
+    assert len(upstream['calls']) == 1
+
+    response = client.get('/api/v1/user/1/friend/mutual/7', params=params)
+    assert [x['id'] for x in response.json()] == [3]
+    response = client.get('/api/v1/user/1/friend/mutual/8', params=params)
+    assert response.status_code == 404
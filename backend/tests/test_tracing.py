@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+import pytest
+from api.tracing import TracingMiddleware
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from social.async_clients import AsyncVKClient
+from social.credentials import Credential, CredentialPool
+from social.ratelimit import governor
+from social.tracing import InMemoryExporter, span, tracer
+
+VK_USER = {
+    'id': 1,
+    'first_name': 'Pavel',
+    'screen_name': 'durov',
+    'photo': 'https://vk.com/images/camera_50.png',
+}
+
+
+@pytest.fixture
+def exporter(monkeypatch):
+    exporter = InMemoryExporter()
+    monkeypatch.setattr(tracer, 'exporter', exporter)
+    monkeypatch.setattr(tracer, 'sample_rate', 1.0)
+    governor.reset()
+    return exporter
+
+
+def test_client_spans_nest_under_the_trace(exporter):
+
+    def handler(request):
+        return httpx.Response(200, json={'response': [VK_USER]})
+
+    client = AsyncVKClient(
+        session=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        credentials=CredentialPool('vkontakte', [Credential('token')], 60),
+    )
+
+    async def lookup():
+        with tracer.start_trace('GET /user'):
+            return await client.get_user('1')
+
+    assert asyncio.run(lookup()).id == 1
+
+    [spans] = exporter.traces
+    by_name = {x['name']: x for x in spans}
+    assert set(by_name) == {'GET /user', 'http', 'json.decode', 'models.parse'}
+    root = by_name['GET /user']
+    assert by_name['http']['parent_id'] == root['span_id']
+    assert by_name['http']['attributes']['status'] == 200
+    assert 'first_byte' in by_name['http']['events']
+    assert {x['trace_id'] for x in spans} == {root['trace_id']}
+
+
+def test_unsampled_traces_record_nothing(exporter, monkeypatch):
+    monkeypatch.setattr(tracer, 'sample_rate', 0.0)
+    with tracer.start_trace('root') as root:
+        with span('child') as child:
+            child.set(status=200)
+    assert root is child
+    assert list(exporter.traces) == []
+
+
+def test_errors_are_recorded_on_spans(exporter):
+    with pytest.raises(ValueError):
+        with tracer.start_trace('root'):
+            with span('child'):
+                raise ValueError()
+    [spans] = exporter.traces
+    assert [x['attributes']['error'] for x in spans] == ['ValueError'] * 2
+
+
+def test_middleware_continues_the_callers_trace(exporter):
+    app = FastAPI()
+
+    @app.get('/user/{user_id}')
+    async def get_user(user_id: str):
+        return {}
+
+    app.add_middleware(TracingMiddleware)
+    client = TestClient(app)
+
+    trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+    response = client.get('/user/1', headers={
+        'traceparent': '00-{}-00f067aa0ba902b7-01'.format(trace_id),
+    })
+    assert response.headers['x-trace-id'] == trace_id
+
+    [[root]] = exporter.traces
+    assert root['name'] == 'GET /user/{user_id}'
+    assert root['parent_id'] == '00f067aa0ba902b7'
+    assert root['attributes']['status'] == 200
+
+    response = client.get('/user/1')
+    assert len(response.headers['x-trace-id']) == 32